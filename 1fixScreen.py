@@ -37,6 +37,9 @@ from datetime import datetime
 import cv2
 import numpy as np
 
+from capture import POLICIES, open_capture
+from detections import Detections
+
 
 def create_trackbar_window(window_name, initial_low=(25, 40, 40), initial_high=(90, 255, 255)):
     cv2.namedWindow(window_name)
@@ -89,29 +92,15 @@ def detect_leaves(frame, lower_hsv, upper_hsv, min_area=500, kernel_size=5):
     # Find contours
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    detections = []
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area < min_area:
-            continue
-        x, y, w, h = cv2.boundingRect(cnt)
-        # Optionally compute solidity, aspect ratio, extent, etc.
-        rect = (x, y, w, h)
-        detections.append({'contour': cnt, 'area': area, 'rect': rect})
+    # Area, bounding rect and centroid for all contours at once, then a vectorized area filter
+    detections = Detections.from_contours(contours, min_area=min_area)
 
     return mask, detections
 
 
 def draw_detections(frame, detections, show_contours=True):
-    out = frame.copy()
-    for det in detections:
-        x, y, w, h = det['rect']
-        area = det['area']
-        cv2.rectangle(out, (x, y), (x + w, y + h), (0, 255, 0), 2)
-        cv2.putText(out, f"{int(area)}", (x, y - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        if show_contours:
-            cv2.drawContours(out, [det['contour']], -1, (0, 128, 255), 1)
-    return out
+    # Boxes and contours are drawn in one batched call each
+    return detections.draw(frame, show_contours=show_contours)
 
 
 def ensure_dir(path):
@@ -128,6 +117,8 @@ def main():
     parser.add_argument('--camera', '-c', type=int, default=0, help='Camera index (default 0)')
     parser.add_argument('--width', type=int, default=800)
     parser.add_argument('--min-area', type=int, default=800)
+    parser.add_argument('--capture-policy', choices=POLICIES, default=None,
+                        help="Frame prefetch policy (default: 'latest' for camera, 'block' for video)")
     parser.add_argument('--no-trackbar', dest='trackbar', action='store_false')
     args = parser.parse_args()
 
@@ -141,7 +132,7 @@ def main():
             print('Không chọn video → dùng camera')
             video_source = args.camera
 
-    cap = cv2.VideoCapture(video_source)
+    cap = open_capture(video_source, policy=args.capture_policy)
     if not cap.isOpened():
         print('ERROR: Cannot open video source')
         return
@@ -215,6 +206,7 @@ def main():
                 cv2.destroyWindow(trackbar_win)
                 print('Trackbar OFF')
 
+    print('Capture stats:', cap.stats())
     cap.release()
     cv2.destroyAllWindows()
 
@@ -18,6 +18,9 @@ import ctypes
 from datetime import datetime
 import os
 
+from capture import open_capture
+from detections import Detections
+
 
 def pick_video():
     root = tk.Tk(); root.withdraw()
@@ -65,23 +68,12 @@ def detect_leaves(frame, lower, upper, min_area=500):
     mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
 
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    detections = []
-    for c in contours:
-        area = cv2.contourArea(c)
-        if area < min_area:
-            continue
-        x, y, w, h = cv2.boundingRect(c)
-        detections.append((c, x, y, w, h, area))
+    detections = Detections.from_contours(contours, min_area=min_area)
     return mask, detections
 
 
 def draw_detections(img, detections):
-    out = img.copy()
-    for c, x, y, w, h, area in detections:
-        cv2.rectangle(out, (x, y), (x + w, y + h), (0, 255, 0), 2)
-        cv2.putText(out, str(int(area)), (x, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        cv2.drawContours(out, [c], -1, (0, 128, 255), 1)
-    return out
+    return detections.draw(img)
 
 
 def get_screen_resolution():
@@ -101,7 +93,7 @@ def main():
         print("Không chọn video → dùng camera")
         video = 0
 
-    cap = cv2.VideoCapture(video)
+    cap = open_capture(video)
     if not cap.isOpened():
         print("Không mở được video/camera")
         return
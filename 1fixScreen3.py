@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 
+from capture import open_capture
+
 # =========================
 # GLOBALS
 # =========================
@@ -79,7 +81,7 @@ def detect_leaf(frame):
 def main():
     global paused, show_tuner
 
-    cap = cv2.VideoCapture(0)
+    cap = open_capture(0)
     cv2.namedWindow("Leaf Detection", cv2.WINDOW_NORMAL)
     create_hsv_trackbars()
 
@@ -3,6 +3,10 @@ import numpy as np
 import tkinter as tk
 from tkinter import filedialog
 
+from capture import open_capture
+from segmentation import mean_hsv
+from tuning import ThresholdCache
+
 
 # =========================
 # GLOBAL SETTINGS
@@ -12,6 +16,10 @@ show_tuner = True
 screen_w = 1366
 screen_h = 768
 
+# HSV + per-channel masks of the paused frame, re-thresholded incrementally while tuning
+tuner = ThresholdCache()
+manual_version = None  # mask version shown in "Manual Detection", None = window not open
+
 
 # =========================
 # TẠO TRACKBARS
@@ -34,14 +42,15 @@ def create_hsv_trackbars():
 # =========================
 def on_mouse(event, x, y, flags, frame):
     if event == cv2.EVENT_LBUTTONDOWN:
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        hsv = tuner.hsv(frame)
         region = hsv[max(0, y-2):y+3, max(0, x-2):x+3]
-        h, s, v = np.mean(region.reshape(-1, 3), axis=0).astype(int)
+        h, s, v = mean_hsv(region)
 
         print(f"[CLICK HSV] H={h}, S={s}, V={v}")
 
-        cv2.setTrackbarPos("H_low",  "HSV Tuner", max(0, h - 15))
-        cv2.setTrackbarPos("H_high", "HSV Tuner", min(179, h + 15))
+        # Hue is circular: near red (0/179) the range wraps, H_low > H_high
+        cv2.setTrackbarPos("H_low",  "HSV Tuner", (h - 15) % 180)
+        cv2.setTrackbarPos("H_high", "HSV Tuner", (h + 15) % 180)
 
         cv2.setTrackbarPos("S_low",  "HSV Tuner", max(0, s - 60))
         cv2.setTrackbarPos("S_high", "HSV Tuner", min(255, s + 60))
@@ -55,9 +64,7 @@ def on_mouse(event, x, y, flags, frame):
 # =========================
 # NHẬN DIỆN LÁ
 # =========================
-def detect_leaf(frame):
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-
+def get_hsv_bounds():
     h_low = cv2.getTrackbarPos("H_low", "HSV Tuner")
     h_high = cv2.getTrackbarPos("H_high", "HSV Tuner")
     s_low = cv2.getTrackbarPos("S_low", "HSV Tuner")
@@ -67,8 +74,12 @@ def detect_leaf(frame):
 
     lower = np.array([h_low, s_low, v_low])
     upper = np.array([h_high, s_high, v_high])
+    return lower, upper
 
-    mask = cv2.inRange(hsv, lower, upper)
+
+def detect_leaf(frame):
+    lower, upper = get_hsv_bounds()
+    mask = tuner.mask(frame, lower, upper)
     result = cv2.bitwise_and(frame, frame, mask=mask)
 
     return result, mask
@@ -90,17 +101,17 @@ def choose_video_source():
 
     if video_path:
         print("[SOURCE] Video:", video_path)
-        return cv2.VideoCapture(video_path)
+        return open_capture(video_path)
 
     print("[SOURCE] Camera (0)")
-    return cv2.VideoCapture(0)  # mặc định camera 0
+    return open_capture(0)  # mặc định camera 0
 
 
 # =========================
 # MAIN LOOP
 # =========================
 def main():
-    global paused, show_tuner
+    global paused, show_tuner, manual_version
 
     cap = choose_video_source()
     cv2.namedWindow("Leaf Detection", cv2.WINDOW_NORMAL)
@@ -125,6 +136,15 @@ def main():
         if show_tuner:
             cv2.imshow("HSV Tuner", np.zeros((200, 500, 3), dtype=np.uint8))
 
+        if paused and manual_version is not None:
+            # Paused: keep the manual detection live, redraw only when the mask changed
+            tuner.mask(frame, *get_hsv_bounds())
+            if tuner.version != manual_version:
+                result, mask = detect_leaf(frame)
+                cv2.imshow("Manual Detection", result)
+                cv2.imshow("Mask", mask)
+                manual_version = tuner.version
+
         # Nhận phím từ bất kỳ cửa sổ nào đang focus
         key = cv2.waitKey(1) & 0xFF
 
@@ -152,6 +172,7 @@ def main():
             result, mask = detect_leaf(frame)
             cv2.imshow("Manual Detection", result)
             cv2.imshow("Mask", mask)
+            manual_version = tuner.version
 
         if key == ord('s'):
             cv2.imwrite("leaf_frame.jpg", frame)
@@ -3,12 +3,20 @@ import numpy as np
 import tkinter as tk
 from tkinter import filedialog
 
+from capture import open_capture
+from segmentation import mean_hsv
+from tuning import ThresholdCache
+
 
 paused = False
 cap = None
 current_frame = None
 show_tuner = True
 
+# HSV + per-channel masks of the paused frame, re-thresholded incrementally while tuning
+tuner = ThresholdCache()
+manual_version = None  # mask version shown in "Manual Detection", None = window not open
+
 
 # =========================
 # HSV TRACKBARS
@@ -28,12 +36,13 @@ def create_hsv_trackbars():
 # =========================
 def on_mouse(event, x, y, flags, frame):
     if event == cv2.EVENT_LBUTTONDOWN:
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        hsv = tuner.hsv(frame)
         region = hsv[max(0, y-2):y+3, max(0, x-2):x+3]
-        h, s, v = np.mean(region.reshape(-1, 3), axis=0).astype(int)
+        h, s, v = mean_hsv(region)
 
-        cv2.setTrackbarPos("H_low", "HSV Tuner", max(0, h - 15))
-        cv2.setTrackbarPos("H_high", "HSV Tuner", min(179, h + 15))
+        # Hue is circular: near red (0/179) the range wraps, H_low > H_high
+        cv2.setTrackbarPos("H_low", "HSV Tuner", (h - 15) % 180)
+        cv2.setTrackbarPos("H_high", "HSV Tuner", (h + 15) % 180)
         cv2.setTrackbarPos("S_low", "HSV Tuner", max(0, s - 60))
         cv2.setTrackbarPos("S_high", "HSV Tuner", min(255, s + 60))
         cv2.setTrackbarPos("V_low", "HSV Tuner", max(0, v - 60))
@@ -45,9 +54,7 @@ def on_mouse(event, x, y, flags, frame):
 # =========================
 # LEAF DETECTION
 # =========================
-def detect_leaf(frame):
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-
+def get_hsv_bounds():
     h_low = cv2.getTrackbarPos("H_low", "HSV Tuner")
     h_high = cv2.getTrackbarPos("H_high", "HSV Tuner")
     s_low = cv2.getTrackbarPos("S_low", "HSV Tuner")
@@ -57,8 +64,12 @@ def detect_leaf(frame):
 
     lower = np.array([h_low, s_low, v_low])
     upper = np.array([h_high, s_high, v_high])
+    return lower, upper
+
 
-    mask = cv2.inRange(hsv, lower, upper)
+def detect_leaf(frame):
+    lower, upper = get_hsv_bounds()
+    mask = tuner.mask(frame, lower, upper)
     result = cv2.bitwise_and(frame, frame, mask=mask)
     return result, mask
 
@@ -68,15 +79,17 @@ def detect_leaf(frame):
 # =========================
 def select_video():
     global cap
+    if cap is not None:
+        cap.release()
     path = filedialog.askopenfilename(
         title="Select Video",
         filetypes=[("Video Files", "*.mp4 *.avi *.mkv")]
     )
     if path:
-        cap = cv2.VideoCapture(path)
+        cap = open_capture(path)
         print("[SOURCE] Using selected video")
     else:
-        cap = cv2.VideoCapture(0)
+        cap = open_capture(0)
         print("[SOURCE] Using Camera")
 
 
@@ -87,13 +100,14 @@ def toggle_pause():
 
 
 def manual_detect():
-    global current_frame
+    global current_frame, manual_version
     if current_frame is None:
         print("No frame available")
         return
     result, mask = detect_leaf(current_frame)
     cv2.imshow("Manual Detection", result)
     cv2.imshow("Mask", mask)
+    manual_version = tuner.version
     print("[MANUAL DETECT DONE]")
 
 
@@ -107,7 +121,7 @@ def quit_app():
 # MAIN LOOP (RUNS VIA TKINTER)
 # =========================
 def update_video():
-    global current_frame
+    global current_frame, manual_version
 
     if cap is not None and not paused:
         ret, frame = cap.read()
@@ -115,10 +129,18 @@ def update_video():
             current_frame = frame.copy()
 
             cv2.namedWindow("Leaf Detection", cv2.WINDOW_NORMAL)
-            cv2.setMouseCallback("Leaf Detection", on_mouse, frame)
+            cv2.setMouseCallback("Leaf Detection", on_mouse, current_frame)
             cv2.imshow("Leaf Detection", frame)
         else:
             print("[END OF VIDEO]")
+    elif paused and current_frame is not None and manual_version is not None:
+        # Paused: keep the manual detection live, redraw only when the mask changed
+        tuner.mask(current_frame, *get_hsv_bounds())
+        if tuner.version != manual_version:
+            result, mask = detect_leaf(current_frame)
+            cv2.imshow("Manual Detection", result)
+            cv2.imshow("Mask", mask)
+            manual_version = tuner.version
 
     root.after(10, update_video)
 
@@ -3,6 +3,9 @@ import numpy as np
 import tkinter as tk
 from tkinter import filedialog
 
+from capture import open_capture
+from detections import Detections
+
 paused = False
 cap = None
 current_frame = None
@@ -62,13 +65,11 @@ def detect_leaf(frame):
     # ------------ NEW: Bounding box ------------
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    result = frame.copy()
-
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area > 500:  # chỉ lấy vùng đủ lớn
-            x, y, w, h = cv2.boundingRect(cnt)
-            cv2.rectangle(result, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    # chỉ lấy vùng đủ lớn
+    detections = Detections.from_contours(contours)
+    # The original loop kept `area > 500`; min_area would also keep exactly 500
+    detections = detections.filter(detections.areas > 500)
+    result = detections.draw(frame, show_contours=False, show_area=False)
 
     return result, mask
 
@@ -78,15 +79,17 @@ def detect_leaf(frame):
 # =========================
 def select_video():
     global cap
+    if cap is not None:
+        cap.release()
     path = filedialog.askopenfilename(
         title="Select Video",
         filetypes=[("Video Files", "*.mp4 *.avi *.mkv")]
     )
     if path:
-        cap = cv2.VideoCapture(path)
+        cap = open_capture(path)
         print("[SOURCE] Using selected video")
     else:
-        cap = cv2.VideoCapture(0)
+        cap = open_capture(0)
         print("[SOURCE] Using Camera")
 
 
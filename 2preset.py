@@ -2,9 +2,14 @@ import cv2
 import numpy as np
 import tkinter as tk
 from tkinter import filedialog
-import json
 import os
 
+from capture import open_capture
+from detections import Detections
+from preset_store import HSV_KEYS, PresetStore
+from segmentation import mean_hsv
+from tuning import ThresholdCache
+
 # =============================
 # GLOBAL VARIABLES
 # =============================
@@ -13,9 +18,16 @@ cap = None
 current_frame = None
 
 preset_path = None
+# SQLite preset database; presets are tagged with the video / camera they were tuned on
+preset_store = None
+source_name = ""
 loaded_preset_name = ""
 loaded_preset_count = 0
 
+# HSV + per-channel masks of the current frame, re-thresholded incrementally while tuning
+tuner = ThresholdCache()
+shown_version = -1
+
 
 # =============================
 # HSV TRACKBARS
@@ -35,12 +47,13 @@ def create_hsv_trackbars():
 # =============================
 def on_mouse(event, x, y, flags, frame):
     if event == cv2.EVENT_LBUTTONDOWN:
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        hsv = tuner.hsv(frame)
         region = hsv[max(0, y - 2):y + 3, max(0, x - 2):x + 3]
-        h, s, v = np.mean(region.reshape(-1, 3), axis=0).astype(int)
+        h, s, v = mean_hsv(region)
 
-        cv2.setTrackbarPos("H_low", "HSV Tuner", max(0, h - 15))
-        cv2.setTrackbarPos("H_high", "HSV Tuner", min(179, h + 15))
+        # Hue is circular: near red (0/179) the range wraps, H_low > H_high
+        cv2.setTrackbarPos("H_low", "HSV Tuner", (h - 15) % 180)
+        cv2.setTrackbarPos("H_high", "HSV Tuner", (h + 15) % 180)
         cv2.setTrackbarPos("S_low", "HSV Tuner", max(0, s - 60))
         cv2.setTrackbarPos("S_high", "HSV Tuner", min(255, s + 60))
         cv2.setTrackbarPos("V_low", "HSV Tuner", max(0, v - 60))
@@ -52,9 +65,7 @@ def on_mouse(event, x, y, flags, frame):
 # =============================
 # LEAF DETECTION + BOUNDING BOX
 # =============================
-def detect_leaf(frame):
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-
+def get_hsv_bounds():
     h_low = cv2.getTrackbarPos("H_low", "HSV Tuner")
     h_high = cv2.getTrackbarPos("H_high", "HSV Tuner")
     s_low = cv2.getTrackbarPos("S_low", "HSV Tuner")
@@ -64,17 +75,18 @@ def detect_leaf(frame):
 
     lower = np.array([h_low, s_low, v_low])
     upper = np.array([h_high, s_high, v_high])
+    return lower, upper
 
-    mask = cv2.inRange(hsv, lower, upper)
-    result = frame.copy()
 
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+def detect_leaf(frame):
+    lower, upper = get_hsv_bounds()
+    mask = tuner.mask(frame, lower, upper)
 
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area > 500:
-            x, y, w, h = cv2.boundingRect(cnt)
-            cv2.rectangle(result, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    detections = Detections.from_contours(contours)
+    # The original loop kept `area > 500`; min_area would also keep exactly 500
+    detections = detections.filter(detections.areas > 500)
+    result = detections.draw(frame, show_contours=False, show_area=False)
 
     return result, mask
 
@@ -82,84 +94,83 @@ def detect_leaf(frame):
 # =============================
 # SAVE PRESET (append nhiều detect)
 # =============================
+def open_preset_store(path):
+    global preset_store, preset_path
+    if preset_store is not None:
+        preset_store.close()
+    preset_path = path
+    preset_store = PresetStore(path)
+
+
 def save_preset():
-    global preset_path, loaded_preset_name, loaded_preset_count
+    global loaded_preset_name, loaded_preset_count
 
-    if preset_path is None:
-        preset_path = filedialog.asksaveasfilename(
+    if preset_store is None:
+        path = filedialog.asksaveasfilename(
             title="Save Preset As",
-            defaultextension=".json",
-            filetypes=[("JSON files", "*.json")]
+            defaultextension=".db",
+            filetypes=[("Preset database", "*.db")]
         )
-        if not preset_path:
+        if not path:
             return
+        open_preset_store(path)
 
-    hsv_values = {
-        "H_low": cv2.getTrackbarPos("H_low", "HSV Tuner"),
-        "H_high": cv2.getTrackbarPos("H_high", "HSV Tuner"),
-        "S_low": cv2.getTrackbarPos("S_low", "HSV Tuner"),
-        "S_high": cv2.getTrackbarPos("S_high", "HSV Tuner"),
-        "V_low": cv2.getTrackbarPos("V_low", "HSV Tuner"),
-        "V_high": cv2.getTrackbarPos("V_high", "HSV Tuner")
-    }
-
-    if not os.path.exists(preset_path):
-        data = {"presets": [hsv_values]}
-    else:
-        with open(preset_path, "r") as f:
-            data = json.load(f)
-        data["presets"].append(hsv_values)
+    hsv_values = {key: cv2.getTrackbarPos(key, "HSV Tuner") for key in HSV_KEYS}
 
-    with open(preset_path, "w") as f:
-        json.dump(data, f, indent=4)
+    # One appended row per save: no re-read / re-write of the earlier presets
+    name = preset_name_var.get().strip() or "default"
+    preset_store.save(hsv_values, name=name, camera=source_name)
 
     loaded_preset_name = os.path.basename(preset_path)
-    loaded_preset_count = len(data["presets"])
+    loaded_preset_count = preset_store.count()
 
     update_preset_label()
-    print(f"[Preset Saved] Total detects: {loaded_preset_count}")
+    print(f"[Preset Saved] '{name}' — total detects: {loaded_preset_count}")
 
 
 # =============================
 # LOAD PRESET
 # =============================
 def load_preset():
-    global preset_path, loaded_preset_name, loaded_preset_count
+    global loaded_preset_name, loaded_preset_count
 
-    preset_path = filedialog.askopenfilename(
+    path = filedialog.askopenfilename(
         title="Select Preset",
-        filetypes=[("JSON files", "*.json")]
+        filetypes=[("Preset database", "*.db"), ("Old JSON presets", "*.json")]
     )
 
-    if not preset_path:
+    if not path:
         return
 
     try:
-        with open(preset_path, "r") as f:
-            data = json.load(f)
-
-        presets = data.get("presets", [])
-        if not presets:
+        if path.lower().endswith(".json"):
+            # Old JSON preset file: migrate once into a database next to it
+            db_path = os.path.splitext(path)[0] + ".db"
+            migrate = not os.path.exists(db_path)
+            open_preset_store(db_path)
+            if migrate:
+                print(f"[Preset] Imported {preset_store.import_json(path)} presets -> {db_path}")
+        else:
+            open_preset_store(path)
+
+        # Latest preset tuned on this source, else the latest overall
+        latest = preset_store.latest(camera=source_name) or preset_store.latest()
+        if latest is None:
             print("[Preset] File empty")
             return
 
-        latest = presets[-1]
-
-        cv2.setTrackbarPos("H_low", "HSV Tuner", latest["H_low"])
-        cv2.setTrackbarPos("H_high", "HSV Tuner", latest["H_high"])
-        cv2.setTrackbarPos("S_low", "HSV Tuner", latest["S_low"])
-        cv2.setTrackbarPos("S_high", "HSV Tuner", latest["S_high"])
-        cv2.setTrackbarPos("V_low", "HSV Tuner", latest["V_low"])
-        cv2.setTrackbarPos("V_high", "HSV Tuner", latest["V_high"])
+        for key in HSV_KEYS:
+            cv2.setTrackbarPos(key, "HSV Tuner", latest[key])
+        preset_name_var.set(latest["name"])
 
         loaded_preset_name = os.path.basename(preset_path)
-        loaded_preset_count = len(presets)
+        loaded_preset_count = preset_store.count()
 
         update_preset_label()
         print(f"[Preset Loaded] {loaded_preset_name} — {loaded_preset_count} detects")
 
-    except:
-        print("[Preset Error] Invalid file")
+    except Exception as exc:
+        print(f"[Preset Error] Invalid file: {exc}")
 
 
 # =============================
@@ -179,16 +190,20 @@ def update_preset_label():
 # VIDEO SOURCE
 # =============================
 def select_video():
-    global cap
+    global cap, source_name
+    if cap is not None:
+        cap.release()
     path = filedialog.askopenfilename(
         title="Select Video",
         filetypes=[("Video Files", "*.mp4 *.avi *.mkv")]
     )
     if path:
-        cap = cv2.VideoCapture(path)
+        cap = open_capture(path)
+        source_name = os.path.basename(path)
         print("[SOURCE] Video loaded")
     else:
-        cap = cv2.VideoCapture(0)
+        cap = open_capture(0)
+        source_name = "camera0"
         print("[SOURCE] Camera loaded")
 
 
@@ -215,6 +230,8 @@ def manual_detect():
 
 
 def quit_app():
+    if preset_store is not None:
+        preset_store.close()
     root.destroy()
     cv2.destroyAllWindows()
     exit()
@@ -223,6 +240,16 @@ def quit_app():
 # =============================
 # MAIN LOOP
 # =============================
+def show_detection(frame):
+    global shown_version
+    detected, _ = detect_leaf(frame)
+    shown_version = tuner.version
+
+    cv2.namedWindow("Leaf Detection", cv2.WINDOW_NORMAL)
+    cv2.setMouseCallback("Leaf Detection", on_mouse, frame)
+    cv2.imshow("Leaf Detection", detected)
+
+
 def update_video():
     global current_frame
 
@@ -230,12 +257,12 @@ def update_video():
         ret, frame = cap.read()
         if ret:
             current_frame = frame.copy()
-
-            detected, _ = detect_leaf(frame)
-
-            cv2.namedWindow("Leaf Detection", cv2.WINDOW_NORMAL)
-            cv2.setMouseCallback("Leaf Detection", on_mouse, frame)
-            cv2.imshow("Leaf Detection", detected)
+            show_detection(current_frame)
+    elif paused and current_frame is not None:
+        # Paused: only the trackbars change; redraw only when the (incrementally updated) mask did
+        tuner.mask(current_frame, *get_hsv_bounds())
+        if tuner.version != shown_version:
+            show_detection(current_frame)
 
     root.after(10, update_video)
 
@@ -250,6 +277,11 @@ tk.Button(root, text="Select Video / Camera", command=select_video, width=25).pa
 tk.Button(root, text="Pause / Resume", command=toggle_pause, width=25).pack(pady=5)
 tk.Button(root, text="Manual Detect", command=manual_detect, width=25).pack(pady=5)
 
+# Name / label of the saved presets (e.g. green, yellow, brown): main.py --preset-names picks them by name
+tk.Label(root, text="Preset name").pack()
+preset_name_var = tk.StringVar(value="default")
+tk.Entry(root, textvariable=preset_name_var, width=27).pack(pady=2)
+
 tk.Button(root, text="Save Preset", command=save_preset, width=25).pack(pady=5)
 tk.Button(root, text="Load Preset", command=load_preset, width=25).pack(pady=5)
 
@@ -0,0 +1,148 @@
+"""
+Lighting-compensated HSV thresholds for changing (outdoor) light.
+
+The thresholds are tuned once (trackbars, presets) for the light at that
+moment; when a cloud passes or the sun moves, V and S of the whole scene
+shift and the fixed bounds start losing leaves. AdaptiveThresholds follows
+the scene instead of re-tuning by hand:
+
+- every frame adds a decimated sample (every `step`-th pixel in both
+  directions, at an offset that rotates from frame to frame, so all pixels
+  are visited over step**2 frames) to running S and V histograms that
+  decay by `decay` per frame; with step=8 that is ~7500 pixels at 800x600,
+  a few hundredths of a millisecond
+- every `every` frames the S and V medians (`percentile`) are read from the
+  histograms and compared with the reference taken when the thresholds were
+  set: S bounds shift by the difference (clamped to +-max_s_shift), V bounds
+  scale by the ratio (light is multiplicative, clamped to v_ratio); bounds
+  at 0 / 255 stay open
+- optional gray-world gain: per-channel gains that bring the running B, G, R
+  means back to the reference means (white balance + exposure), applied to
+  the frame with one cv2.multiply; the histograms are then taken from the
+  normalized sample, so the S / V shift only covers what the gain did not
+
+The reference is taken from the running state whenever the base thresholds
+change (rebase()), i.e. the bounds the operator just set are exact for the
+current light. Hue is left alone: it does not move with exposure.
+
+Usage:
+    adaptive = AdaptiveThresholds(every=15, gain=True)
+    for frame in frames:
+        lower, upper = adaptive.update(frame, base_lower, base_upper)   # the raw frame
+        frame = adaptive.normalize(frame)     # only with gain=True
+        mask = segment_leaves(frame, lower, upper)
+"""
+
+import cv2
+import numpy as np
+
+
+class AdaptiveThresholds:
+    """Running S/V histograms that shift a base HSV range with the scene lighting."""
+
+    def __init__(self, every=15, step=8, decay=0.95, percentile=50, max_s_shift=40, v_ratio=(0.5, 2.0),
+                 gain=False, gain_limits=(0.5, 2.0)):
+        self.every = max(1, every)
+        self.step = max(1, step)
+        self.decay = decay
+        self.percentile = percentile
+        self.max_s_shift = max_s_shift
+        self.v_ratio = v_ratio
+        self.gain = gain
+        self.gain_limits = gain_limits
+        self.frames = 0
+        self.updates = 0
+        self._s_hist = np.zeros(256, dtype=np.float64)
+        self._v_hist = np.zeros(256, dtype=np.float64)
+        self._bgr_mean = None
+        self._base = None
+        self._ref = None
+        # Current correction: S offset, V factor, per-channel BGR gains
+        self.s_shift = 0
+        self.v_scale = 1.0
+        self.gains = np.ones(3)
+        self._bounds = None
+
+    def _sample(self, frame):
+        # Rotating decimation offset: frame k samples phase k of the step x step grid
+        phase = self.frames % (self.step * self.step)
+        oy, ox = divmod(phase, self.step)
+        return np.ascontiguousarray(frame[oy::self.step, ox::self.step])
+
+    def observe(self, frame):
+        """Add one frame's decimated sample to the running histograms."""
+        sample = self._sample(frame)
+        self.frames += 1
+        mean = np.array(cv2.mean(sample)[:3])
+        if self._bgr_mean is None:
+            self._bgr_mean = mean
+        else:
+            self._bgr_mean = self.decay * self._bgr_mean + (1.0 - self.decay) * mean
+        if self.gain:
+            sample = cv2.multiply(sample, tuple(self.gains.tolist()) + (0.0,))
+        hsv = cv2.cvtColor(sample, cv2.COLOR_BGR2HSV)
+        self._s_hist *= self.decay
+        self._v_hist *= self.decay
+        self._s_hist += cv2.calcHist([hsv], [1], None, [256], [0, 256]).ravel()
+        self._v_hist += cv2.calcHist([hsv], [2], None, [256], [0, 256]).ravel()
+
+    def _level(self, hist):
+        cdf = np.cumsum(hist)
+        return int(np.searchsorted(cdf, cdf[-1] * self.percentile / 100.0))
+
+    def rebase(self, lower, upper):
+        """New base thresholds: they are taken as exact for the current light."""
+        self._base = (np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8))
+        self._ref = None
+        if self.frames:
+            self._take_reference()
+        self._bounds = self._base
+
+    def _take_reference(self):
+        # Current gain stays in effect; the S/V correction starts over from here
+        self._ref = (self._level(self._s_hist), max(1, self._level(self._v_hist)), self._bgr_mean * self.gains)
+        self.s_shift, self.v_scale = 0, 1.0
+
+    def _recompute(self):
+        if self._ref is None:
+            self._take_reference()
+            return
+        s_ref, v_ref, bgr_ref = self._ref
+        if self.gain:
+            lo, hi = self.gain_limits
+            self.gains = np.clip(bgr_ref / np.maximum(self._bgr_mean, 1.0), lo, hi)
+        self.s_shift = int(np.clip(self._level(self._s_hist) - s_ref, -self.max_s_shift, self.max_s_shift))
+        self.v_scale = float(np.clip(self._level(self._v_hist) / float(v_ref), *self.v_ratio))
+        self.updates += 1
+
+        lower, upper = (b.astype(np.float64) for b in self._base)
+        new_lower, new_upper = lower.copy(), upper.copy()
+        # Open ends (0 / 255) stay open, so a range never closes on the bright / saturated side
+        for bounds, new in ((lower, new_lower), (upper, new_upper)):
+            if 0 < bounds[1] < 255:
+                new[1] = bounds[1] + self.s_shift
+            if 0 < bounds[2] < 255:
+                new[2] = bounds[2] * self.v_scale
+        self._bounds = (np.clip(np.round(new_lower), 0, 255).astype(np.uint8),
+                        np.clip(np.round(new_upper), 0, 255).astype(np.uint8))
+
+    def update(self, frame, lower, upper):
+        """Observe `frame` and return the adapted (lower, upper) for the base range (lower, upper)."""
+        if self._base is None or not (np.array_equal(lower, self._base[0]) and np.array_equal(upper, self._base[1])):
+            self.rebase(lower, upper)
+        self.observe(frame)
+        if self.frames % self.every == 0:
+            self._recompute()
+        return self._bounds
+
+    def normalize(self, frame, dst=None):
+        """Frame with the current gray-world gains applied (the frame itself while gain is off or neutral)."""
+        if not self.gain or np.allclose(self.gains, 1.0, atol=1e-3):
+            return frame
+        return cv2.multiply(frame, tuple(self.gains.tolist()) + (0.0,), dst=dst)
+
+    def describe(self):
+        text = f'S{self.s_shift:+d} Vx{self.v_scale:.2f}'
+        if self.gain:
+            text += ' gain ' + '/'.join(f'{g:.2f}' for g in self.gains)
+        return text
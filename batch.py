@@ -0,0 +1,201 @@
+"""
+Headless batch leaf detection over whole video files.
+
+Features:
+- No windows, trackbars or key handling: runs on servers / over SSH
+- Splits the video into contiguous frame-range shards
+- Each worker process opens its own decoder and runs
+  preprocess_frame + detect_leaves on its shards
+- Per-frame detections are merged back in frame order into one output file
+  (JSONL, or fixed-width binary records for .ldet, see detection_log.py)
+- Prints a frames/sec summary at the end
+
+Usage:
+    python batch.py field.mp4 -o detections.jsonl
+    python batch.py field.mp4 -o detections.jsonl --workers 8 --min-area 800
+    python batch.py field.mp4 -o detections.jsonl --presets presets.db   # every saved preset, one pass
+    python batch.py field.mp4 -o detections.jsonl --calibration rig.json   # + world positions (calibration.py)
+    python main.py --video field.mp4 --headless detections.jsonl
+
+Output (JSONL): one JSON object per frame, timestamps are video time in seconds, e.g.
+    {"frame": 12, "ts": 0.4, "detections": [{"rect": [x, y, w, h], "centroid": [cx, cy], "area": 1534.0}]}
+    (with --track every detection also has a persistent "id", with --presets the index of the
+    matching "preset", with --calibration "world" [x, y] and "world_area" in calibration units)
+"""
+
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+from calibration import Calibration
+from detection_log import open_sink
+from main import detect_leaves, preprocess_frame
+from preset_store import load_preset_set
+from segmentation import LUTSegmenter
+from tracker import LeafTracker
+
+DEFAULT_LOWER = (25, 40, 40)
+DEFAULT_UPPER = (95, 255, 255)
+
+
+def parse_hsv(text):
+    values = [int(v) for v in text.split(',')]
+    if len(values) != 3:
+        raise argparse.ArgumentTypeError(f'Expected H,S,V but got {text!r}')
+    return tuple(values)
+
+
+def probe_video(path):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return None, None
+    n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return max(n, 0), (fps if fps > 0 else 30.0)
+
+
+def make_shards(total_frames, workers, shards_per_worker=4):
+    # A few shards per worker keeps the pool busy when shards decode at different speeds
+    if not total_frames:
+        return [(0, None)]
+    n_shards = max(1, min(total_frames, workers * shards_per_worker))
+    bounds = np.linspace(0, total_frames, n_shards + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def _open_at(path, start):
+    cap = cv2.VideoCapture(path)
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        # Some codecs seek to the previous keyframe only; fall back to decoding forward
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start:
+            cap.release()
+            cap = cv2.VideoCapture(path)
+            for _ in range(start):
+                if not cap.grab():
+                    break
+    return cap
+
+
+def _init_worker():
+    # One decoder per process; keep OpenCV from spawning its own threads on top
+    cv2.setNumThreads(1)
+
+
+def _warm_calibration(video, path, width):
+    # Build the pixel -> world table for the processing size once, before the workers start
+    cap = cv2.VideoCapture(video)
+    w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    if w and h:
+        size = (width, int(h * width / float(w))) if width is not None else (w, h)
+        Calibration.load(path).table(size)
+
+
+def process_shard(task):
+    path, start, end, fps, lower, upper, width, min_area, ranges, calibration = task
+    lower = np.array(lower, dtype=np.uint8)
+    upper = np.array(upper, dtype=np.uint8)
+    # A preset set goes through one colour table, so its cost does not grow with the number of presets
+    segmenter = LUTSegmenter() if ranges else None
+    # The world table was built (and cached to disk) by run_batch, workers only load it
+    calibration = Calibration.load(calibration) if calibration else None
+
+    cap = _open_at(path, start)
+    results = []
+    idx = start
+    while end is None or idx < end:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_proc = preprocess_frame(frame, width=width)
+        _, detections = detect_leaves(frame_proc, lower, upper, min_area=min_area, segmenter=segmenter,
+                                      ranges=ranges, calibration=calibration)
+        results.append((idx, idx / fps, detections))
+        idx += 1
+    cap.release()
+    return results
+
+
+def run_batch(video, output, lower=DEFAULT_LOWER, upper=DEFAULT_UPPER, width=800, min_area=800,
+              workers=None, contour_epsilon=None, track=False, ranges=None, calibration=None):
+    workers = workers or os.cpu_count() or 1
+    total, fps = probe_video(video)
+    if total is None:
+        print('ERROR: Cannot open video source')
+        return None
+
+    shards = make_shards(total, workers)
+    if ranges:
+        ranges = [(tuple(int(v) for v in lo), tuple(int(v) for v in hi)) for lo, hi in ranges]
+    if calibration:
+        _warm_calibration(video, calibration, width)
+    tasks = [(video, a, b, fps, tuple(lower), tuple(upper), width, min_area, ranges, calibration)
+             for a, b in shards]
+    print(f'Processing {total or "unknown"} frames in {len(shards)} shards on {workers} workers')
+
+    t0 = time.perf_counter()
+    n_frames = 0
+    n_detections = 0
+    sink = open_sink(output, contour_epsilon=contour_epsilon)
+    # Shards are merged in frame order, so tracking runs here on the merged stream
+    tracker = LeafTracker() if track else None
+    with Pool(workers, initializer=_init_worker) as pool:
+        # imap yields shard results in submission order, so frames stay ordered
+        for records in pool.imap(process_shard, tasks):
+            for idx, ts, detections in records:
+                if tracker is not None:
+                    detections = tracker.update(detections)
+                sink.write(idx, detections, ts)
+                n_detections += len(detections)
+            n_frames += len(records)
+    sink.close()
+    elapsed = time.perf_counter() - t0
+
+    fps = n_frames / elapsed if elapsed > 0 else 0.0
+    print(f'Done: {n_frames} frames, {n_detections} detections in {elapsed:.2f}s '
+          f'({fps:.1f} frames/sec, {workers} workers) -> {output}')
+    return {'frames': n_frames, 'detections': n_detections, 'seconds': elapsed, 'fps': fps}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless batch leaf detection over a video file')
+    parser.add_argument('video', help='Path to video file')
+    parser.add_argument('--output', '-o', default='detections.jsonl', help='Output file (.jsonl or binary .ldet)')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--width', type=int, default=800, help='Resize width for processing')
+    parser.add_argument('--min-area', type=int, default=800, help='Minimum contour area to keep')
+    parser.add_argument('--lower', type=parse_hsv, default=DEFAULT_LOWER, help='Lower HSV bound, e.g. 25,40,40')
+    parser.add_argument('--upper', type=parse_hsv, default=DEFAULT_UPPER, help='Upper HSV bound, e.g. 95,255,255')
+    parser.add_argument('--contours', type=float, default=None, metavar='EPS',
+                        help='Include contours simplified with approxPolyDP(EPS) in JSONL output')
+    parser.add_argument('--track', action='store_true', help='Assign persistent leaf IDs across frames')
+    parser.add_argument('--presets', metavar='DB', help='Detect with the saved presets of a 2preset.py database')
+    parser.add_argument('--preset-names', nargs='+', metavar='NAME',
+                        help='Presets to use, latest of each name (default: every saved range)')
+    parser.add_argument('--calibration', metavar='JSON', help='Add world positions (calibration.py file)')
+    args = parser.parse_args()
+
+    ranges = None
+    if args.presets:
+        if not os.path.exists(args.presets):
+            print(f'ERROR: preset database not found: {args.presets}')
+            return
+        labels, ranges = load_preset_set(args.presets, args.preset_names)
+        if not ranges:
+            print(f'ERROR: no matching presets in {args.presets}')
+            return
+        print('Presets:', ', '.join(f'{i}={label}' for i, label in enumerate(labels)))
+
+    run_batch(args.video, args.output, lower=args.lower, upper=args.upper, width=args.width,
+              min_area=args.min_area, workers=args.workers, contour_epsilon=args.contours,
+              track=args.track, ranges=ranges, calibration=args.calibration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,615 @@
+"""
+Benchmarks for the leaf detection pipeline.
+
+Runs headless on synthetic frames (or a recorded clip), no camera or display needed.
+
+Usage:
+    python benchmark.py pipeline                   # preprocess / detect / draw + end-to-end
+    python benchmark.py pipeline --sizes 640x480 1920x1080 --leaves 10 100 --noise 4 16
+    python benchmark.py pipeline --clip field.mp4 --json after.json
+    python benchmark.py compare before.json after.json
+    python benchmark.py buffers                    # allocations per frame with / without BufferPool
+    python benchmark.py tuning --sizes 3840x2160   # trackbar drag on a paused frame
+    python benchmark.py segmentation               # LUT vs cvtColor+inRange
+    python benchmark.py segmentation --sizes 800x600 3840x2160 --ranges 1 4
+    python benchmark.py blobs                      # findContours vs connected components
+    python benchmark.py pyramid                    # full-resolution vs pyramid segmentation
+    python benchmark.py tiles --tiles 4 8 16       # untiled vs parallel banded segmentation
+    python benchmark.py bus --modes threads processes   # per-topic latency / throughput of bus.py
+"""
+
+import argparse
+import functools
+import itertools
+import json
+import os
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from buffers import BufferPool
+from bus import (TOPICS, Bus, Cmd, FrameHandle, ImageRaw, LeafPosition, Publisher, Subscription, close_frames,
+                 frame_valid, open_frame)
+from detections import Detections, records_equal
+from frame_ring import FrameRing
+from main import detect_leaves, draw_detections, morph_reach, preprocess_frame, segment_leaves
+from segmentation import LUTSegmenter, inrange_mask
+from tiling import TileSegmenter
+from tuning import ThresholdCache
+
+# Green, yellow, brown and a second green preset, as saved from 2preset.py
+SAMPLE_RANGES = [
+    ((25, 40, 40), (95, 255, 255)),
+    ((15, 80, 80), (35, 255, 255)),
+    ((5, 40, 20), (20, 200, 160)),
+    ((40, 30, 30), (85, 200, 200)),
+    ((90, 20, 20), (130, 255, 255)),
+    ((0, 60, 30), (8, 255, 200)),
+    ((130, 30, 30), (170, 255, 255)),
+    ((20, 0, 0), (40, 60, 100)),
+]
+
+
+def parse_size(text):
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+
+def make_leaf_scene(width, height, n_leaves=40, noise=8.0, seed=0, leaf_size=1.0):
+    # Deterministic synthetic scene: soil-coloured background with leaf-like ellipses
+    rng = np.random.default_rng(seed)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = (40, 60, 90)
+    scale = min(width, height) * leaf_size
+    for _ in range(n_leaves):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (max(1, int(rng.uniform(0.02, 0.06) * scale)), max(1, int(rng.uniform(0.01, 0.03) * scale)))
+        color = (int(rng.integers(20, 80)), int(rng.integers(120, 220)), int(rng.integers(30, 120)))
+        cv2.ellipse(frame, center, axes, float(rng.uniform(0, 180)), 0, 360, color, -1)
+    if noise > 0:
+        jitter = rng.normal(0, noise, frame.shape)
+        frame = np.clip(frame.astype(np.float32) + jitter, 0, 255).astype(np.uint8)
+    return cv2.GaussianBlur(frame, (5, 5), 0)
+
+
+def make_blob_mask(width, height, n_blobs, seed=0):
+    # Binary mask with n_blobs filled ellipses; about a third are big enough to survive min_area
+    rng = np.random.default_rng(seed)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for _ in range(n_blobs):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        r = int(rng.choice([4, 8, 24], p=[0.4, 0.3, 0.3]))
+        axes = (r, max(2, int(r * rng.uniform(0.4, 1.0))))
+        cv2.ellipse(mask, center, axes, float(rng.uniform(0, 180)), 0, 360, 255, -1)
+    return mask
+
+
+def legacy_contour_loop(mask, min_area):
+    # The per-contour Python loop detect_leaves used before Detections
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    detections = []
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area < min_area:
+            continue
+        detections.append({'contour': cnt, 'area': area, 'rect': cv2.boundingRect(cnt)})
+    return detections
+
+
+def contours_engine(mask, min_area):
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return Detections.from_contours(contours, min_area=min_area)
+
+
+def bench_blobs(counts, size=(1280, 720), min_area=800, repeat=30):
+    rows = []
+    width, height = size
+    for n in counts:
+        mask = make_blob_mask(width, height, n)
+        legacy = np.median(time_call(lambda: legacy_contour_loop(mask, min_area), repeat))
+        contours = np.median(time_call(lambda: contours_engine(mask, min_area), repeat))
+        components = np.median(time_call(lambda: Detections.from_components(mask, min_area), repeat))
+        # Components plus tracing the contours of every kept blob (what drawing costs)
+        traced = np.median(time_call(lambda: Detections.from_components(mask, min_area).contours(), repeat))
+        kept = len(Detections.from_components(mask, min_area))
+        rows.append({'blobs': n, 'kept': kept, 'legacy_ms': legacy, 'contours_ms': contours,
+                     'components_ms': components, 'components_traced_ms': traced})
+        print(f"{width}x{height} blobs={n} kept={kept}: loop {legacy:.2f} ms | contours {contours:.2f} ms "
+              f"| components {components:.2f} ms | components+contours {traced:.2f} ms")
+    return rows
+
+
+def rect_error(reference, candidate):
+    # Largest rect coordinate difference over matched boxes (nearest top-left corner), plus the count difference
+    if not len(reference) or not len(candidate):
+        return 0, len(candidate) - len(reference)
+    a = reference.rects.astype(np.int64)
+    b = candidate.rects.astype(np.int64)
+    d = np.abs(a[:, None, :2] - b[None, :, :2]).sum(-1)
+    match = d.argmin(1)
+    return int(np.abs(a - b[match]).max()), len(candidate) - len(reference)
+
+
+def bench_pyramid(sizes, scales, use_lut=True, min_area=800, repeat=20):
+    rows = []
+    lower = np.array([25, 40, 40], dtype=np.uint8)
+    upper = np.array([95, 255, 255], dtype=np.uint8)
+    for width, height in sizes:
+        frame = make_leaf_scene(width, height, n_leaves=40, noise=12)
+        seg = LUTSegmenter() if use_lut else None
+        _, ref = detect_leaves(frame, lower, upper, min_area=min_area, segmenter=seg)
+        full = np.median(time_call(lambda: detect_leaves(frame, lower, upper, min_area=min_area,
+                                                         segmenter=seg), repeat))
+        for scale in scales:
+            _, dets = detect_leaves(frame, lower, upper, min_area=min_area, segmenter=seg, pyramid=scale)
+            t = np.median(time_call(lambda: detect_leaves(frame, lower, upper, min_area=min_area,
+                                                          segmenter=seg, pyramid=scale), repeat))
+            err, dcount = rect_error(ref, dets)
+            rows.append({'size': f'{width}x{height}', 'scale': scale, 'full_ms': full, 'pyramid_ms': t,
+                         'speedup': full / t, 'max_rect_err_px': err, 'count_diff': dcount})
+            print(f"{width}x{height} 1/{scale}: full {full:.2f} ms | pyramid {t:.2f} ms | x{full / t:.2f} "
+                  f"| max rect err {err}px | count diff {dcount:+d}")
+    return rows
+
+
+def bench_tiles(sizes, tiles_list, workers=None, use_lut=True, min_area=800, repeat=20):
+    rows = []
+    lower = np.array([25, 40, 40], dtype=np.uint8)
+    upper = np.array([95, 255, 255], dtype=np.uint8)
+    factory = lambda: functools.partial(segment_leaves, segmenter=LUTSegmenter() if use_lut else None)
+    for width, height in sizes:
+        frame = make_leaf_scene(width, height, n_leaves=60, noise=12)
+        seg = LUTSegmenter() if use_lut else None
+        ref_mask, ref = detect_leaves(frame, lower, upper, min_area=min_area, segmenter=seg)
+        full = np.median(time_call(lambda: detect_leaves(frame, lower, upper, min_area=min_area,
+                                                         segmenter=seg), repeat))
+        for tiles in tiles_list:
+            tiler = TileSegmenter(factory, tiles=tiles, workers=workers, pad=morph_reach())
+            mask, dets = detect_leaves(frame, lower, upper, min_area=min_area, tiler=tiler)
+            t = np.median(time_call(lambda: detect_leaves(frame, lower, upper, min_area=min_area,
+                                                          tiler=tiler), repeat))
+            tiler.close()
+            # Bands are padded by the morphology reach, so the stitched result must match exactly
+            identical = bool(np.array_equal(mask, ref_mask) and records_equal(dets.records, ref.records))
+            rows.append({'size': f'{width}x{height}', 'tiles': tiles, 'workers': tiler.workers, 'untiled_ms': full,
+                         'tiled_ms': t, 'speedup': full / t, 'identical': identical})
+            print(f"{width}x{height} {tiles} tiles / {tiler.workers} threads: untiled {full:.2f} ms | "
+                  f"tiled {t:.2f} ms | x{full / t:.2f} | {'identical' if identical else 'MISMATCH'}")
+    return rows
+
+
+def time_call(fn, repeat=50, warmup=3):
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples[i] = time.perf_counter() - t0
+    return samples * 1000.0
+
+
+def summarize(samples_ms):
+    samples_ms = np.asarray(samples_ms)
+    mean = float(samples_ms.mean())
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99]).tolist()
+    return {'mean_ms': mean, 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+            'fps': 1000.0 / mean if mean > 0 else 0.0}
+
+
+def load_clip(path, max_frames=120):
+    # Decode up front so decoding is not part of the timings
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def run_pipeline(frames, width=None, min_area=800, segmenter=None, engine='contours', pyramid=1,
+                 repeat=100, warmup=5):
+    lower = np.array([25, 40, 40], dtype=np.uint8)
+    upper = np.array([95, 255, 255], dtype=np.uint8)
+
+    def step(frame):
+        t0 = time.perf_counter()
+        proc = preprocess_frame(frame, width=width)
+        t1 = time.perf_counter()
+        _, dets = detect_leaves(proc, lower, upper, min_area=min_area, segmenter=segmenter,
+                                engine=engine, pyramid=pyramid)
+        t2 = time.perf_counter()
+        draw_detections(proc, dets)
+        t3 = time.perf_counter()
+        return t1 - t0, t2 - t1, t3 - t2, t3 - t0, len(dets)
+
+    for i in range(warmup):
+        step(frames[i % len(frames)])
+    times = np.empty((repeat, 4))
+    n_dets = 0
+    for i in range(repeat):
+        *times[i], n = step(frames[i % len(frames)])
+        n_dets += n
+    times *= 1000.0
+
+    # Separate pass for memory: tracemalloc slows allocations down, so it must not skew the timings
+    tracemalloc.start()
+    for i in range(min(repeat, len(frames))):
+        step(frames[i])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stages = {name: summarize(times[:, k]) for k, name in enumerate(('preprocess', 'detect', 'draw', 'total'))}
+    return stages, peak, n_dets / repeat
+
+
+def bench_pipeline(sizes, leaves, noises, leaf_size=1.0, clip=None, width=None, n_frames=8, use_lut=True,
+                   engine='contours', pyramid=1, repeat=100):
+    rows = []
+    if clip:
+        frames = load_clip(clip, max_frames=max(n_frames, repeat))
+        if not frames:
+            print(f'ERROR: Cannot read frames from {clip}')
+            return rows
+        h, w = frames[0].shape[:2]
+        cases = [({'source': os.path.basename(clip), 'size': f'{w}x{h}', 'frames': len(frames)}, frames)]
+    else:
+        cases = []
+        for (w, h), n, noise in itertools.product(sizes, leaves, noises):
+            frames = [make_leaf_scene(w, h, n_leaves=n, noise=noise, seed=seed, leaf_size=leaf_size)
+                      for seed in range(n_frames)]
+            cases.append(({'source': 'synthetic', 'size': f'{w}x{h}', 'leaves': n, 'noise': noise}, frames))
+
+    for case, frames in cases:
+        seg = LUTSegmenter() if use_lut else None
+        stages, peak, mean_dets = run_pipeline(frames, width=width, segmenter=seg, engine=engine,
+                                               pyramid=pyramid, repeat=repeat)
+        row = dict(case, detections=round(mean_dets, 1), peak_mem_mb=peak / 2**20)
+        for name, stats in stages.items():
+            row.update({f'{name}_{k}': v for k, v in stats.items()})
+        rows.append(row)
+        label = ' '.join(f'{k}={v}' for k, v in case.items())
+        total = stages['total']
+        print(f"{label}: {total['fps']:.1f} fps | total p50 {total['p50_ms']:.2f} / p95 {total['p95_ms']:.2f} "
+              f"/ p99 {total['p99_ms']:.2f} ms | preprocess {stages['preprocess']['p50_ms']:.2f} "
+              f"| detect {stages['detect']['p50_ms']:.2f} | draw {stages['draw']['p50_ms']:.2f} ms "
+              f"| peak {peak / 2**20:.1f} MB | {mean_dets:.1f} leaves")
+    return rows
+
+
+def render_frame(frame, lower, upper, segmenter, width, pool):
+    # One serial iteration of main.py: preprocess, detect, draw + side-by-side canvas
+    proc = preprocess_frame(frame, width=width, buffers=pool)
+    mask, dets = detect_leaves(proc, lower, upper, min_area=800, segmenter=segmenter, buffers=pool)
+    if pool is not None:
+        canvas, left, right = pool.canvas(proc.shape)
+        draw_detections(proc, dets, out=left)
+        cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR, dst=right)
+        return canvas
+    out = draw_detections(proc, dets)
+    return np.hstack([out, cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)])
+
+
+def frame_allocations(fn, frames, n=20):
+    # Peak bytes allocated above the steady state while processing one frame, averaged
+    tracemalloc.start()
+    peaks = []
+    for i in range(n):
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn(frames[i % len(frames)])
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return float(np.mean(peaks))
+
+
+def bench_buffers(sizes, width=None, use_lut=True, repeat=50):
+    rows = []
+    lower = np.array([25, 40, 40], dtype=np.uint8)
+    upper = np.array([95, 255, 255], dtype=np.uint8)
+    for w, h in sizes:
+        frames = [make_leaf_scene(w, h, seed=seed) for seed in range(4)]
+        row = {'size': f'{w}x{h}'}
+        for name, pool in (('alloc', None), ('pooled', BufferPool())):
+            seg = LUTSegmenter() if use_lut else None
+            fn = lambda f: render_frame(f, lower, upper, seg, width, pool)
+            for f in frames:
+                fn(f)
+            it = iter(itertools.cycle(frames))
+            row[f'{name}_ms'] = float(np.median(time_call(lambda: fn(next(it)), repeat)))
+            row[f'{name}_kb_per_frame'] = frame_allocations(fn, frames) / 1024.0
+            if pool is not None:
+                row['pool_kb'] = pool.nbytes() / 1024.0
+        rows.append(row)
+        print(f"{w}x{h}: allocated per frame {row['alloc_kb_per_frame']:.0f} KB -> "
+              f"{row['pooled_kb_per_frame']:.0f} KB with pool ({row['pool_kb']:.0f} KB reused) "
+              f"| {row['alloc_ms']:.2f} -> {row['pooled_ms']:.2f} ms")
+    return rows
+
+
+def bench_tuning(sizes, steps=40, noise=24.0):
+    # One trackbar (S_low) dragged across `steps` positions on a paused frame
+    rows = []
+    for w, h in sizes:
+        frame = make_leaf_scene(w, h, noise=noise)
+        lower = np.array([25, 40, 40], dtype=np.uint8)
+        upper = np.array([95, 255, 255], dtype=np.uint8)
+        bounds = []
+        for i in range(steps):
+            lo = lower.copy()
+            lo[1] = 41 + i
+            bounds.append(lo)
+
+        t0 = time.perf_counter()
+        for lo in bounds:
+            cv2.inRange(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV), lo, upper)
+        full = (time.perf_counter() - t0) * 1000.0 / steps
+
+        tuner = ThresholdCache()
+        tuner.mask(frame, lower, upper)
+        t0 = time.perf_counter()
+        tuner.mask(frame, bounds[0], upper)
+        first = (time.perf_counter() - t0) * 1000.0
+        t0 = time.perf_counter()
+        for lo in bounds[1:]:
+            tuner.mask(frame, lo, upper)
+        incremental = (time.perf_counter() - t0) * 1000.0 / (steps - 1)
+        assert (tuner.mask(frame, bounds[-1], upper) == inrange_mask(frame, [(bounds[-1], upper)])).all()
+
+        rows.append({'size': f'{w}x{h}', 'full_ms': full, 'first_move_ms': first, 'incremental_ms': incremental,
+                     'skipped': tuner.skipped_updates})
+        print(f"{w}x{h}: cvtColor+inRange {full:.2f} ms/tick | incremental {incremental:.2f} ms/tick "
+              f"(first move {first:.1f} ms, {tuner.skipped_updates}/{steps - 1} ticks changed nothing)")
+    return rows
+
+
+def environment():
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'cv2_threads': cv2.getNumThreads(),
+    }
+
+
+def write_json(path, bench, args, rows):
+    params = {k: v for k, v in vars(args).items() if k not in ('json', 'bench')}
+    with open(path, 'w') as f:
+        json.dump({'bench': bench, 'params': params, 'env': environment(), 'results': rows}, f, indent=2,
+                  default=str)
+    print('Results written to', path)
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old['bench'] != new['bench']:
+        print(f"WARNING: comparing different benchmarks ({old['bench']} vs {new['bench']})")
+    # Rows are matched by position; each run uses the same case order for the same arguments
+    for a, b in zip(old['results'], new['results']):
+        label = ' '.join(f'{k}={v}' for k, v in b.items() if isinstance(v, str) or k in ('leaves', 'ranges', 'blobs', 'scale'))
+        changes = [f"{k} {a[k]:.2f}->{b[k]:.2f} ({(b[k] / a[k] - 1) * 100:+.0f}%)"
+                   for k in b if k.endswith(('p50_ms', 'p95_ms')) or k in ('fps', 'total_fps')
+                   if isinstance(a.get(k), (int, float)) and a[k]]
+        print(f"{label}: " + ', '.join(changes))
+
+
+def bench_segmentation(sizes, range_counts, bits=5, repeat=50):
+    rows = []
+    for width, height in sizes:
+        frame = make_leaf_scene(width, height)
+        for n in range_counts:
+            ranges = SAMPLE_RANGES[:n]
+            seg = LUTSegmenter(bits=bits)
+            t0 = time.perf_counter()
+            seg.update(ranges)
+            build_ms = (time.perf_counter() - t0) * 1000.0
+
+            base = np.median(time_call(lambda: inrange_mask(frame, ranges), repeat))
+            lut = np.median(time_call(lambda: seg.mask(frame), repeat))
+            agree = np.mean(seg.mask(frame) == inrange_mask(frame, ranges)) * 100.0
+            rows.append({
+                'size': f'{width}x{height}', 'ranges': n, 'inrange_ms': base, 'lut_ms': lut,
+                'speedup': base / lut, 'build_ms': build_ms, 'agree_pct': agree,
+            })
+            print(f"{width}x{height} ranges={n}: inRange {base:.2f} ms | LUT{bits} {lut:.2f} ms "
+                  f"| x{base / lut:.2f} | build {build_ms:.1f} ms | agree {agree:.2f}%")
+    return rows
+
+
+def _bus_sink(stop, sub, results):
+    # Subscriber side of bench_bus: reads every frame it gets (first pixel) so a handle is really dereferenced
+    rings = {}
+    torn = 0
+    last = None
+    while True:
+        msg = sub.get(timeout=0.05)
+        if msg is None:
+            if stop.is_set():
+                break
+            continue
+        last = time.perf_counter()
+        if isinstance(msg, ImageRaw):
+            view = open_frame(msg.frame, rings)
+            if view is not None:
+                int(view[0, 0, 0])
+            if view is None or not frame_valid(msg.frame, rings):
+                torn += 1
+            view = None
+        elif isinstance(msg, np.ndarray):
+            int(msg[0, 0, 0])
+    close_frames(rings)
+    results.put((sub.received, list(sub.latency_ms), last, torn))
+
+
+def _bus_run(processes, topic, make_msg, n, rate, depth):
+    bus = Bus(processes=processes, depth=depth)
+    if topic in TOPICS:
+        sub = bus.subscribe(topic)
+        pub = bus.publisher(topic)
+    else:
+        # Baseline: the frame itself through the same keep-last queue
+        q = bus.queue(depth)
+        sub, pub = Subscription(topic, q), Publisher(topic, np.ndarray, [q])
+    results = bus.queue()
+    stop = bus.event()
+    sink = bus.worker(_bus_sink, 'sink', {'stop': stop, 'sub': sub, 'results': results})
+    sink.start()
+    time.sleep(0.2)
+    publish_ms = np.empty(n)
+    t_start = time.perf_counter()
+    for i in range(n):
+        t0 = time.perf_counter()
+        pub.publish(make_msg(i))
+        publish_ms[i] = (time.perf_counter() - t0) * 1000.0
+        if rate:
+            time.sleep(max(0.0, t_start + (i + 1) / rate - time.perf_counter()))
+    stop.set()
+    received, latency_ms, last, torn = results.get()
+    sink.join()
+    elapsed = (last - t_start) if last else float('nan')
+    return received, latency_ms, received / elapsed, torn, pub.dropped, float(np.median(publish_ms))
+
+
+def bench_bus(sizes, modes=('threads', 'processes'), n=200, rate=100.0, depth=8):
+    """Per-topic latency (paced at `rate` Hz) and delivered throughput (unpaced burst) of bus.py."""
+    rows = []
+    small = make_leaf_scene(800, 600)
+    _, dets = detect_leaves(small, np.array([25, 40, 40], dtype=np.uint8), np.array([95, 255, 255], dtype=np.uint8),
+                            min_area=800)
+    records = dets.records
+    for mode in modes:
+        cases = []
+        for width, height in sizes:
+            frame = make_leaf_scene(width, height)
+            frames = FrameRing.create(None, frame.shape, slots=depth + 4)
+            make_handle = lambda i, f=frame, r=frames: ImageRaw(i, time.perf_counter(), FrameHandle(r.name, r.write(f)))
+            cases.append(('image_raw', f'{width}x{height}', frame.nbytes, make_handle, frames))
+            cases.append(('frame-by-value', f'{width}x{height}', frame.nbytes, lambda i, f=frame: f, None))
+        cases.append(('leaf_position', f'{len(records)} leaves', records.nbytes,
+                      lambda i: LeafPosition(i, time.perf_counter(), (600, 800), records), None))
+        cases.append(('cmd', f'{len(records)} leaves', records.nbytes,
+                      lambda i: Cmd(i, time.perf_counter(), records, False), None))
+        for topic, label, nbytes, make_msg, frames in cases:
+            received, latency_ms, _, torn, _, publish_ms = _bus_run(mode == 'processes', topic, make_msg, n, rate,
+                                                                     depth)
+            b_received, _, throughput, b_torn, dropped, _ = _bus_run(mode == 'processes', topic, make_msg, n, 0,
+                                                                     depth)
+            if frames is not None:
+                frames.close()
+            stats = summarize(latency_ms)
+            rows.append({'mode': mode, 'topic': topic, 'payload': label, 'p50_ms': stats['p50_ms'],
+                         'p95_ms': stats['p95_ms'], 'publish_ms': publish_ms, 'msgs_per_s': throughput,
+                         'mb_per_s': throughput * nbytes / 1e6, 'burst_delivered': b_received, 'burst_dropped': dropped,
+                         'torn': torn + b_torn})
+            print(f"{mode:9s} {topic:14s} {label:10s}: latency p50 {stats['p50_ms']:.3f} ms p95 "
+                  f"{stats['p95_ms']:.3f} ms | publish {publish_ms:.3f} ms | burst: {b_received}/{n} delivered at "
+                  f"{throughput:.0f} msg/s ({throughput * nbytes / 1e6:.0f} MB/s), {torn + b_torn} torn")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Leaf detector benchmarks (headless)')
+    sub = parser.add_subparsers(dest='bench', required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--json', metavar='PATH', help='Also write the results (and environment) to a JSON file')
+
+    p = sub.add_parser('pipeline', parents=[common], help='Per-stage and end-to-end timings of the detection loop')
+    p.add_argument('--sizes', nargs='+', type=parse_size, default=[(640, 480), (1280, 720), (1920, 1080)])
+    p.add_argument('--leaves', nargs='+', type=int, default=[10, 40, 160], help='Leaves per synthetic frame')
+    p.add_argument('--noise', nargs='+', type=float, default=[8.0], help='Gaussian pixel noise (std)')
+    p.add_argument('--leaf-size', type=float, default=1.0, help='Leaf size multiplier')
+    p.add_argument('--frames', type=int, default=8, help='Distinct synthetic frames per case')
+    p.add_argument('--clip', help='Replay a recorded video instead of synthetic scenes')
+    p.add_argument('--width', type=int, default=None, help='preprocess_frame resize width (default: keep size)')
+    p.add_argument('--segmentation', choices=('lut', 'inrange'), default='lut')
+    p.add_argument('--engine', choices=('contours', 'components'), default='contours')
+    p.add_argument('--pyramid', type=int, choices=(1, 2, 4), default=1)
+    p.add_argument('--repeat', type=int, default=100)
+
+    p = sub.add_parser('buffers', parents=[common], help='Per-frame allocations with / without BufferPool')
+    p.add_argument('--sizes', nargs='+', type=parse_size, default=[(640, 480), (1280, 720), (1920, 1080)])
+    p.add_argument('--width', type=int, default=None, help='preprocess_frame resize width (default: keep size)')
+    p.add_argument('--segmentation', choices=('lut', 'inrange'), default='lut')
+    p.add_argument('--repeat', type=int, default=50)
+
+    p = sub.add_parser('tuning', parents=[common], help='Incremental re-threshold of a paused frame vs full')
+    p.add_argument('--sizes', nargs='+', type=parse_size, default=[(1280, 720), (3840, 2160)])
+    p.add_argument('--steps', type=int, default=40)
+
+    p = sub.add_parser('compare', help='Compare two --json result files')
+    p.add_argument('old')
+    p.add_argument('new')
+
+    p = sub.add_parser('segmentation', parents=[common], help='LUT segmentation vs cvtColor+inRange')
+    p.add_argument('--sizes', nargs='+', type=parse_size, default=[(800, 600), (1920, 1080)])
+    p.add_argument('--ranges', nargs='+', type=int, default=[1, 2, 4, 8])
+    p.add_argument('--bits', type=int, default=5)
+    p.add_argument('--repeat', type=int, default=50)
+
+    p = sub.add_parser('blobs', parents=[common], help='findContours + contour loop vs connectedComponentsWithStats')
+    p.add_argument('--counts', nargs='+', type=int, default=[10, 100, 1000, 5000])
+    p.add_argument('--size', type=parse_size, default=(1280, 720))
+    p.add_argument('--min-area', type=int, default=800)
+    p.add_argument('--repeat', type=int, default=30)
+
+    p = sub.add_parser('pyramid', parents=[common], help='detect_leaves at full resolution vs pyramid mode')
+    p.add_argument('--sizes', nargs='+', type=parse_size, default=[(800, 600), (1920, 1080), (3840, 2160)])
+    p.add_argument('--scales', nargs='+', type=int, default=[2, 4])
+    p.add_argument('--inrange', dest='lut', action='store_false', help='Use cvtColor+inRange instead of the LUT')
+    p.add_argument('--repeat', type=int, default=20)
+
+    p = sub.add_parser('tiles', parents=[common], help='detect_leaves untiled vs parallel banded segmentation')
+    p.add_argument('--sizes', nargs='+', type=parse_size, default=[(1920, 1080), (3840, 2160), (4000, 3000)])
+    p.add_argument('--tiles', nargs='+', type=int, default=[4, 8, 16])
+    p.add_argument('--workers', type=int, default=None, help='Threads (default: CPU count)')
+    p.add_argument('--inrange', dest='lut', action='store_false', help='Use cvtColor+inRange instead of the LUT')
+    p.add_argument('--repeat', type=int, default=20)
+
+    p = sub.add_parser('bus', parents=[common], help='Per-topic latency / throughput of the bus.py topics')
+    p.add_argument('--sizes', nargs='+', type=parse_size, default=[(1280, 720), (1920, 1080)])
+    p.add_argument('--modes', nargs='+', choices=('threads', 'processes'), default=['threads', 'processes'])
+    p.add_argument('--messages', type=int, default=200, help='Messages per run')
+    p.add_argument('--rate', type=float, default=100.0, help='Publish rate (Hz) of the latency run')
+    p.add_argument('--depth', type=int, default=8, help='Keep-last queue depth')
+
+    args = parser.parse_args()
+    if args.bench == 'compare':
+        compare(args.old, args.new)
+        return
+    if args.bench == 'pipeline':
+        rows = bench_pipeline(args.sizes, args.leaves, args.noise, leaf_size=args.leaf_size, clip=args.clip,
+                              width=args.width, n_frames=args.frames, use_lut=args.segmentation == 'lut',
+                              engine=args.engine, pyramid=args.pyramid, repeat=args.repeat)
+    elif args.bench == 'buffers':
+        rows = bench_buffers(args.sizes, width=args.width, use_lut=args.segmentation == 'lut', repeat=args.repeat)
+    elif args.bench == 'tuning':
+        rows = bench_tuning(args.sizes, steps=args.steps)
+    elif args.bench == 'segmentation':
+        rows = bench_segmentation(args.sizes, args.ranges, bits=args.bits, repeat=args.repeat)
+    elif args.bench == 'blobs':
+        rows = bench_blobs(args.counts, size=args.size, min_area=args.min_area, repeat=args.repeat)
+    elif args.bench == 'bus':
+        rows = bench_bus(args.sizes, modes=args.modes, n=args.messages, rate=args.rate, depth=args.depth)
+    elif args.bench == 'tiles':
+        rows = bench_tiles(args.sizes, args.tiles, workers=args.workers, use_lut=args.lut, repeat=args.repeat)
+    else:
+        rows = bench_pyramid(args.sizes, args.scales, use_lut=args.lut, repeat=args.repeat)
+    if args.json:
+        write_json(args.json, args.bench, args, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Preallocated frame buffers for the serial detection loop.
+
+Every iteration used to allocate a resized frame, a blurred frame, an HSV
+image, a mask, two morphology outputs, a frame.copy() for drawing, a
+GRAY2BGR mask and an np.hstack canvas: about 10 full-frame arrays per
+frame. BufferPool hands out named arrays that are allocated once per
+resolution and reused, and the pipeline writes into them through the
+OpenCV `dst=` arguments:
+
+- preprocess_frame: resize -> 'resized', GaussianBlur -> 'blurred'
+- segment_leaves: HSV -> 'hsv', threshold -> 'mask', open -> 'morph',
+  close -> back into 'mask'
+- the side-by-side canvas is one (h, 2w, 3) array: the detections are drawn
+  into its left half and the mask is converted straight into its right half
+  (BufferPool.canvas), so there is no copy()/hstack at all
+
+Arrays from the pool are overwritten by the next frame, so anything that
+must outlive the frame has to be copied. The threaded pipeline
+(main.py --pipeline) has several frames in flight and does not use the pool.
+
+Usage:
+    pool = BufferPool()
+    blurred = preprocess_frame(frame, width=800, buffers=pool)
+    mask, dets = detect_leaves(blurred, lower, upper, buffers=pool)
+    canvas, left, right = pool.canvas(blurred.shape)
+"""
+
+import numpy as np
+
+
+class BufferPool:
+    """Named, reusable arrays; reallocated only when the requested shape changes."""
+
+    def __init__(self):
+        self._buffers = {}
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        shape = tuple(shape)
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+            self.allocations += 1
+        return buf
+
+    def canvas(self, frame_shape):
+        # Output | mask side by side; the halves are views, written in place
+        h, w = frame_shape[:2]
+        canvas = self.get('canvas', (h, 2 * w, 3))
+        return canvas, canvas[:, :w], canvas[:, w:]
+
+    def nbytes(self):
+        return sum(b.nbytes for b in self._buffers.values())
+
+    def clear(self):
+        self._buffers.clear()
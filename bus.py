@@ -0,0 +1,455 @@
+"""
+Local publish/subscribe bus laid out like the readme's ROS2 node graph.
+
+main() runs capture, detection, pixel -> world conversion and the robot
+link in one loop. bus.py splits them into nodes connected by typed topics,
+so every node can run in its own process (the detector several times), or
+all of them as threads of one process on small boards:
+
+    camera --image_raw--> detect (x N) --leaf_position--> convert --cmd--> move --> robot
+
+- topics are typed: a publisher only accepts the topic's message class
+  (ImageRaw, LeafPosition, Cmd)
+- frames never go through the queues: the camera node writes them into a
+  shared-memory FrameRing (frame_ring.py) and image_raw only carries a
+  FrameHandle (ring name, sequence number). Subscribers attach to the ring
+  once per node and read the frame as a NumPy view, then check with frame_valid()
+  that its slot was not reused while they were reading it. With --ring the
+  camera node does not open the camera at all: it republishes the frames of
+  a running frame_ring.py capture daemon, which other programs can read too
+- every subscription is a bounded keep-last queue (like a ROS2 KEEP_LAST
+  history of `depth`): a slow subscriber loses its oldest messages and the
+  publisher never blocks. Subscribers in the same `group` share one queue
+  and split the messages between them (several detect nodes)
+- the graph is static: all subscriptions are made before the publishers
+  and before run_graph() starts the nodes as threads or processes
+- every subscription keeps per-topic latency (publish -> receive) and
+  counts, printed by each node when it stops; `benchmark.py bus` measures
+  every topic and compares image_raw with sending the frames by value
+
+Stamps are time.perf_counter() (CLOCK_MONOTONIC on Linux), which is
+comparable between processes on the same machine.
+
+Usage:
+    python bus.py --video field.mp4                          # all nodes as threads of one process
+    python bus.py --video field.mp4 --processes --detect-nodes 2 --robot pty
+    python bus.py --camera 0 --processes --calibration rig.json --robot /dev/ttyUSB0
+    python bus.py --ring leafcam --processes            # frames from a frame_ring.py capture daemon
+    python bus.py --video field.mp4 --presets presets.db --preset-names green yellow
+
+    bus = Bus(processes=True)
+    sub = bus.subscribe('image_raw', group='detect')
+    pub = bus.publisher('image_raw')            # after all subscriptions
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import NamedTuple
+
+import numpy as np
+
+from batch import DEFAULT_LOWER, DEFAULT_UPPER, parse_hsv
+from frame_ring import FrameRing, RingReader
+from preset_store import load_preset_set
+
+
+class FrameHandle(NamedTuple):
+    name: str           # FrameRing (shared-memory segment) name
+    seq: int            # frame sequence number in that ring
+
+
+class ImageRaw(NamedTuple):
+    seq: int
+    stamp: float        # capture time
+    frame: FrameHandle
+
+
+class LeafPosition(NamedTuple):
+    seq: int
+    stamp: float
+    shape: tuple        # (h, w) of the processed frame the detections refer to
+    records: np.ndarray  # DETECTION_DTYPE rows (no contour points)
+
+
+class Cmd(NamedTuple):
+    seq: int
+    stamp: float
+    records: np.ndarray
+    world: bool         # records carry calibrated world positions
+    units: str = 'cm'   # world unit of the calibration
+
+
+TOPICS = {'image_raw': ImageRaw, 'leaf_position': LeafPosition, 'cmd': Cmd}
+
+
+def _ring_for(handle, rings):
+    # rings: the calling node's own {name: FrameRing} attachments, closed by that node alone
+    ring = rings.get(handle.name)
+    if ring is None:
+        try:
+            ring = rings[handle.name] = FrameRing.attach(handle.name)
+        except FileNotFoundError:
+            # The camera node has already shut its ring down
+            return None
+    return ring
+
+
+def open_frame(handle, rings):
+    """Zero-copy view of the frame behind an image_raw handle; None if its slot has been reused already."""
+    ring = _ring_for(handle, rings)
+    return ring.view(handle.seq) if ring is not None else None
+
+
+def frame_valid(handle, rings):
+    """True while the frame has not been overwritten; check it after reading from an open_frame() view."""
+    ring = _ring_for(handle, rings)
+    return ring is not None and ring.valid(handle.seq)
+
+
+def close_frames(rings):
+    for ring in rings.values():
+        try:
+            ring.close()
+        except BufferError:
+            # A view is still referenced somewhere; the mapping goes away with the process
+            pass
+    rings.clear()
+
+
+def _latency_text(latency_ms):
+    if not latency_ms:
+        return 'no messages'
+    p50, p95 = np.percentile(np.array(latency_ms), [50, 95]).tolist()
+    return f'latency p50 {p50:.2f} ms, p95 {p95:.2f} ms'
+
+
+class Publisher:
+    def __init__(self, topic, msg_type, queues):
+        self.topic = topic
+        self.msg_type = msg_type
+        self._queues = queues
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, msg):
+        if not isinstance(msg, self.msg_type):
+            raise TypeError(f'{self.topic} takes {self.msg_type.__name__}, got {type(msg).__name__}')
+        envelope = (time.perf_counter(), msg)
+        for q in self._queues:
+            while True:
+                try:
+                    q.put_nowait(envelope)
+                    break
+                except queue.Full:
+                    # Keep last: the oldest unread message makes room
+                    try:
+                        q.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        self.published += 1
+
+
+class Subscription:
+    def __init__(self, topic, q, window=1000):
+        self.topic = topic
+        self._queue = q
+        self.received = 0
+        self.latency_ms = deque(maxlen=window)
+
+    def get(self, timeout=None):
+        """Next message, or None after `timeout` seconds without one."""
+        try:
+            published, msg = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.latency_ms.append((time.perf_counter() - published) * 1000.0)
+        self.received += 1
+        return msg
+
+    def report(self):
+        return f'{self.topic}: {self.received} received, {_latency_text(self.latency_ms)}'
+
+
+class Bus:
+    """Static topic graph: subscribe() everything first, then create publishers and start the nodes."""
+
+    def __init__(self, processes=False, depth=4):
+        self.processes = processes
+        self.depth = depth
+        self._ctx = multiprocessing.get_context()
+        self._queues = {topic: {} for topic in TOPICS}
+
+    def queue(self, depth=0):
+        """Plain queue of the bus' kind (thread or process), e.g. to collect results from nodes."""
+        return self._ctx.Queue(depth) if self.processes else queue.Queue(depth)
+
+    def subscribe(self, topic, group=None, depth=None):
+        if topic not in TOPICS:
+            raise ValueError(f'unknown topic {topic!r} (expected one of {tuple(TOPICS)})')
+        queues = self._queues[topic]
+        key = group if group is not None else object()
+        if key not in queues:
+            queues[key] = self.queue(depth or self.depth)
+        return Subscription(topic, queues[key])
+
+    def publisher(self, topic):
+        if topic not in TOPICS:
+            raise ValueError(f'unknown topic {topic!r} (expected one of {tuple(TOPICS)})')
+        return Publisher(topic, TOPICS[topic], list(self._queues[topic].values()))
+
+    def event(self):
+        return self._ctx.Event() if self.processes else threading.Event()
+
+    def worker(self, target, name, kwargs):
+        if self.processes:
+            return self._ctx.Process(target=target, name=name, kwargs=kwargs, daemon=True)
+        return threading.Thread(target=target, name=name, kwargs=kwargs, daemon=True)
+
+
+def run_graph(bus, nodes, sources=('camera',), drain=1.0):
+    """Start (name, fn, kwargs) nodes; when the sources are done, give the rest `drain` seconds, then stop them.
+
+    Source nodes also get a `done` event to set at the end of their stream; they keep the frames they
+    published readable (their FrameRing) until `stop`.
+    """
+    stop = bus.event()
+    done = {name: bus.event() for name in sources}
+    workers = {name: bus.worker(fn, name, dict(kwargs, stop=stop, **({'done': done[name]} if name in done else {})))
+               for name, fn, kwargs in nodes}
+    for w in workers.values():
+        w.start()
+    try:
+        for name in sources:
+            # A source that crashed never sets done
+            while not done[name].wait(0.1) and workers[name].is_alive():
+                pass
+        time.sleep(drain)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for w in workers.values():
+        w.join()
+
+
+def camera_node(stop, image_raw, source=0, slots=8, ring=None, done=None):
+    if ring is not None:
+        return _ring_camera_node(stop, image_raw, ring, done)
+    from capture import open_capture
+
+    cap = open_capture(source)
+    frames = None
+    published = 0
+    try:
+        while not stop.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frames is None:
+                frames = FrameRing.create(None, frame.shape, frame.dtype, slots)
+            seq = frames.write(frame, cap.last_timestamp)
+            image_raw.publish(ImageRaw(seq, cap.last_timestamp, FrameHandle(frames.name, seq)))
+            published += 1
+    finally:
+        cap.release()
+        print(f'[camera] {published} frames published, {image_raw.dropped} dropped by slow subscribers')
+        if frames is not None:
+            if done is not None:
+                # Handles still queued at the end of a file need the ring's name: a detect process that has
+                # not attached yet could not open it once unlinked, so the ring stays until the graph stops
+                done.set()
+                stop.wait()
+            frames.close()
+        elif done is not None:
+            done.set()
+
+
+def _ring_camera_node(stop, image_raw, name, done=None):
+    # Frames are already in the daemon's ring: only handles are published, nothing is copied
+    try:
+        reader = RingReader(FrameRing.attach(name))
+    except FileNotFoundError:
+        print(f'ERROR: no frame ring named {name} (start: python frame_ring.py serve --name {name})')
+        return
+    try:
+        while not stop.is_set():
+            item = reader.read(timeout=0.1)
+            if item is None:
+                if reader.ring.closed or not reader.ring.writer_alive():
+                    break
+                continue
+            seq, ts, _ = item
+            image_raw.publish(ImageRaw(seq, ts, FrameHandle(name, seq)))
+    finally:
+        item = None
+        stats = reader.stats()
+        print(f"[camera] ring {name}: {stats['read']} frames published, {stats['skipped']} skipped, "
+              f"{image_raw.dropped} dropped by slow subscribers")
+        # The daemon owns the ring, so it stays readable after this node detaches
+        reader.ring.close()
+        if done is not None:
+            done.set()
+
+
+def detect_node(stop, image_raw, leaf_position, width=800, min_area=800, lower=DEFAULT_LOWER, upper=DEFAULT_UPPER,
+                ranges=None, name='detect'):
+    from buffers import BufferPool
+    from main import detect_leaves, preprocess_frame
+    from segmentation import LUTSegmenter
+
+    lower, upper = np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8)
+    segmenter = LUTSegmenter()
+    pool = BufferPool()
+    rings = {}
+    torn = 0
+    try:
+        while not stop.is_set():
+            msg = image_raw.get(timeout=0.1)
+            if msg is None:
+                continue
+            frame = open_frame(msg.frame, rings)
+            if frame is None:
+                torn += 1
+                continue
+            # The resize / blur reads the shared slot once; everything after works on pool buffers
+            proc = preprocess_frame(frame, width=width, buffers=pool)
+            if not frame_valid(msg.frame, rings):
+                torn += 1
+                continue
+            _, dets = detect_leaves(proc, lower, upper, min_area=min_area, segmenter=segmenter, buffers=pool,
+                                    ranges=ranges)
+            leaf_position.publish(LeafPosition(msg.seq, msg.stamp, proc.shape[:2], dets.records))
+    finally:
+        frame = None
+        close_frames(rings)
+        print(f'[{name}] {image_raw.report()}, {torn} frames overwritten before they were read')
+
+
+def convert_node(stop, leaf_position, cmd, calibration=None):
+    from calibration import Calibration
+    from detections import Detections
+
+    calib = Calibration.load(calibration) if calibration else None
+    last_seq = -1
+    late = 0
+    try:
+        while not stop.is_set():
+            msg = leaf_position.get(timeout=0.1)
+            if msg is None:
+                continue
+            if msg.seq <= last_seq:
+                # Several detect nodes can finish out of order; a newer frame was already converted
+                late += 1
+                continue
+            last_seq = msg.seq
+            dets = Detections(msg.records)
+            if calib is not None:
+                calib.locate(dets, msg.shape)
+            cmd.publish(Cmd(msg.seq, msg.stamp, dets.records, calib is not None,
+                            calib.units if calib is not None else 'cm'))
+    finally:
+        print(f'[convert] {leaf_position.report()}, {late} out of order')
+
+
+def move_node(stop, cmd, robot=None, baud=115200, max_age=0.2):
+    from detections import Detections
+    from robot_link import UNIT_MM, PtyStandIn, RobotLink, open_port
+
+    stand_in = PtyStandIn(baud) if robot == 'pty' else None
+    link = None
+    end_to_end = deque(maxlen=1000)
+    try:
+        while not stop.is_set():
+            msg = cmd.get(timeout=0.1)
+            if msg is None:
+                continue
+            end_to_end.append((time.perf_counter() - msg.stamp) * 1000.0)
+            if robot and link is None:
+                try:
+                    if msg.world and msg.units not in UNIT_MM:
+                        raise ValueError(f'calibration units {msg.units!r} are not one of {tuple(UNIT_MM)}')
+                    link = RobotLink(open_port(stand_in.path if stand_in else robot, baud), max_age=max_age,
+                                     world=msg.world, baudrate=baud, units=msg.units)
+                except (OSError, ImportError, ValueError) as e:
+                    print(f'ERROR: cannot open robot link {robot}: {e}')
+                    robot = None
+            if link is not None:
+                link.publish(msg.seq, Detections(msg.records), msg.stamp)
+    finally:
+        print(f'[move] {cmd.report()}; capture -> cmd {_latency_text(end_to_end)}')
+        if link is not None:
+            link.close()
+            print('[move]', link.report())
+        if stand_in is not None:
+            stand_in.close()
+
+
+def build_graph(bus, source, detect_nodes=1, width=800, min_area=800, lower=DEFAULT_LOWER, upper=DEFAULT_UPPER,
+                ranges=None, calibration=None, robot=None, baud=115200, slots=8, ring=None):
+    """The readme's camera -> detection -> coordinate conversion -> movement graph as run_graph() nodes."""
+    detect_in = [bus.subscribe('image_raw', group='detect') for _ in range(detect_nodes)]
+    convert_in = bus.subscribe('leaf_position')
+    move_in = bus.subscribe('cmd')
+    image_raw, leaf_position, cmd = (bus.publisher(t) for t in ('image_raw', 'leaf_position', 'cmd'))
+    nodes = [('camera', camera_node, {'image_raw': image_raw, 'source': source, 'slots': slots,
+                                        'ring': ring})]
+    for i, sub in enumerate(detect_in):
+        nodes.append((f'detect{i}', detect_node, {'image_raw': sub, 'leaf_position': leaf_position, 'width': width,
+                                                  'min_area': min_area, 'lower': tuple(lower), 'upper': tuple(upper),
+                                                  'ranges': ranges, 'name': f'detect{i}'}))
+    nodes.append(('convert', convert_node, {'leaf_position': convert_in, 'cmd': cmd, 'calibration': calibration}))
+    nodes.append(('move', move_node, {'cmd': move_in, 'robot': robot, 'baud': baud}))
+    return nodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Leaf robot node graph on a local publish/subscribe bus')
+    parser.add_argument('--video', '-v', help='Path to video file (omit to use camera)')
+    parser.add_argument('--camera', '-c', type=int, default=0, help='Camera index (default 0)')
+    parser.add_argument('--ring', metavar='NAME', help='Frames from a frame_ring.py capture daemon')
+    parser.add_argument('--processes', action='store_true', help='One process per node (default: threads)')
+    parser.add_argument('--detect-nodes', type=int, default=1, help='Detect nodes sharing the image_raw stream')
+    parser.add_argument('--depth', type=int, default=4, help='Keep-last queue depth per subscription')
+    parser.add_argument('--slots', type=int, default=8, help='Frames in the shared-memory image ring')
+    parser.add_argument('--width', type=int, default=800, help='Resize width for detection')
+    parser.add_argument('--min-area', type=int, default=800, help='Minimum contour area to keep')
+    parser.add_argument('--lower', type=parse_hsv, default=DEFAULT_LOWER, help='Lower HSV bound, e.g. 25,40,40')
+    parser.add_argument('--upper', type=parse_hsv, default=DEFAULT_UPPER, help='Upper HSV bound, e.g. 95,255,255')
+    parser.add_argument('--presets', metavar='DB', help='Detect with the saved presets of a 2preset.py database')
+    parser.add_argument('--preset-names', nargs='+', metavar='NAME',
+                        help='Presets to use, latest of each name (default: every saved range)')
+    parser.add_argument('--calibration', metavar='JSON', help='World positions in cmd (calibration.py file)')
+    parser.add_argument('--robot', metavar='PORT', help="Serial port for the move node ('pty': local stand-in)")
+    parser.add_argument('--robot-baud', type=int, default=115200)
+    args = parser.parse_args()
+
+    if args.slots <= args.depth:
+        # A handle still queued could otherwise point at a slot that was already reused
+        print('WARNING: --slots should be larger than --depth, frames will be dropped as overwritten')
+    ranges = None
+    if args.presets:
+        if not os.path.exists(args.presets):
+            print(f'ERROR: preset database not found: {args.presets}')
+            return
+        labels, ranges = load_preset_set(args.presets, args.preset_names)
+        if not ranges:
+            print(f'ERROR: no matching presets in {args.presets}')
+            return
+        print('Presets:', ', '.join(f'{i}={label}' for i, label in enumerate(labels)))
+    bus = Bus(processes=args.processes, depth=args.depth)
+    nodes = build_graph(bus, args.video if args.video else args.camera, detect_nodes=args.detect_nodes,
+                        width=args.width, min_area=args.min_area, lower=args.lower, upper=args.upper, ranges=ranges,
+                        calibration=args.calibration, robot=args.robot,
+                        baud=args.robot_baud, slots=args.slots, ring=args.ring)
+    t0 = time.perf_counter()
+    run_graph(bus, nodes)
+    print(f"Graph ran {time.perf_counter() - t0:.2f}s as {'processes' if args.processes else 'threads'}")
+
+
+if __name__ == '__main__':
+    main()
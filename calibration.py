@@ -0,0 +1,321 @@
+"""
+Pixel -> world (ground plane) coordinates for detected leaves.
+
+The readme converts (cx, cy) to centimetres with a fixed px_to_cm scale, or
+"properly" with calibrateCamera / solvePnP. Undistorting every frame
+(cv2.undistort, or a cv2.remap per frame) would cost a full-frame pass for
+the few points we actually need, so the calibration is applied to the
+detections only:
+
+- a calibration file (JSON) holds the camera intrinsics (camera_matrix,
+  dist_coeffs, optional) and a ground-plane homography from undistorted
+  pixels to world units, both for the resolution the camera was
+  calibrated at (image_size)
+- for a processing resolution the whole pixel -> world mapping
+  (undistortPoints, then the homography) is evaluated once on a grid of
+  every `step`-th pixel and kept as a (rows, cols, 2) float32 table; the
+  table is cached next to the calibration file (.npz, keyed by the
+  calibration contents, resolution and step) so later runs just load it
+- per frame, locate() looks up all centroids and rect corners of a
+  Detections batch in the table at once (bilinear interpolation in NumPy):
+  world centroid and leaf area in world units (pixel area scaled by the
+  rect's world / pixel area ratio); a few dozen microseconds per frame
+
+The mapping is smooth, so the grid (step=8 by default) is accurate to well
+below a millimetre on a typical rig; step=1 gives the exact per-pixel table.
+
+Calibration files are made with the subcommands below. `ground` takes at
+least 4 pixel / world point pairs on the floor (e.g. the corners of a sheet
+of paper); `scale` is the readme's simple method (origin at the image
+centre, Y up).
+
+Usage:
+    python calibration.py intrinsics --images 'calib/*.jpg' --pattern 9 6 --square 2.5 -o rig.json
+    python calibration.py ground -o rig.json --pixels "102,388 530,391 560,80 75,84" \\
+                                             --world "0,0 40,0 40,30 0,30"
+    python calibration.py scale -o rig.json --px-to-cm 0.0625 --size 640 480
+    python main.py --calibration rig.json --record run.jsonl     # records carry "world" / "world_area"
+
+    calib = Calibration.load('rig.json')
+    calib.locate(detections, frame.shape)     # fills detections.world / detections.world_areas
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import threading
+
+import cv2
+import numpy as np
+
+
+def parse_points(text):
+    # "x,y x,y ..." in pixels or world units
+    try:
+        points = [tuple(float(v) for v in pair.split(',')) for pair in text.split()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected "x,y x,y ..." but got {text!r}')
+    if any(len(p) != 2 for p in points):
+        raise argparse.ArgumentTypeError(f'Expected "x,y x,y ..." but got {text!r}')
+    return points
+
+
+def _quad_areas(quads):
+    # Shoelace area of (N, 4, 2) quadrilaterals
+    x, y = quads[..., 0], quads[..., 1]
+    return 0.5 * np.abs((x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y).sum(axis=1))
+
+
+class Calibration:
+    """Camera intrinsics + ground homography, applied to detections through cached lookup tables."""
+
+    def __init__(self, image_size, homography, camera_matrix=None, dist_coeffs=None, units='cm', path=None,
+                 step=8):
+        self.image_size = tuple(int(v) for v in image_size)
+        self.homography = np.asarray(homography, dtype=np.float64).reshape(3, 3)
+        self.camera_matrix = None if camera_matrix is None else np.asarray(camera_matrix, dtype=np.float64)
+        self.dist_coeffs = None if dist_coeffs is None else np.asarray(dist_coeffs, dtype=np.float64).ravel()
+        self.units = units
+        self.path = path
+        self.step = max(1, int(step))
+        self._tables = {}
+        # Detect workers of the threaded pipeline may ask for the same table at once
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, step=8):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if data.get('homography') is None:
+            raise ValueError(f'{path} has no ground homography (run: calibration.py ground -o {path} ...)')
+        return cls(data['image_size'], data['homography'], data.get('camera_matrix'), data.get('dist_coeffs'),
+                   data.get('units', 'cm'), path=path, step=step)
+
+    def _key(self, size):
+        parts = [self.image_size, self.homography.round(12).tolist(), size, self.step,
+                 None if self.camera_matrix is None else self.camera_matrix.round(12).tolist(),
+                 None if self.dist_coeffs is None else self.dist_coeffs.round(12).tolist()]
+        return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+    def _cache_path(self, size):
+        return f'{os.path.splitext(self.path)[0]}.{size[0]}x{size[1]}.s{self.step}.npz'
+
+    def pixels_to_world(self, points, size=None):
+        """Exact mapping of (N, 2) pixel points at processing resolution `size` (default: calibrated size)."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if size is not None and tuple(size) != self.image_size:
+            points = points * (np.array(self.image_size, dtype=np.float64) / np.array(size, dtype=np.float64))
+        if self.camera_matrix is not None:
+            # Undistorted pixel coordinates of the calibrated camera (P = K keeps them in pixels)
+            points = cv2.undistortPoints(points, self.camera_matrix, self.dist_coeffs, P=self.camera_matrix)
+        return cv2.perspectiveTransform(points, self.homography).reshape(-1, 2)
+
+    def table(self, size):
+        """(rows, cols, 2) world coordinates of every `step`-th pixel at resolution size = (w, h)."""
+        size = (int(size[0]), int(size[1]))
+        table = self._tables.get(size)
+        if table is not None:
+            return table
+        with self._lock:
+            if size not in self._tables:
+                self._tables[size] = self._build(size)
+        return self._tables[size]
+
+    def _build(self, size):
+        table = None
+        key = self._key(size)
+        cache = self._cache_path(size) if self.path else None
+        if cache and os.path.exists(cache):
+            with np.load(cache) as data:
+                if str(data['key']) == key:
+                    table = data['table']
+        if table is None:
+            w, h = size
+            # Grid covers the last pixel too, so lookups never extrapolate
+            xs = np.arange(0, w - 1 + self.step, self.step, dtype=np.float64)
+            ys = np.arange(0, h - 1 + self.step, self.step, dtype=np.float64)
+            gx, gy = np.meshgrid(xs, ys)
+            world = self.pixels_to_world(np.stack([gx.ravel(), gy.ravel()], axis=1), size)
+            table = world.reshape(len(ys), len(xs), 2).astype(np.float32)
+            if cache:
+                # Renamed into place, so another process never loads a half-written cache
+                tmp = cache + '.tmp'
+                with open(tmp, 'wb') as f:
+                    np.savez(f, table=table, key=key)
+                os.replace(tmp, cache)
+        return table
+
+    def lookup(self, points, size):
+        """World coordinates of (N, 2) pixel points, bilinearly interpolated from table(size)."""
+        table = self.table(size)
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2) / self.step
+        rows, cols = table.shape[:2]
+        x = np.clip(pts[:, 0], 0, cols - 1)
+        y = np.clip(pts[:, 1], 0, rows - 1)
+        x0 = np.minimum(x.astype(np.intp), cols - 2) if cols > 1 else np.zeros(len(x), dtype=np.intp)
+        y0 = np.minimum(y.astype(np.intp), rows - 2) if rows > 1 else np.zeros(len(y), dtype=np.intp)
+        x1 = np.minimum(x0 + 1, cols - 1)
+        y1 = np.minimum(y0 + 1, rows - 1)
+        fx = (x - x0)[:, None]
+        fy = (y - y0)[:, None]
+        top = table[y0, x0] * (1 - fx) + table[y0, x1] * fx
+        bottom = table[y1, x0] * (1 - fx) + table[y1, x1] * fx
+        return top * (1 - fy) + bottom * fy
+
+    def locate(self, detections, frame_shape):
+        """Fill world centroids and world areas of `detections` (found on a frame of frame_shape) in place."""
+        n = len(detections)
+        if not n:
+            return detections
+        h, w = frame_shape[:2]
+        rects = detections.rects.astype(np.float64)
+        x0, y0 = rects[:, 0], rects[:, 1]
+        x1, y1 = x0 + rects[:, 2], y0 + rects[:, 3]
+        # Centroids and the 4 rect corners of every leaf in one lookup
+        corners = np.stack([np.stack([x0, y0], 1), np.stack([x1, y0], 1),
+                            np.stack([x1, y1], 1), np.stack([x0, y1], 1)], 1)
+        world = self.lookup(np.concatenate([detections.centroids, corners.reshape(-1, 2)]), (w, h))
+        detections.records['world'] = world[:n]
+        # Local world / pixel area ratio over the leaf's box (covers perspective and lens scale changes)
+        ratio = _quad_areas(world[n:].reshape(n, 4, 2)) / np.maximum(rects[:, 2] * rects[:, 3], 1.0)
+        detections.records['world_area'] = detections.areas * ratio
+        return detections
+
+    def to_json(self):
+        return {
+            'image_size': list(self.image_size),
+            'camera_matrix': None if self.camera_matrix is None else self.camera_matrix.tolist(),
+            'dist_coeffs': None if self.dist_coeffs is None else self.dist_coeffs.tolist(),
+            'homography': self.homography.tolist(),
+            'units': self.units,
+        }
+
+
+def _read_json(path):
+    if path and os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def _write_json(path, data):
+    # Written to a temp file and renamed, so a crash never leaves half a calibration
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp, path)
+
+
+def calibrate_intrinsics(paths, pattern=(9, 6), square=1.0):
+    """calibrateCamera on chessboard images; returns (rms, camera_matrix, dist_coeffs, image_size)."""
+    objp = np.zeros((pattern[0] * pattern[1], 3), np.float32)
+    objp[:, :2] = np.mgrid[0:pattern[0], 0:pattern[1]].T.reshape(-1, 2) * square
+    obj_points, img_points, size = [], [], None
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+    for path in paths:
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            print(f'WARNING: cannot read {path}')
+            continue
+        if size is None:
+            size = gray.shape[::-1]
+        elif gray.shape[::-1] != size:
+            print(f'WARNING: {path} is {gray.shape[1]}x{gray.shape[0]}, expected {size[0]}x{size[1]}; skipped')
+            continue
+        found, corners = cv2.findChessboardCorners(gray, pattern)
+        if not found:
+            print(f'WARNING: no {pattern[0]}x{pattern[1]} chessboard in {path}')
+            continue
+        obj_points.append(objp)
+        img_points.append(cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria))
+    if len(obj_points) < 3:
+        raise ValueError(f'need at least 3 images with a detected chessboard, got {len(obj_points)}')
+    rms, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera(obj_points, img_points, size, None, None)
+    return rms, camera_matrix, dist_coeffs.ravel(), size
+
+
+def fit_ground(pixels, world, camera_matrix=None, dist_coeffs=None):
+    """Homography from undistorted pixels to world units; returns (H, per-point error in world units)."""
+    pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 1, 2)
+    world = np.asarray(world, dtype=np.float64).reshape(-1, 2)
+    if len(pixels) < 4 or len(pixels) != len(world):
+        raise ValueError('need at least 4 matching pixel / world points')
+    if camera_matrix is not None:
+        pixels = cv2.undistortPoints(pixels, camera_matrix, dist_coeffs, P=camera_matrix)
+    homography, _ = cv2.findHomography(pixels, world)
+    if homography is None:
+        raise ValueError('ground points are degenerate (collinear?)')
+    fitted = cv2.perspectiveTransform(pixels, homography).reshape(-1, 2)
+    return homography, np.linalg.norm(fitted - world, axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build camera / ground-plane calibration files for main.py')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p = sub.add_parser('intrinsics', help='Camera matrix and distortion from chessboard images')
+    p.add_argument('--images', required=True, help="Glob of chessboard images, e.g. 'calib/*.jpg'")
+    p.add_argument('--pattern', type=int, nargs=2, default=(9, 6), metavar=('COLS', 'ROWS'),
+                   help='Inner corners of the chessboard')
+    p.add_argument('--square', type=float, default=1.0, help='Chessboard square size (any unit)')
+    p.add_argument('-o', '--output', required=True, help='Calibration JSON to create or update')
+
+    p = sub.add_parser('ground', help='Ground-plane homography from >= 4 pixel / world point pairs')
+    p.add_argument('--pixels', type=parse_points, required=True, help='"u,v u,v ..." pixel positions')
+    p.add_argument('--world', type=parse_points, required=True, help='"x,y x,y ..." matching world positions')
+    p.add_argument('--size', type=int, nargs=2, metavar=('W', 'H'),
+                   help='Resolution the pixels were measured at (default: from intrinsics)')
+    p.add_argument('--units', default='cm')
+    p.add_argument('-o', '--output', required=True, help='Calibration JSON to create or update')
+
+    p = sub.add_parser('scale', help='Fixed px -> cm scale, origin at the image centre (no lens model)')
+    p.add_argument('--px-to-cm', type=float, required=True)
+    p.add_argument('--size', type=int, nargs=2, required=True, metavar=('W', 'H'))
+    p.add_argument('-o', '--output', required=True, help='Calibration JSON to create')
+    args = parser.parse_args()
+
+    data = _read_json(args.output)
+    if args.cmd == 'intrinsics':
+        paths = sorted(glob.glob(args.images))
+        if not paths:
+            print(f'ERROR: no images match {args.images}')
+            return
+        try:
+            rms, camera_matrix, dist_coeffs, size = calibrate_intrinsics(paths, tuple(args.pattern), args.square)
+        except ValueError as e:
+            print(f'ERROR: {e}')
+            return
+        if data.get('homography') is not None:
+            print('WARNING: the existing ground homography was fitted without these intrinsics; re-run ground')
+        data.update(image_size=list(size), camera_matrix=camera_matrix.tolist(), dist_coeffs=dist_coeffs.tolist())
+        print(f'RMS reprojection error {rms:.3f} px over {len(paths)} images')
+    elif args.cmd == 'ground':
+        size = args.size or data.get('image_size')
+        if size is None:
+            print('ERROR: --size is needed when there are no intrinsics in the file')
+            return
+        if data.get('image_size') and list(size) != list(data['image_size']):
+            print('ERROR: --size differs from the calibrated image_size; measure the pixels at that resolution')
+            return
+        camera_matrix = np.array(data['camera_matrix']) if data.get('camera_matrix') else None
+        dist_coeffs = np.array(data['dist_coeffs']) if data.get('dist_coeffs') else None
+        try:
+            homography, errors = fit_ground(args.pixels, args.world, camera_matrix, dist_coeffs)
+        except ValueError as e:
+            print(f'ERROR: {e}')
+            return
+        data.update(image_size=list(size), homography=homography.tolist(), units=args.units)
+        print(f'Ground fit error: mean {errors.mean():.3f}, max {errors.max():.3f} {args.units}')
+    else:
+        w, h = args.size
+        s = args.px_to_cm
+        # X = (cx - w/2) * s, Y = (h/2 - cy) * s
+        data = Calibration((w, h), [[s, 0, -w / 2.0 * s], [0, -s, h / 2.0 * s], [0, 0, 1]]).to_json()
+    _write_json(args.output, data)
+    print('Saved', args.output)
+
+
+if __name__ == '__main__':
+    main()
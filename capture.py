@@ -0,0 +1,166 @@
+"""
+Threaded frame-prefetch capture for the leaf detector scripts.
+
+Features:
+- Background reader thread decodes frames while the main loop runs detection
+- Bounded ring buffer between the reader and the consumer
+- Selectable policies:
+    latest - only the newest frame is handed out, older ones are dropped
+             (live camera on the robot, keeps latency low)
+    block  - the reader waits when the buffer is full, nothing is dropped
+             (offline video, every frame gets processed)
+- Counters for decoded / dropped / delivered frames
+- set() (e.g. a CAP_PROP_POS_FRAMES seek) drops prefetched frames and
+  resumes decoding from the new position, also after the end of a file
+- Same read()/isOpened()/get()/set()/release() surface as cv2.VideoCapture,
+  so it is a drop-in replacement for the `cap` object in the scripts
+
+Usage:
+    from capture import open_capture
+    cap = open_capture('field.mp4')          # policy 'block' for files
+    cap = open_capture(0)                    # policy 'latest' for cameras
+    ret, frame = cap.read()
+    print(cap.stats())
+"""
+
+import threading
+import time
+from collections import deque
+
+import cv2
+
+POLICY_LATEST = 'latest'
+POLICY_BLOCK = 'block'
+POLICIES = (POLICY_LATEST, POLICY_BLOCK)
+
+
+class ThreadedCapture:
+    """cv2.VideoCapture wrapper that decodes frames on a background thread."""
+
+    def __init__(self, source, policy=POLICY_BLOCK, buffer_size=4):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown capture policy: {policy!r} (expected one of {POLICIES})')
+        self.source = source
+        self.policy = policy
+        self.buffer_size = max(1, int(buffer_size))
+
+        self.cap = cv2.VideoCapture(source)
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        # Serializes access to self.cap between the reader thread and get()/set()
+        self._cap_lock = threading.Lock()
+        self._stopped = False
+        self._eof = False
+        # Bumped by every set(): a frame read before a seek must not land in the cleared buffer
+        self._generation = 0
+
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+        self.frames_delivered = 0
+        self.last_timestamp = None
+
+        self._thread = None
+        if self.cap.isOpened():
+            self._thread = threading.Thread(target=self._reader, name='capture-reader', daemon=True)
+            self._thread.start()
+
+    def _reader(self):
+        while not self._stopped:
+            with self._cap_lock:
+                generation = self._generation
+                ret, frame = self.cap.read()
+            ts = time.perf_counter()
+            if not ret:
+                with self._cond:
+                    if generation != self._generation:
+                        continue
+                    self._eof = True
+                    self._cond.notify_all()
+                    # Idle at the end until set() seeks back (or release()), then decode from there
+                    while generation == self._generation and not self._stopped:
+                        self._cond.wait()
+                continue
+
+            with self._cond:
+                self.frames_decoded += 1
+                if self.policy == POLICY_BLOCK:
+                    while len(self._buffer) >= self.buffer_size and not self._stopped:
+                        self._cond.wait()
+                if generation != self._generation:
+                    # set() seeked while this frame was decoded or waiting for room
+                    continue
+                if self.policy != POLICY_BLOCK and len(self._buffer) >= self.buffer_size:
+                    # Ring buffer full: overwrite the oldest frame
+                    self._buffer.popleft()
+                    self.frames_dropped += 1
+                self._buffer.append((frame, ts))
+                self._cond.notify_all()
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self, timeout=None):
+        with self._cond:
+            while not self._buffer and not self._eof and not self._stopped:
+                if not self._cond.wait(timeout):
+                    return False, None
+            if not self._buffer:
+                return False, None
+
+            if self.policy == POLICY_LATEST:
+                # Skip straight to the newest frame, everything older is stale
+                self.frames_dropped += len(self._buffer) - 1
+                frame, ts = self._buffer.pop()
+                self._buffer.clear()
+            else:
+                frame, ts = self._buffer.popleft()
+            self.frames_delivered += 1
+            self.last_timestamp = ts
+            self._cond.notify_all()
+            return True, frame
+
+    def get(self, prop_id):
+        with self._cap_lock:
+            return self.cap.get(prop_id)
+
+    def set(self, prop_id, value):
+        with self._cap_lock:
+            ok = self.cap.set(prop_id, value)
+            # Seeking invalidates anything already prefetched
+            with self._cond:
+                self._generation += 1
+                self._buffer.clear()
+                self._eof = False
+                self._cond.notify_all()
+        return ok
+
+    def stats(self):
+        with self._cond:
+            return {
+                'decoded': self.frames_decoded,
+                'dropped': self.frames_dropped,
+                'delivered': self.frames_delivered,
+                'buffered': len(self._buffer),
+            }
+
+    def release(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        with self._cap_lock:
+            self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def open_capture(source, policy=None, buffer_size=4):
+    # Cameras (int index) default to latest-frame-only, files never drop frames
+    if policy is None:
+        policy = POLICY_LATEST if isinstance(source, int) else POLICY_BLOCK
+    return ThreadedCapture(source, policy=policy, buffer_size=buffer_size)
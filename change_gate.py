@@ -0,0 +1,193 @@
+"""
+Change-driven recompute: skip detection on frames where nothing moved.
+
+On the fixed overhead rigs the scene is static for long stretches, yet
+segmentation + blob extraction ran on every frame. ChangeGate sits in front
+of them:
+
+- every frame is reduced to a small grayscale image (INTER_AREA, 1/downscale
+  per side) and compared with the image the cached mask was computed from;
+  the per-tile maximum absolute difference decides which tiles changed
+- no tile changed: the previous mask and detections are reused as they are
+- a few tiles changed (at most `local_max` of the frame): only those tiles
+  are re-segmented. A change can move the mask up to the morphology reach
+  (`pad`) outside its tile, so each changed tile grown by `pad` is written back
+  into the cached mask, computed from a crop grown by 2 * pad so the
+  morphology sees the same neighbourhood as on the full frame; blobs are then
+  extracted once from the whole mask
+- otherwise the frame is processed in full
+
+The reference image is only refreshed for recomputed tiles, so a slow drift
+accumulates until it crosses the threshold instead of being missed frame by
+frame. invalidate() (e.g. after a threshold change) forces the next frame to
+be processed in full, and so does every `refresh_every`-th frame, which
+bounds how long a cached result can live and keeps the cost estimate below
+current.
+
+stats() reports the hit rate and an estimate of the saved time: for every
+reused or partial frame, the rolling cost of a full recompute minus the time
+actually spent. The first full frame pays one-off setup (e.g. the LUT build)
+and is not used for that estimate.
+
+Usage:
+    gate = ChangeGate(threshold=12, tile=64, pad=16)
+    mask, dets = gate.process(frame,
+                              segment=lambda img, buffers: segment_leaves(img, lower, upper, buffers=buffers),
+                              extract=lambda mask: find_leaves(mask, min_area))
+    print(gate.report())
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+from scheduler import merge_rects
+
+
+class ChangeGate:
+    """Reuses the previous mask / detections for unchanged frames and tiles."""
+
+    def __init__(self, threshold=12, tile=64, downscale=8, pad=16, local_max=0.3, refresh_every=300):
+        self.threshold = threshold
+        self.tile = max(downscale, tile - tile % downscale)
+        self.downscale = downscale
+        self.pad = pad
+        self.local_max = local_max
+        self.refresh_every = refresh_every
+        self._since_full = 0
+        self._ref = None
+        self._small = None
+        self.mask = None
+        self.detections = None
+        # Rolling full-recompute cost (ms) for the saved-time estimate; the first one is warm-up
+        self._full_ms = None
+        self._warm = False
+
+        self.frames = 0
+        self.hits = 0
+        self.partial = 0
+        self.full = 0
+        self.spent_ms = 0.0
+        self.saved_ms = 0.0
+        self.pixels = 0
+        self.total_pixels = 0
+        # 'hit' / 'partial' / 'full' for the last frame, and its changed tile rects
+        self.last = None
+        self.last_rects = []
+
+    def invalidate(self):
+        self._ref = None
+
+    def _reduce(self, frame):
+        h, w = frame.shape[:2]
+        size = (max(1, w // self.downscale), max(1, h // self.downscale))
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self._small = cv2.resize(gray, size, dst=self._small, interpolation=cv2.INTER_AREA)
+        return self._small
+
+    def changed_tiles(self, small):
+        # Boolean (rows, cols) grid of tiles whose max abs difference exceeds the threshold
+        diff = cv2.absdiff(small, self._ref)
+        st = self.tile // self.downscale
+        h, w = diff.shape
+        rows, cols = -(-h // st), -(-w // st)
+        if rows * st != h or cols * st != w:
+            diff = np.pad(diff, ((0, rows * st - h), (0, cols * st - w)))
+        return diff.reshape(rows, st, cols, st).max(axis=(1, 3)) > self.threshold
+
+    def _tile_rects(self, grid, shape, pad=0):
+        # Changed tiles as [x0, y0, x1, y1], grown by pad and merged where they overlap
+        h, w = shape[:2]
+        t = self.tile
+        ys, xs = np.nonzero(grid)
+        rects = [[max(0, x * t - pad), max(0, y * t - pad), min(w, (x + 1) * t + pad), min(h, (y + 1) * t + pad)]
+                 for y, x in zip(ys.tolist(), xs.tolist())]
+        return merge_rects(rects)
+
+    def process(self, frame, segment, extract, buffers=None):
+        """segment(img, buffers) -> mask, extract(mask) -> Detections; returns (mask, detections)."""
+        t0 = time.perf_counter()
+        small = self._reduce(frame)
+        h, w = frame.shape[:2]
+        self.frames += 1
+        self.total_pixels += h * w
+
+        mode = 'full'
+        self._since_full += 1
+        if self._since_full < self.refresh_every and self._ref is not None and self._ref.shape == small.shape and self.mask.shape == (h, w):
+            grid = self.changed_tiles(small)
+            if not grid.any():
+                mode = 'hit'
+            elif grid.mean() <= self.local_max:
+                mode = 'partial'
+
+        if mode == 'hit':
+            self.hits += 1
+            self.last, self.last_rects = mode, []
+            self._account(t0)
+            return self.mask, self.detections
+
+        if mode == 'partial':
+            pad = self.pad
+            rects = self._tile_rects(grid, frame.shape, pad)
+            for x0, y0, x1, y1 in rects:
+                px0, py0 = max(0, x0 - pad), max(0, y0 - pad)
+                px1, py1 = min(w, x1 + pad), min(h, y1 + pad)
+                crop = segment(frame[py0:py1, px0:px1], None)
+                self.mask[y0:y1, x0:x1] = crop[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+                self.pixels += (px1 - px0) * (py1 - py0)
+            # The reference moves on only where the mask was brought up to date
+            st = self.tile // self.downscale
+            for y, x in zip(*np.nonzero(grid)):
+                self._ref[y * st:(y + 1) * st, x * st:(x + 1) * st] = small[y * st:(y + 1) * st, x * st:(x + 1) * st]
+            self.partial += 1
+            self.last_rects = rects
+        else:
+            mask = segment(frame, buffers)
+            # Own copy: pooled buffers are overwritten by the next frame
+            if self.mask is None or self.mask.shape != mask.shape:
+                self.mask = mask.copy()
+            else:
+                np.copyto(self.mask, mask)
+            self._ref = small.copy()
+            self._since_full = 0
+            self.pixels += h * w
+            self.full += 1
+            self.last_rects = []
+
+        self.detections = extract(self.mask)
+        self.last = mode
+        self._account(t0)
+        return self.mask, self.detections
+
+    def _account(self, t0):
+        ms = (time.perf_counter() - t0) * 1000.0
+        self.spent_ms += ms
+        if self.last == 'full':
+            if not self._warm:
+                self._warm = True
+            else:
+                self._full_ms = ms if self._full_ms is None else 0.9 * self._full_ms + 0.1 * ms
+        elif self._full_ms is not None:
+            self.saved_ms += max(0.0, self._full_ms - ms)
+
+    def stats(self):
+        n = max(1, self.frames)
+        return {
+            'frames': self.frames,
+            'hits': self.hits,
+            'partial': self.partial,
+            'full': self.full,
+            'hit_rate': self.hits / n,
+            'recomputed_fraction': self.pixels / max(1, self.total_pixels),
+            'spent_ms': self.spent_ms,
+            # None until a full recompute has been timed after the warm-up frame
+            'saved_ms': self.saved_ms if self._full_ms is not None else None,
+        }
+
+    def report(self):
+        s = self.stats()
+        return (f"Change gate: {s['frames']} frames, {s['hits']} reused ({s['hit_rate']:.0%}), "
+                f"{s['partial']} partial, {s['full']} full, {s['recomputed_fraction']:.0%} of pixels recomputed, "
+                + (f"~{s['saved_ms'] / 1000.0:.1f} s saved" if s['saved_ms'] is not None else 'saved time not measured yet'))
@@ -0,0 +1,217 @@
+"""
+Streaming detection output for the leaf detector.
+
+Features:
+- Per-frame records: frame index, timestamp, rect, centroid, area, track ID
+  (-1 when tracking is off), matching preset (-1 unless detecting with a
+  preset set), ground-plane position and area (NaN / omitted without a
+  calibration) and an optional simplified contour
+- JSONL sink (one JSON object per frame) for analytics and debugging
+- Compact fixed-width binary sink (one record per detection) for pickers
+- All formatting and disk writes happen on a background thread; the capture
+  loop only enqueues the detections it already has, so it never waits on disk
+- BinaryDetectionLog memory-maps the binary format for random access by frame
+
+Usage:
+    sink = open_sink('run.jsonl')          # or 'run.ldet' for binary
+    sink.write(frame_idx, detections, timestamp)
+    sink.close()
+
+    log = BinaryDetectionLog('run.ldet')
+    recs = log.frame(1200)                 # structured array of that frame's leaves
+"""
+
+import abc
+import json
+import math
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Version 2 added track_id, version 3 preset, version 4 world position / area
+BINARY_MAGIC = b'LEAFDET4'
+BINARY_EXTENSIONS = ('.ldet', '.bin')
+
+RECORD_DTYPE = np.dtype([
+    ('frame', '<u4'),
+    ('timestamp', '<f8'),
+    ('x', '<i4'), ('y', '<i4'), ('w', '<i4'), ('h', '<i4'),
+    ('cx', '<f4'), ('cy', '<f4'),
+    ('area', '<f4'),
+    ('track_id', '<i4'),
+    ('preset', '<i4'),
+    ('wx', '<f4'), ('wy', '<f4'),
+    ('warea', '<f4'),
+])
+
+
+class DetectionSink(abc.ABC):
+    """Base class: queues frames and formats/writes them on a writer thread."""
+
+    file_mode = 'wb'
+
+    def __init__(self, path, flush_interval=0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.frames_written = 0
+        self.records_written = 0
+        self._queue = queue.Queue()
+        self._file = open(path, self.file_mode)
+        self._write_header()
+        self._thread = threading.Thread(target=self._writer, name='detection-sink', daemon=True)
+        self._thread.start()
+
+    def _write_header(self):
+        pass
+
+    def write(self, frame_idx, detections, timestamp=None):
+        # Only a queue put on the caller's thread; Detections arrays are not copied
+        if timestamp is None:
+            timestamp = time.time()
+        self._queue.put((frame_idx, timestamp, detections))
+
+    def _writer(self):
+        # The file object buffers writes; the disk is only flushed every flush_interval
+        last_flush = time.perf_counter()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                self._write_frame(*item)
+            now = time.perf_counter()
+            if now - last_flush >= self.flush_interval:
+                self._file.flush()
+                last_flush = now
+        self._file.flush()
+
+    @abc.abstractmethod
+    def _write_frame(self, frame_idx, timestamp, detections):
+        """Format and write one frame's detections (runs on the writer thread)."""
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonlSink(DetectionSink):
+    """One JSON object per frame."""
+
+    file_mode = 'w'
+
+    def __init__(self, path, contour_epsilon=None, flush_interval=0.5):
+        # contour_epsilon: approxPolyDP tolerance in pixels, None = no contours in output
+        self.contour_epsilon = contour_epsilon
+        super().__init__(path, flush_interval=flush_interval)
+
+    def _write_frame(self, frame_idx, timestamp, detections):
+        dets = []
+        located = bool(len(detections)) and not np.isnan(detections.world[:, 0]).all()
+        world = detections.world.tolist() if located else None
+        world_areas = detections.world_areas.tolist() if located else None
+        for i, (rect, area, centroid, tid, preset) in enumerate(zip(
+                detections.rects.tolist(), detections.areas.tolist(), detections.centroids.tolist(),
+                detections.track_ids.tolist(), detections.presets.tolist())):
+            rec = {
+                'rect': rect,
+                'centroid': [round(centroid[0], 2), round(centroid[1], 2)],
+                'area': area,
+            }
+            if tid >= 0:
+                rec['id'] = tid
+            if preset >= 0:
+                rec['preset'] = preset
+            if located and not math.isnan(world[i][0]):
+                rec['world'] = [round(world[i][0], 2), round(world[i][1], 2)]
+                rec['world_area'] = round(world_areas[i], 2)
+            if self.contour_epsilon is not None:
+                approx = cv2.approxPolyDP(detections.contour(i), self.contour_epsilon, True)
+                rec['contour'] = [] if approx is None else approx.reshape(-1, 2).tolist()
+            dets.append(rec)
+        self._file.write(json.dumps({'frame': int(frame_idx), 'ts': timestamp, 'detections': dets}) + '\n')
+        self.frames_written += 1
+        self.records_written += len(dets)
+
+
+class BinarySink(DetectionSink):
+    """Fixed-width little-endian records (RECORD_DTYPE), one per detection."""
+
+    def _write_header(self):
+        self._file.write(BINARY_MAGIC)
+        self._file.write(np.uint32(RECORD_DTYPE.itemsize).tobytes())
+
+    def _write_frame(self, frame_idx, timestamp, detections):
+        self.frames_written += 1
+        if not detections:
+            return
+        recs = np.empty(len(detections), dtype=RECORD_DTYPE)
+        recs['frame'] = frame_idx
+        recs['timestamp'] = timestamp
+        rects = detections.rects
+        recs['x'], recs['y'], recs['w'], recs['h'] = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+        recs['cx'] = detections.centroids[:, 0]
+        recs['cy'] = detections.centroids[:, 1]
+        recs['area'] = detections.areas
+        recs['track_id'] = detections.track_ids
+        recs['preset'] = detections.presets
+        recs['wx'] = detections.world[:, 0]
+        recs['wy'] = detections.world[:, 1]
+        recs['warea'] = detections.world_areas
+        self._file.write(recs.tobytes())
+        self.records_written += len(recs)
+
+
+class BinaryDetectionLog:
+    """Read-only memory-mapped view of a BinarySink file."""
+
+    header_size = len(BINARY_MAGIC) + 4
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(self.header_size)
+        if header[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+            raise ValueError(f'{path} is not a binary detection log')
+        itemsize = int(np.frombuffer(header[len(BINARY_MAGIC):], dtype='<u4')[0])
+        if itemsize != RECORD_DTYPE.itemsize:
+            raise ValueError(f'{path}: record size {itemsize} does not match {RECORD_DTYPE.itemsize}')
+        self.path = path
+        try:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=self.header_size)
+        except ValueError:
+            # Empty log: np.memmap refuses zero-length mappings
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def frame(self, frame_idx):
+        # Records are written in frame order, so a binary search finds the slice
+        frames = self.records['frame']
+        lo = np.searchsorted(frames, frame_idx, side='left')
+        hi = np.searchsorted(frames, frame_idx, side='right')
+        return self.records[lo:hi]
+
+    def frame_range(self, start, stop):
+        frames = self.records['frame']
+        lo = np.searchsorted(frames, start, side='left')
+        hi = np.searchsorted(frames, stop, side='left')
+        return self.records[lo:hi]
+
+
+def open_sink(path, contour_epsilon=None, flush_interval=0.5):
+    if path.lower().endswith(BINARY_EXTENSIONS):
+        return BinarySink(path, flush_interval=flush_interval)
+    return JsonlSink(path, contour_epsilon=contour_epsilon, flush_interval=flush_interval)
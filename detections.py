@@ -0,0 +1,278 @@
+"""
+Array-backed detection container for the leaf detector.
+
+detect_leaves used to build one dict (or 6-tuple) per contour and
+draw_detections looped over them in Python. Detections are kept as a
+handful of NumPy arrays instead, so the sinks, the tracker and the robot
+link read whole columns without a per-leaf loop:
+
+- records:  structured array, one row per leaf: rect (x, y, w, h), area,
+            centroid (cx, cy) and the [start, end) offsets of its contour
+- points:   all contour points of the frame in one flat (P, 2) int32 buffer
+
+Filtering only selects rows of `records`; the point buffer is shared, never
+copied.
+
+Detections can also come straight from cv2.connectedComponentsWithStats
+(from_components): areas, boxes and centroids of every blob in one call,
+no findContours at all. Contours are then extracted lazily, per blob, only
+when something actually draws or exports them. Note that component areas
+are pixel counts, slightly larger than the polygon area of the contour.
+
+Area (shoelace, same as cv2.contourArea), bounding rect (same as
+cv2.boundingRect) and centroid (same as cv2.moments) are computed for every
+contour at once with np.add/minimum/maximum.reduceat, the min-area filter is
+a boolean mask, and drawing is batched into a few OpenCV calls. Extraction
+costs about the same as the old contourArea/boundingRect loop (which had no
+centroids) and drawing about the same as the old draw loop; compare with
+`python benchmark.py blobs`.
+
+Usage:
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    dets = Detections.from_contours(contours, min_area=800)
+    out = dets.draw(frame)
+    dets.rects, dets.areas, dets.centroids, dets.contour(0)
+    dets.track_ids                                          # set by tracker.LeafTracker, else -1
+    dets.presets                                            # matching preset index (multi-preset), else -1
+    dets.world, dets.world_areas                            # set by calibration.Calibration.locate, else NaN
+
+    dets = Detections.from_components(mask, min_area=800)   # contours on demand
+"""
+
+import cv2
+import numpy as np
+
+DETECTION_DTYPE = np.dtype([
+    ('rect', '<i4', (4,)),
+    ('area', '<f8'),
+    ('centroid', '<f4', (2,)),
+    ('start', '<i8'),
+    ('end', '<i8'),
+    ('label', '<i4'),
+    ('track_id', '<i4'),
+    ('preset', '<i4'),
+    ('world', '<f4', (2,)),
+    ('world_area', '<f4'),
+])
+
+_EMPTY_POINTS = np.empty((0, 2), dtype=np.int32)
+
+# Box colours (BGR) by preset index when detecting with several presets
+PRESET_COLORS = ((0, 255, 0), (0, 255, 255), (0, 128, 255), (255, 0, 255),
+                 (255, 255, 0), (255, 0, 0), (0, 0, 255), (255, 255, 255))
+
+
+def records_equal(a, b):
+    # Field by field: world / world_area are NaN without a calibration, and NaN != NaN in np.array_equal
+    if a.dtype != b.dtype or a.shape != b.shape:
+        return False
+    return all(np.array_equal(a[name], b[name], equal_nan=a.dtype[name].base.kind == 'f') for name in a.dtype.names)
+
+
+class Detections:
+    """Leaves found in one frame, stored as flat NumPy arrays."""
+
+    __slots__ = ('records', 'points', 'labels', '_lazy_contours')
+
+    def __init__(self, records=None, points=None, labels=None):
+        self.records = np.empty(0, dtype=DETECTION_DTYPE) if records is None else records
+        self.points = _EMPTY_POINTS if points is None else points
+        # Label image from connectedComponents; only set when contours are extracted lazily
+        self.labels = labels
+        self._lazy_contours = {}
+
+    @classmethod
+    def from_contours(cls, contours, min_area=0):
+        n = len(contours)
+        if n == 0:
+            return cls()
+        lengths = np.array(list(map(len, contours)), dtype=np.int64)
+        points = np.concatenate(contours).reshape(-1, 2)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        starts = offsets[:-1]
+
+        # Contiguous float64 coordinates (exact: pixel coordinates stay far below 2**26)
+        # and the next vertex of every point, wrapping each contour back to its start
+        ends = offsets[1:] - 1
+        x = points[:, 0].astype(np.float64)
+        y = points[:, 1].astype(np.float64)
+        xn = np.empty_like(x)
+        yn = np.empty_like(y)
+        xn[:-1] = x[1:]
+        yn[:-1] = y[1:]
+        xn[ends] = x[starts]
+        yn[ends] = y[starts]
+        cross = x * yn
+        cross -= xn * y
+
+        # Shoelace area and polygon first moments, summed per contour
+        area2 = np.add.reduceat(cross, starts)
+        x += xn
+        y += yn
+        mx = np.add.reduceat(x * cross, starts)
+        my = np.add.reduceat(y * cross, starts)
+        lo = np.minimum.reduceat(points, starts, axis=0)
+        hi = np.maximum.reduceat(points, starts, axis=0)
+
+        records = np.empty(n, dtype=DETECTION_DTYPE)
+        records['rect'][:, :2] = lo
+        records['rect'][:, 2:] = hi - lo + 1
+        area = np.abs(area2) * 0.5
+        records['area'] = area
+        records['start'] = starts
+        records['end'] = offsets[1:]
+        records['label'] = -1
+        records['track_id'] = -1
+        records['preset'] = -1
+        records['world'] = np.nan
+        records['world_area'] = np.nan
+
+        # Polygon centroid; degenerate (zero-area) contours fall back to the rect centre
+        centroid = records['centroid']
+        centroid[:] = lo + (hi - lo) / 2.0
+        nz = area2 != 0
+        centroid[nz, 0] = mx[nz] / (3.0 * area2[nz])
+        centroid[nz, 1] = my[nz] / (3.0 * area2[nz])
+
+        dets = cls(records, points)
+        if min_area > 0:
+            dets = dets.filter(area >= min_area)
+        return dets
+
+    @classmethod
+    def from_components(cls, mask, min_area=0, connectivity=8):
+        # Grana's block-based labelling; plain connectedComponentsWithStats picks a slower algorithm here
+        n, labels, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(
+            mask, connectivity, cv2.CV_32S, cv2.CCL_GRANA)
+        # Label 0 is the background
+        stats = stats[1:]
+        keep = stats[:, cv2.CC_STAT_AREA] >= min_area
+        stats = stats[keep]
+        records = np.empty(len(stats), dtype=DETECTION_DTYPE)
+        records['rect'] = stats[:, :4]
+        records['area'] = stats[:, cv2.CC_STAT_AREA]
+        records['centroid'] = centroids[1:][keep]
+        records['start'] = 0
+        records['end'] = 0
+        records['label'] = np.flatnonzero(keep) + 1
+        records['track_id'] = -1
+        records['preset'] = -1
+        records['world'] = np.nan
+        records['world_area'] = np.nan
+        return cls(records, labels=labels)
+
+    def filter(self, keep):
+        keep = np.asarray(keep, dtype=bool)
+        if keep.all():
+            return self
+        return Detections(self.records[keep], self.points, self.labels)
+
+    def filter_area(self, min_area):
+        return self.filter(self.records['area'] >= min_area)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def rects(self):
+        return self.records['rect']
+
+    @property
+    def areas(self):
+        return self.records['area']
+
+    @property
+    def centroids(self):
+        return self.records['centroid']
+
+    @property
+    def track_ids(self):
+        # -1 until a LeafTracker has associated the detection
+        return self.records['track_id']
+
+    @property
+    def presets(self):
+        # Index of the preset (HSV range) that matched most of the leaf, -1 if not labelled
+        return self.records['preset']
+
+    @property
+    def world(self):
+        # Ground-plane centroid in calibration units (calibration.Calibration.locate), NaN if not located
+        return self.records['world']
+
+    @property
+    def world_areas(self):
+        return self.records['world_area']
+
+    def blob_mask(self, i):
+        # Boolean mask of leaf i's own pixels inside its bounding rect
+        rec = self.records[i]
+        x, y, w, h = rec['rect'].tolist()
+        if rec['label'] >= 0 and self.labels is not None:
+            return self.labels[y:y + h, x:x + w] == rec['label']
+        blob = np.zeros((h, w), dtype=np.uint8)
+        cv2.drawContours(blob, [self.contour(i)], -1, 1, -1, offset=(-x, -y))
+        return blob.view(bool)
+
+    def _extract_contour(self, rec):
+        # Trace only the blob's own bounding box in the label image
+        label = int(rec['label'])
+        cached = self._lazy_contours.get(label)
+        if cached is None:
+            x, y, w, h = rec['rect'].tolist()
+            blob = (self.labels[y:y + h, x:x + w] == label).view(np.uint8)
+            cs, _ = cv2.findContours(blob, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x, y))
+            cached = max(cs, key=len) if cs else np.empty((0, 1, 2), dtype=np.int32)
+            self._lazy_contours[label] = cached
+        return cached
+
+    def contour(self, i):
+        # (n, 1, 2) in the layout cv2 functions expect
+        rec = self.records[i]
+        if rec['label'] >= 0 and self.labels is not None:
+            return self._extract_contour(rec)
+        return self.points[rec['start']:rec['end']].reshape(-1, 1, 2)
+
+    def contours(self):
+        if self.labels is not None:
+            return [self.contour(i) for i in range(len(self))]
+        pts = self.points
+        return [pts[a:b].reshape(-1, 1, 2) for a, b in zip(self.records['start'].tolist(),
+                                                          self.records['end'].tolist())]
+
+    def box_polygons(self):
+        # Rect corners as (N, 4, 2) so all rectangles go through one polylines call
+        r = self.rects
+        x0, y0 = r[:, 0], r[:, 1]
+        x1, y1 = x0 + r[:, 2], y0 + r[:, 3]
+        return np.stack([np.stack([x0, y0], 1), np.stack([x1, y0], 1),
+                         np.stack([x1, y1], 1), np.stack([x0, y1], 1)], 1).astype(np.int32)
+
+    def draw(self, frame, show_contours=True, show_area=True, copy=True,
+             box_color=(0, 255, 0), contour_color=(0, 128, 255)):
+        out = frame.copy() if copy else frame
+        if not len(self):
+            return out
+        presets = self.presets
+        boxes = self.box_polygons()
+        if (presets >= 0).any():
+            # One polylines call per preset, each in its own colour
+            colors = [PRESET_COLORS[p % len(PRESET_COLORS)] if p >= 0 else box_color for p in presets.tolist()]
+            for p in np.unique(presets).tolist():
+                color = PRESET_COLORS[p % len(PRESET_COLORS)] if p >= 0 else box_color
+                cv2.polylines(out, list(boxes[presets == p]), True, color, 2)
+        else:
+            colors = [box_color] * len(self)
+            cv2.polylines(out, list(boxes), True, box_color, 2)
+        if show_contours:
+            cv2.drawContours(out, self.contours(), -1, contour_color, 1)
+        if show_area:
+            for (x, y, _, _), area, color in zip(self.rects.tolist(), self.areas.tolist(), colors):
+                cv2.putText(out, f"{int(area)}", (x, y - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+        tracked = self.track_ids >= 0
+        if tracked.any():
+            for (cx, cy), tid in zip(self.centroids[tracked].tolist(), self.track_ids[tracked].tolist()):
+                cv2.putText(out, f"#{tid}", (int(cx) - 10, int(cy) + 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                            (255, 255, 255), 2)
+        return out
@@ -0,0 +1,432 @@
+"""
+Shared-memory frame ring: one capture daemon, any number of reader processes.
+
+cv2.VideoCapture can only be opened by one process, so the live display,
+the recorder and the detector cannot each open the camera. The capture
+daemon opens it once and writes every decoded frame into a ring of `slots`
+frames in one multiprocessing.shared_memory segment; readers attach by name
+and get the frames as NumPy views of the segment, without pickling or
+copying:
+
+- the header holds the layout (slots, shape, dtype), the sequence number of
+  the newest frame, the daemon's pid and a closed flag, so a reader only
+  needs the ring's name
+- every slot has a sequence number and a capture timestamp. The writer
+  marks a slot -1 while it copies a frame in and stores the slot's sequence
+  number after the copy; a reader checks the number when it takes the frame
+  and again after it used it (valid()), and drops the frame if it changed
+- the writer never waits for readers. A reader that falls behind skips
+  ahead, to the newest frame (policy 'latest', for live use) or to the
+  oldest frame that is not about to be overwritten (policy 'next'), and
+  counts the frames it skipped
+- readers poll the head sequence number (every 0.5 ms while waiting), there
+  is no cross-process wakeup
+- the daemon unlinks the segment when it exits (also on SIGTERM); readers
+  see `closed` and get end-of-stream. A segment left behind by a killed
+  daemon is replaced by the next daemon with the same name
+
+Usage:
+    python frame_ring.py serve --camera 0 --name leafcam              # capture daemon
+    python frame_ring.py serve --video field.mp4 --name leafcam       # file, paced at its frame rate
+    python frame_ring.py watch --name leafcam --delay 100             # (slow) reader: rate / skips / latency
+    python leaf_detector.py --ring leafcam                            # detector on the daemon's frames
+
+    reader = RingReader(FrameRing.attach('leafcam'))
+    seq, ts, frame = reader.read()           # view into shared memory
+    ...use frame...
+    if not reader.ring.valid(seq): ...       # overwritten while it was in use
+"""
+
+import argparse
+import os
+import signal
+import time
+from collections import deque
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+MAGIC = 0x4C46524E47  # 'LFRNG'
+VERSION = 1
+POLICIES = ('latest', 'next')
+
+# int64 header fields
+_MAGIC, _VERSION, _SLOTS, _H, _W, _C, _DTYPE, _HEAD, _CLOSED, _PID = range(10)
+_HEADER_WORDS = 16
+_ALIGN = 64
+
+# Segments created by this process; attaching to one of them must not touch the resource tracker
+_CREATED = set()
+
+
+def _layout(slots, shape, dtype):
+    frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    frames_at = 8 * _HEADER_WORDS + 16 * slots
+    frames_at = (frames_at + _ALIGN - 1) // _ALIGN * _ALIGN
+    return frames_at, frames_at + frame_bytes * slots
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class FrameRing:
+    """Ring of equally sized frames in one named shared-memory segment (use create() / attach())."""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.name = shm.name
+        self._header = np.ndarray((_HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        if self._header[_MAGIC] != MAGIC or self._header[_VERSION] != VERSION:
+            shm.close()
+            raise ValueError(f'{shm.name} is not a version {VERSION} frame ring')
+        self.slots = int(self._header[_SLOTS])
+        h, w, c = (int(v) for v in self._header[[_H, _W, _C]])
+        self.shape = (h, w, c) if c else (h, w)
+        self.dtype = np.dtype(chr(int(self._header[_DTYPE])))
+        frames_at, _ = _layout(self.slots, self.shape, self.dtype)
+        self._seqs = np.ndarray((self.slots,), dtype=np.int64, buffer=shm.buf, offset=8 * _HEADER_WORDS)
+        self._stamps = np.ndarray((self.slots,), dtype=np.float64, buffer=shm.buf,
+                                  offset=8 * _HEADER_WORDS + 8 * self.slots)
+        self._frames = np.ndarray((self.slots,) + self.shape, dtype=self.dtype, buffer=shm.buf, offset=frames_at)
+        self._next = int(self._header[_HEAD]) + 1
+
+    @classmethod
+    def create(cls, name, shape, dtype=np.uint8, slots=8):
+        """New ring owned by this process (name=None: a generated name). A stale ring of a dead writer is replaced."""
+        if len(shape) not in (2, 3):
+            raise ValueError(f'frames must be 2-D or 3-D, got shape {shape}')
+        dtype = np.dtype(dtype)
+        _, size = _layout(slots, shape, dtype)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            old = cls.attach(name)
+            pid = int(old._header[_PID])
+            alive = not old.closed and _pid_alive(pid)
+            old.close()
+            if alive:
+                raise FileExistsError(f'frame ring {name} is still being written by pid {pid}')
+            shared_memory.SharedMemory(name=name).unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _CREATED.add(shm.name)
+        header = np.ndarray((_HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[[_SLOTS, _H, _W, _C, _DTYPE]] = (slots, shape[0], shape[1], shape[2] if len(shape) == 3 else 0,
+                                                ord(dtype.char))
+        header[_HEAD] = -1
+        header[_PID] = os.getpid()
+        np.ndarray((slots,), dtype=np.int64, buffer=shm.buf, offset=8 * _HEADER_WORDS)[:] = -1
+        header[_VERSION] = VERSION
+        # Magic last: a reader attaching during create() sees an invalid ring, not a half-initialized one
+        header[_MAGIC] = MAGIC
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Existing ring by name; FileNotFoundError while no daemon has created it."""
+        shm = shared_memory.SharedMemory(name=name)
+        if shm.name not in _CREATED:
+            # Python < 3.13 registers attached segments with this process's resource tracker, which would
+            # unlink them when this process exits; only the creating process owns the segment
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def head(self):
+        """Sequence number of the newest complete frame (-1: none yet)."""
+        return int(self._header[_HEAD])
+
+    @property
+    def closed(self):
+        return bool(self._header[_CLOSED])
+
+    def writer_alive(self):
+        return not self.closed and _pid_alive(int(self._header[_PID]))
+
+    def write(self, frame, timestamp=None):
+        """Copy `frame` into the next slot (the writer never waits); returns its sequence number."""
+        if frame.shape != self.shape or frame.dtype != self.dtype:
+            raise ValueError(f'frame {frame.shape} {frame.dtype} does not fit ring {self.shape} {self.dtype}')
+        seq = self._next
+        slot = seq % self.slots
+        self._seqs[slot] = -1
+        np.copyto(self._frames[slot], frame)
+        self._stamps[slot] = time.perf_counter() if timestamp is None else timestamp
+        self._seqs[slot] = seq
+        self._header[_HEAD] = seq
+        self._next = seq + 1
+        return seq
+
+    def valid(self, seq):
+        """True while frame `seq` is still in its slot (not overwritten, not being written)."""
+        return int(self._seqs[seq % self.slots]) == seq
+
+    def view(self, seq):
+        """Zero-copy view of frame `seq`, or None if its slot no longer holds it."""
+        return self._frames[seq % self.slots] if self.valid(seq) else None
+
+    def timestamp(self, seq):
+        return float(self._stamps[seq % self.slots])
+
+    def close(self):
+        """Detach (views of this ring must be gone); the owner also marks the ring closed and unlinks it."""
+        if self.owner:
+            self._header[_CLOSED] = 1
+        self._header = self._seqs = self._stamps = self._frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _CREATED.discard(self.shm.name)
+
+
+class RingReader:
+    """One consumer's position in a FrameRing; skips ahead instead of holding the writer back."""
+
+    def __init__(self, ring, policy='latest', poll=0.0005):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown ring policy: {policy!r} (expected one of {POLICIES})')
+        self.ring = ring
+        self.policy = policy
+        self.poll = poll
+        self.last = -1
+        self.frames_read = 0
+        self.frames_skipped = 0
+        self.frames_torn = 0
+
+    def poll_frame(self):
+        """(seq, timestamp, view) of the next frame to read, or None if there is no newer frame yet."""
+        ring = self.ring
+        while True:
+            head = ring.head
+            if head <= self.last:
+                return None
+            if self.policy == 'latest' or self.last < 0:
+                seq = head
+            else:
+                # head + 1 reuses the slot of head - slots + 1, so that one may already be going
+                seq = max(self.last + 1, head - ring.slots + 2)
+            if self.last >= 0:
+                self.frames_skipped += seq - self.last - 1
+            self.last = seq
+            view = ring.view(seq)
+            ts = ring.timestamp(seq)
+            if view is not None and ring.valid(seq):
+                self.frames_read += 1
+                return seq, ts, view
+            # Overwritten between reading head and taking the slot: try again from the new head
+            self.frames_torn += 1
+
+    def read(self, timeout=None):
+        """Next frame as (seq, timestamp, view); None after `timeout` seconds or at the end of the stream."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        checked = time.perf_counter()
+        while True:
+            item = self.poll_frame()
+            if item is not None:
+                return item
+            now = time.perf_counter()
+            if self.ring.closed or (deadline is not None and now >= deadline):
+                return None
+            if now - checked > 1.0:
+                # A killed daemon never sets closed
+                checked = now
+                if not self.ring.writer_alive():
+                    return None
+            time.sleep(self.poll)
+
+    def stats(self):
+        return {'read': self.frames_read, 'skipped': self.frames_skipped, 'torn': self.frames_torn}
+
+
+class RingCapture:
+    """cv2.VideoCapture-like reader of a FrameRing, a drop-in for the `cap` object in main.py.
+
+    read() returns views into the ring (copy=False) or private copies (copy=True, for frames that wait in
+    a queue). 'late' counts frames that were overwritten before the next read(), i.e. possibly while the
+    caller was still working on the view.
+    """
+
+    def __init__(self, name, policy='latest', copy=False):
+        self.reader = RingReader(FrameRing.attach(name), policy=policy)
+        self.copy = copy
+        self.last_timestamp = None
+        self.last_seq = None
+        self.frames_late = 0
+
+    def isOpened(self):
+        return self.reader.ring is not None
+
+    def read(self, timeout=None):
+        if self.last_seq is not None and not self.copy and not self.reader.ring.valid(self.last_seq):
+            self.frames_late += 1
+        while True:
+            item = self.reader.read(timeout)
+            if item is None:
+                return False, None
+            seq, ts, frame = item
+            if not self.copy:
+                break
+            frame = frame.copy()
+            if self.reader.ring.valid(seq):
+                break
+            self.reader.frames_torn += 1
+        self.last_seq, self.last_timestamp = seq, ts
+        return True, frame
+
+    def get(self, prop_id):
+        import cv2
+
+        ring = self.reader.ring
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(ring.shape[1])
+        if prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(ring.shape[0])
+        return 0.0
+
+    def set(self, prop_id, value):
+        return False
+
+    def stats(self):
+        stats = self.reader.stats()
+        stats['late'] = self.frames_late
+        return stats
+
+    def release(self):
+        if self.reader.ring is not None:
+            self.reader.ring.close()
+            self.reader.ring = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _interrupt(signum, frame):
+    # SIGTERM stops the daemon like Ctrl-C, so the ring is still closed and unlinked
+    raise KeyboardInterrupt
+
+
+def serve(source, name, slots=8, fps=None, report_every=5.0):
+    """Capture daemon: decode `source` once and write every frame into the ring `name` until it ends."""
+    import cv2
+
+    from capture import open_capture
+
+    cap = open_capture(source)
+    if not cap.isOpened():
+        print(f'ERROR: Cannot open video source {source}')
+        return 1
+    if fps is None and not isinstance(source, int):
+        # Files are replayed like a camera, at their own frame rate
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    signal.signal(signal.SIGTERM, _interrupt)
+
+    ring = None
+    written = 0
+    t0 = last_report = time.perf_counter()
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if ring is None:
+                ring = FrameRing.create(name, frame.shape, frame.dtype, slots)
+                print(f'Frame ring {ring.name}: {slots} x {frame.shape} {frame.dtype}')
+            if fps:
+                time.sleep(max(0.0, t0 + written / fps - time.perf_counter()))
+            ring.write(frame, cap.last_timestamp if not fps else None)
+            written += 1
+            now = time.perf_counter()
+            if now - last_report > report_every:
+                print(f'{written} frames written, {written / (now - t0):.1f} fps')
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.release()
+        if ring is not None:
+            ring.close()
+        elapsed = time.perf_counter() - t0
+        print(f'Capture daemon stopped: {written} frames in {elapsed:.1f}s')
+    return 0
+
+
+def watch(name, seconds=10.0, delay_ms=0.0, policy='latest', show=False):
+    """Reader for trying the ring out: frame rate, skipped / torn frames, capture -> read latency."""
+    try:
+        reader = RingReader(FrameRing.attach(name), policy=policy)
+    except FileNotFoundError:
+        print(f'ERROR: no frame ring named {name} (start: python frame_ring.py serve --name {name})')
+        return 1
+    if show:
+        import cv2
+    latency_ms = deque(maxlen=1000)
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        item = reader.read(timeout=1.0)
+        if item is None:
+            if reader.ring.closed or not reader.ring.writer_alive():
+                print('Capture daemon has stopped')
+                break
+            continue
+        seq, ts, frame = item
+        latency_ms.append((time.perf_counter() - ts) * 1000.0)
+        if show:
+            cv2.imshow(name, frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+        if delay_ms:
+            # Simulated slow consumer: the frame stays in use for delay_ms
+            time.sleep(delay_ms / 1000.0)
+        if not reader.ring.valid(seq):
+            reader.frames_torn += 1
+        frame = None
+    elapsed = time.perf_counter() - t0
+    stats = reader.stats()
+    text = f"{stats['read']} frames in {elapsed:.1f}s ({stats['read'] / elapsed:.1f} fps), {stats['skipped']} " \
+           f"skipped, {stats['torn']} overwritten while in use"
+    if latency_ms:
+        p50, p95 = np.percentile(np.array(latency_ms), [50, 95]).tolist()
+        text += f', capture -> read p50 {p50:.2f} ms, p95 {p95:.2f} ms'
+    print(text)
+    reader.ring.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared-memory frame ring: capture daemon and reader')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p = sub.add_parser('serve', help='Capture daemon: write decoded frames into the ring')
+    p.add_argument('--video', '-v', help='Path to video file (omit to use camera)')
+    p.add_argument('--camera', '-c', type=int, default=0, help='Camera index (default 0)')
+    p.add_argument('--name', default='leafcam', help='Ring (shared-memory segment) name')
+    p.add_argument('--slots', type=int, default=8, help='Frames kept in the ring')
+    p.add_argument('--fps', type=float, default=None, help='Write rate for files (default: the file\'s, 0: max)')
+
+    p = sub.add_parser('watch', help='Attach as a reader and report rate, skips and latency')
+    p.add_argument('--name', default='leafcam')
+    p.add_argument('--seconds', type=float, default=10.0)
+    p.add_argument('--delay', type=float, default=0.0, metavar='MS', help='Simulated work per frame')
+    p.add_argument('--policy', choices=POLICIES, default='latest')
+    p.add_argument('--show', action='store_true', help='Display the frames')
+
+    args = parser.parse_args()
+    if args.cmd == 'serve':
+        return serve(args.video if args.video else args.camera, args.name, slots=args.slots, fps=args.fps)
+    return watch(args.name, seconds=args.seconds, delay_ms=args.delay, policy=args.policy, show=args.show)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -7,7 +7,7 @@ Features:
 - Optional trackbars to tune HSV lower/upper thresholds live
 - Morphological filtering, contour detection, bounding boxes
 - Area and contour filtering to reduce noise
-- Save detected frames/masks with 's' key
+- Save detected frames/masks with 's' key (background writer, the loop never waits on disk)
 
 Dependencies: opencv-python, numpy
 Install: pip install opencv-python numpy
@@ -15,6 +15,22 @@ Install: pip install opencv-python numpy
 Usage:
     python leaf_detector.py            # open default camera
     python leaf_detector.py --video path/to/video.mp4
+    python leaf_detector.py --video path/to/video.mp4 --headless out.jsonl   # batch, no GUI
+    python leaf_detector.py --record run.ldet     # stream detections for the picker
+    python leaf_detector.py --track --detect-every 3   # persistent leaf IDs, detect every 3rd frame
+    python leaf_detector.py --profile --metrics-port 9108   # per-stage ms overlay + /metrics
+    python leaf_detector.py --pipeline --detect-workers 3   # threaded stages, frame order kept
+    python leaf_detector.py --full-every 10 --roi "0,0.5 1,0.5 1,1 0,1"   # lower half, ROI tracking
+    python leaf_detector.py --change-gate --gate-threshold 12   # reuse results while the scene is static
+    python leaf_detector.py --width 3840 --tiles 8   # 4K without downscale, bands segmented in parallel
+    python leaf_detector.py --presets presets.db   # every range saved with 2preset.py, in one pass
+    python leaf_detector.py --presets presets.db --preset-names green yellow brown   # latest of each name
+    python leaf_detector.py --adaptive --adapt-gain   # follow outdoor light: shift S/V bounds, gray-world gain
+    python leaf_detector.py --calibration rig.json --record run.jsonl   # leaf positions in cm (calibration.py)
+    python leaf_detector.py --robot /dev/ttyUSB0 --robot-baud 115200 --track   # targets to the robot, async
+    python leaf_detector.py --robot pty --robot-baud 9600   # local pseudo-terminal stand-in, no hardware
+    python leaf_detector.py --ring leafcam   # frames from a frame_ring.py capture daemon, shared with others
+    python leaf_detector.py --autosave-area 2000 --snapshot-dir dataset   # leaf crops + index.jsonl for training
 
 Controls while running:
     q - quit
@@ -30,17 +46,36 @@ step with the model inference.
 """
 
 import argparse
+import functools
+import itertools
 import os
 import time
-from datetime import datetime
 
 import cv2
 import numpy as np
 
+from capture import POLICIES, open_capture
+from adaptive import AdaptiveThresholds
+from buffers import BufferPool
+from calibration import Calibration
+from change_gate import ChangeGate
+from detection_log import open_sink
+from detections import PRESET_COLORS, Detections
+from frame_ring import RingCapture
+from pipeline import Stage, StagePipeline
+from preset_store import load_preset_set
+from profiling import PROFILER, MetricsExporter
+from robot_link import PtyStandIn, RobotLink, open_port
+from scheduler import ROIScheduler, parse_polygon
+from segmentation import LUTSegmenter, inrange_mask, label_image, pyramid_mask, range_mask
+from snapshot import FORMATS, SnapshotWriter
+from tiling import TileSegmenter
+from tracker import ASSIGNMENTS, LeafTracker
+
 
 def create_trackbar_window(window_name, initial_low=(25, 40, 40), initial_high=(90, 255, 255)):
     cv2.namedWindow(window_name)
-    # Create trackbars for HSV lower and upper bounds
+    # Create trackbars for HSV lower and upper bounds; H_low > H_high selects reds wrapping past 179
     cv2.createTrackbar('H_low', window_name, initial_low[0], 179, lambda x: None)
     cv2.createTrackbar('S_low', window_name, initial_low[1], 255, lambda x: None)
     cv2.createTrackbar('V_low', window_name, initial_low[2], 255, lambda x: None)
@@ -61,62 +96,152 @@ def get_trackbar_values(window_name):
     return lower, upper
 
 
-def preprocess_frame(frame, width=None):
+def preprocess_frame(frame, width=None, buffers=None):
+    # buffers: optional BufferPool, results are written into its reused arrays
     if width is not None:
         h, w = frame.shape[:2]
         if w != width:
-            scale = width / float(w)
-            frame = cv2.resize(frame, (width, int(h * scale)))
+            with PROFILER.stage('resize'):
+                size = (width, int(h * width / float(w)))
+                dst = buffers.get('resized', (size[1], size[0]) + frame.shape[2:]) if buffers else None
+                frame = cv2.resize(frame, size, dst=dst)
     # optional: apply slight blur to reduce noise
-    blurred = cv2.GaussianBlur(frame, (5, 5), 0)
+    with PROFILER.stage('blur'):
+        dst = buffers.get('blurred', frame.shape) if buffers else None
+        blurred = cv2.GaussianBlur(frame, (5, 5), 0, dst=dst)
     return blurred
 
 
-def detect_leaves(frame, lower_hsv, upper_hsv, min_area=500, kernel_size=5):
-    # Convert to HSV and threshold
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-    mask = cv2.inRange(hsv, lower_hsv, upper_hsv)
+@functools.lru_cache(maxsize=8)
+def _morph_kernel(kernel_size):
+    return cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+
+
+def morph_reach(kernel_size=5):
+    # How far (pixels) a change can travel through segment_leaves' morphology:
+    # open = erode + dilate, close x2 = 2 dilates + 2 erodes, each pass reaches kernel_size // 2
+    return 6 * (kernel_size // 2)
+
+
+def segment_leaves(frame, lower_hsv, upper_hsv, min_area=500, kernel_size=5, segmenter=None, pyramid=1,
+                   buffers=None, ranges=None):
+    # ranges: several (lower, upper) pairs (a preset set) instead of lower_hsv/upper_hsv
+    ranges = ranges or [(lower_hsv, upper_hsv)]
+    if pyramid > 1:
+        # Threshold + morphology at 1/pyramid scale, blob edges refined at full resolution
+        with PROFILER.stage('pyramid'):
+            return pyramid_mask(frame, ranges, pyramid, kernel_size, segmenter=segmenter, min_area=min_area)
+    shape = frame.shape[:2]
+    mask = buffers.get('mask', shape) if buffers else None
+    with PROFILER.stage('threshold'):
+        if segmenter is not None:
+            # Lookup-table path: table is rebuilt only when the thresholds change; all ranges share one table
+            segmenter.update(ranges)
+            mask = segmenter.mask(frame, dst=mask)
+        elif len(ranges) > 1:
+            mask = inrange_mask(frame, ranges)
+        else:
+            # Convert to HSV and threshold
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=buffers.get('hsv', frame.shape) if buffers else None)
+            mask = range_mask(hsv, lower_hsv, upper_hsv, dst=mask)
 
     # Morphological operations to clean up mask
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    with PROFILER.stage('morphology'):
+        kernel = _morph_kernel(kernel_size)
+        opened = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1,
+                                  dst=buffers.get('morph', shape) if buffers else None)
+        # Close back into the threshold buffer (ping-pong between the two)
+        mask = cv2.morphologyEx(opened, cv2.MORPH_CLOSE, kernel, iterations=2, dst=mask if buffers else None)
+    return mask
+
+
+def detect_leaves(frame, lower_hsv, upper_hsv, min_area=500, kernel_size=5, segmenter=None, engine='contours',
+                  pyramid=1, rois=None, roi_mask=None, buffers=None, tiler=None, ranges=None, calibration=None):
+    if rois is None and tiler is not None:
+        # Bands segmented in parallel and stitched into one mask (TileSegmenter)
+        with PROFILER.stage('tiles'):
+            mask = tiler.mask(frame, lower_hsv, upper_hsv, ranges=ranges,
+                              out=buffers.get('mask', frame.shape[:2]) if buffers else None)
+    elif rois is None:
+        mask = segment_leaves(frame, lower_hsv, upper_hsv, min_area, kernel_size, segmenter, pyramid, buffers,
+                              ranges)
+    else:
+        # Only the scheduled (non-overlapping) rectangles are thresholded, the rest stays empty
+        if buffers:
+            mask = buffers.get('roi_mask', frame.shape[:2])
+            mask.fill(0)
+        else:
+            mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+        for x, y, w, h in rois:
+            mask[y:y + h, x:x + w] = segment_leaves(frame[y:y + h, x:x + w], lower_hsv, upper_hsv, min_area,
+                                                    kernel_size, segmenter, pyramid, ranges=ranges)
+    if roi_mask is not None:
+        # Static ROI polygons
+        cv2.bitwise_and(mask, roi_mask, dst=mask)
 
     # Optional: fill small holes using dilation then erosion
     # mask = cv2.dilate(mask, kernel, iterations=1)
     # mask = cv2.erode(mask, kernel, iterations=1)
 
-    # Find contours
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    detections = find_leaves(mask, min_area, engine)
+    if ranges is not None:
+        label_presets(frame, detections, ranges, segmenter)
+    if calibration is not None:
+        # Centroids / rect corners only, through the cached pixel -> world table
+        with PROFILER.stage('world'):
+            calibration.locate(detections, frame.shape)
+    return mask, detections
+
 
-    detections = []
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area < min_area:
-            continue
-        x, y, w, h = cv2.boundingRect(cnt)
-        # Optionally compute solidity, aspect ratio, extent, etc.
-        rect = (x, y, w, h)
-        detections.append({'contour': cnt, 'area': area, 'rect': rect})
+def find_leaves(mask, min_area=500, engine='contours'):
+    with PROFILER.stage('contours'):
+        if engine == 'components':
+            # One connectedComponentsWithStats call; contours are traced only if drawn/exported
+            return Detections.from_components(mask, min_area=min_area)
+        # Find contours
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    return mask, detections
+        # Area, bounding rect and centroid for all contours at once, then a vectorized area filter
+        return Detections.from_contours(contours, min_area=min_area)
+
+
+# Bits of every byte value, (256, 8): a byte histogram @ this = set count per bit
+_BYTE_BITS = (np.arange(256)[:, None] >> np.arange(8)) & 1
 
 
-def draw_detections(frame, detections, show_contours=True):
-    out = frame.copy()
-    for det in detections:
-        x, y, w, h = det['rect']
-        area = det['area']
-        cv2.rectangle(out, (x, y), (x + w, y + h), (0, 255, 0), 2)
-        cv2.putText(out, f"{int(area)}", (x, y - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        if show_contours:
-            cv2.drawContours(out, [det['contour']], -1, (0, 128, 255), 1)
-    return out
+def _bit_counts(values):
+    # How often each bit is set in an integer array; one bincount per byte, no unpacking
+    b = values.view(np.uint8).reshape(len(values), -1)
+    return np.concatenate([np.bincount(b[:, k], minlength=256) @ _BYTE_BITS for k in range(b.shape[1])])
 
 
-def ensure_dir(path):
-    if not os.path.exists(path):
-        os.makedirs(path)
+def label_presets(frame, detections, ranges, segmenter=None):
+    # Tag every leaf with the range (preset) most of its pixels match. The mask pass above
+    # already used all ranges at once; the per-range bits are only read over the leaves' own pixels.
+    presets = detections.presets
+    if len(ranges) == 1:
+        presets[:] = 0
+        return detections
+    if segmenter is not None:
+        segmenter.update(ranges)
+        labels_of = segmenter.labels
+    else:
+        labels_of = functools.partial(label_image, ranges=ranges)
+    with PROFILER.stage('presets'):
+        for i, (x, y, w, h) in enumerate(detections.rects.tolist()):
+            bits = labels_of(frame[y:y + h, x:x + w])[detections.blob_mask(i)]
+            # Matches per range over the blob; a pixel can match several ranges
+            counts = _bit_counts(bits)
+            presets[i] = int(counts.argmax()) if counts.any() else -1
+    return detections
+
+
+def draw_detections(frame, detections, show_contours=True, out=None):
+    # Boxes and contours are drawn in one batched call each; out: preallocated (e.g. canvas half) to draw into
+    if out is None:
+        return detections.draw(frame, show_contours=show_contours)
+    np.copyto(out, frame)
+    return detections.draw(out, show_contours=show_contours, copy=False)
 
 
 def main():
@@ -125,10 +250,149 @@ def main():
     parser.add_argument('--camera', '-c', type=int, default=0, help='Camera index (default 0)')
     parser.add_argument('--width', type=int, default=800, help='Resize width for processing (speeds up)')
     parser.add_argument('--min-area', type=int, default=800, help='Minimum contour area to keep')
+    parser.add_argument('--capture-policy', choices=POLICIES, default=None,
+                        help="Frame prefetch policy (default: 'latest' for camera, 'block' for video)")
+    parser.add_argument('--ring', metavar='NAME',
+                        help='Read frames from a frame_ring.py capture daemon instead of opening the camera')
+    parser.add_argument('--segmentation', choices=('lut', 'inrange'), default='lut',
+                        help='HSV threshold engine: precomputed colour table or cvtColor+inRange')
+    parser.add_argument('--lut-bits', type=int, default=5, help='Bits per channel for --segmentation lut (5..8)')
+    parser.add_argument('--engine', choices=('contours', 'components'), default='contours',
+                        help='Blob extraction: findContours, or connectedComponentsWithStats with lazy contours')
+    parser.add_argument('--pyramid', type=int, choices=(1, 2, 4), default=1,
+                        help='Threshold/morphology at 1/N scale, refine blob edges at full resolution')
+    parser.add_argument('--presets', metavar='DB',
+                        help='Detect with a set of saved presets (2preset.py database) instead of one HSV range')
+    parser.add_argument('--preset-names', nargs='+', metavar='NAME',
+                        help='Presets to use from --presets, latest of each name (default: every saved range)')
+    parser.add_argument('--preset-camera', metavar='SOURCE',
+                        help='Prefer presets tuned on this video/camera (as tagged by 2preset.py)')
+    parser.add_argument('--tiles', type=int, default=0, metavar='N',
+                        help='Segment each frame as N overlapping bands on a thread pool (for large --width)')
+    parser.add_argument('--tile-workers', type=int, default=None, help='Threads for --tiles (default: CPU count)')
+    parser.add_argument('--roi', type=parse_polygon, action='append', metavar='"x,y x,y x,y ..."',
+                        help='Static ROI polygon as fractions of the frame (repeatable); leaves outside are ignored')
+    parser.add_argument('--full-every', type=int, default=None, metavar='N',
+                        help='Full-frame pass every N frames, only ROIs around known leaves in between')
+    parser.add_argument('--roi-margin', type=float, default=0.25,
+                        help='Grow tracked leaf boxes by this fraction for the in-between ROIs')
+    parser.add_argument('--change-gate', action='store_true',
+                        help='Reuse the last mask/detections while the frame is static, recompute only changed tiles')
+    parser.add_argument('--gate-threshold', type=int, default=12,
+                        help='Gray-level difference (on the 1/8 scale frame) that marks a tile as changed')
+    parser.add_argument('--gate-tile', type=int, default=64, help='Change-gate tile size in pixels')
+    parser.add_argument('--gate-report', type=float, default=10.0, metavar='SECONDS',
+                        help='Print change-gate hit rate and saved time every SECONDS (0 = only at exit)')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Shift the S/V bounds with the scene lighting (running histograms of the frames)')
+    parser.add_argument('--adapt-every', type=int, default=15, metavar='N',
+                        help='Recompute the --adaptive bounds every N frames')
+    parser.add_argument('--adapt-gain', action='store_true',
+                        help='With --adaptive: also normalize the frame with gray-world per-channel gains')
+    parser.add_argument('--calibration', metavar='JSON',
+                        help='Camera / ground calibration (calibration.py): add world positions to the detections')
+    parser.add_argument('--robot', metavar='PORT',
+                        help="Send each frame's targets to the robot on serial PORT ('pty': local stand-in)")
+    parser.add_argument('--robot-baud', type=int, default=115200, help='Serial speed for --robot')
+    parser.add_argument('--robot-max-age', type=float, default=0.2, metavar='SECONDS',
+                        help='Drop robot packets older than this when the link is busy')
+    parser.add_argument('--track', action='store_true', help='Track leaves across frames and assign persistent IDs')
+    parser.add_argument('--track-assignment', choices=ASSIGNMENTS, default='greedy',
+                        help='Track/detection matching (hungarian needs scipy)')
+    parser.add_argument('--track-distance', type=float, default=80.0,
+                        help='Max centroid jump (pixels per frame) for matching a leaf to its track')
+    parser.add_argument('--detect-every', type=int, default=1, metavar='N',
+                        help='With --track: detect every N-th frame, extrapolate tracks in between')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time every pipeline stage, show per-stage ms + FPS on screen, print a report at exit')
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help='Periodically write stage timings to PATH (Prometheus text format)')
+    parser.add_argument('--metrics-port', type=int, default=None, metavar='PORT',
+                        help='Serve stage timings on http://127.0.0.1:PORT/metrics (Prometheus text format)')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Run read/preprocess/detect/render as threaded stages (frame order is kept)')
+    parser.add_argument('--detect-workers', type=int, default=2, help='Detect threads for --pipeline')
+    parser.add_argument('--queue-size', type=int, default=4, help='Frames buffered between --pipeline stages')
     parser.add_argument('--no-trackbar', dest='trackbar', action='store_false', help="Don't show HSV trackbars")
+    parser.add_argument('--record', metavar='PATH',
+                        help='Stream per-frame detections to PATH (.jsonl, or .ldet for binary records)')
+    parser.add_argument('--record-contours', type=float, default=None, metavar='EPS',
+                        help='Include contours simplified with approxPolyDP(EPS) in JSONL records')
+    parser.add_argument('--snapshot-dir', default='leaf_detections', help="Directory for 's' and autosave snapshots")
+    parser.add_argument('--snapshot-format', choices=FORMATS, default='jpg',
+                        help='Snapshot image format (masks are always lossless: png, or npy with npy)')
+    parser.add_argument('--jpeg-quality', type=int, default=95, help='JPEG quality for --snapshot-format jpg')
+    parser.add_argument('--png-compression', type=int, default=3, help='PNG compression level 0-9')
+    parser.add_argument('--autosave-area', type=float, default=None, metavar='AREA',
+                        help='Save a crop of every detection of at least AREA px (dataset collection)')
+    parser.add_argument('--autosave-every', type=int, default=15, metavar='N',
+                        help='With --autosave-area: only every N-th frame, to skip near-duplicates')
+    parser.add_argument('--headless', metavar='OUTPUT',
+                        help='Batch-process --video without any windows, write detections to OUTPUT (JSONL)')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='Worker processes for --headless')
     args = parser.parse_args()
 
-    cap = cv2.VideoCapture(args.video if args.video else args.camera)
+    preset_names, preset_ranges = [], None
+    if args.presets:
+        if not os.path.exists(args.presets):
+            print(f'ERROR: preset database not found: {args.presets}')
+            return
+        preset_names, preset_ranges = load_preset_set(args.presets, args.preset_names, camera=args.preset_camera)
+        if not preset_ranges:
+            print(f'ERROR: no matching presets in {args.presets}')
+            return
+        print(f"Detecting with {len(preset_ranges)} presets: {', '.join(preset_names)}")
+        if args.trackbar:
+            print('Note: HSV trackbars do not apply with --presets')
+            args.trackbar = False
+
+    if args.adaptive and (preset_ranges or args.headless):
+        # A preset set is several ranges, and batch shards have no running history to adapt from
+        print('WARNING: --adaptive is ignored with --presets/--headless')
+        args.adaptive = False
+
+    calibration = None
+    if args.calibration:
+        try:
+            calibration = Calibration.load(args.calibration)
+        except (OSError, ValueError, KeyError) as e:
+            print(f'ERROR: cannot load calibration {args.calibration}: {e}')
+            return
+
+    if args.headless:
+        if not args.video:
+            print('ERROR: --headless needs --video')
+            return
+        from batch import run_batch
+        run_batch(args.video, args.headless, width=args.width, min_area=args.min_area, workers=args.workers,
+                  contour_epsilon=args.record_contours, track=args.track, ranges=preset_ranges,
+                  calibration=args.calibration)
+        return
+
+    link = robot = None
+    if args.robot:
+        try:
+            if args.robot == 'pty':
+                robot = PtyStandIn(args.robot_baud)
+                print('Robot stand-in on', robot.path)
+            link = RobotLink(open_port(robot.path if robot else args.robot, args.robot_baud),
+                             max_age=args.robot_max_age, world=calibration is not None, baudrate=args.robot_baud,
+                             units=calibration.units if calibration is not None else 'cm')
+        except (OSError, ImportError, ValueError) as e:
+            # ValueError: world targets in a unit robot_link cannot convert to millimetres
+            print(f'ERROR: cannot open robot link {args.robot}: {e}')
+            return
+
+    if args.ring:
+        # Zero-copy views unless frames wait in pipeline queues, where the daemon could overwrite them
+        try:
+            cap = RingCapture(args.ring, policy='next' if args.capture_policy == 'block' else 'latest',
+                              copy=args.pipeline)
+        except (FileNotFoundError, ValueError) as e:
+            print(f'ERROR: cannot attach to frame ring {args.ring}: {e} (start: python frame_ring.py serve)')
+            return
+    else:
+        cap = open_capture(args.video if args.video else args.camera, policy=args.capture_policy)
     if not cap.isOpened():
         print('ERROR: Cannot open video source')
         return
@@ -138,54 +402,240 @@ def main():
         # Reasonable default for green leaves, but lighting varies
         create_trackbar_window(trackbar_win, initial_low=(25, 40, 40), initial_high=(95, 255, 255))
 
-    save_dir = 'leaf_detections'
-    ensure_dir(save_dir)
-    frame_count = 0
-    show_contours = True
-
-    print("Controls: q=quit, t=toggle trackbar, s=save, c=toggle contours")
-
-    while True:
-        ret, frame = cap.read()
+    scheduler = None
+    if args.roi or args.full_every:
+        if args.pipeline:
+            # Each ROI plan depends on the previous frame's detections, which a parallel detect stage does not have yet
+            print('WARNING: --roi/--full-every need the serial loop, ignored with --pipeline')
+        else:
+            scheduler = ROIScheduler(static_rois=args.roi, full_every=args.full_every or 1, margin=args.roi_margin)
+    gate = None
+    if args.change_gate:
+        if args.pipeline:
+            print('WARNING: --change-gate needs the serial loop, ignored with --pipeline')
+        elif scheduler is not None:
+            print('WARNING: --change-gate is ignored with --roi/--full-every')
+        else:
+            gate = ChangeGate(threshold=args.gate_threshold, tile=args.gate_tile, pad=morph_reach())
+    tiler = None
+    if args.tiles:
+        if args.pyramid > 1:
+            # The pyramid's per-blob min_area filter is not local, bands would not stitch exactly
+            print('WARNING: --tiles is ignored with --pyramid')
+        else:
+            tiler = TileSegmenter(
+                lambda: functools.partial(segment_leaves, segmenter=LUTSegmenter(bits=args.lut_bits)
+                                          if args.segmentation == 'lut' else None),
+                tiles=args.tiles, workers=args.tile_workers, pad=morph_reach())
+    adaptive = None
+    if args.adaptive:
+        adaptive = AdaptiveThresholds(every=args.adapt_every, gain=args.adapt_gain)
+    tracker = None
+    if args.track:
+        tracker = LeafTracker(max_distance=args.track_distance, assignment=args.track_assignment)
+    elif args.detect_every > 1:
+        print('WARNING: --detect-every needs --track, detecting every frame')
+    sink = open_sink(args.record, contour_epsilon=args.record_contours) if args.record else None
+
+    exporter = None
+    if args.profile or args.metrics_file or args.metrics_port:
+        PROFILER.enable()
+        if args.metrics_file or args.metrics_port:
+            exporter = MetricsExporter(PROFILER, path=args.metrics_file, port=args.metrics_port)
+
+    snapshots = SnapshotWriter(args.snapshot_dir, fmt=args.snapshot_format, jpeg_quality=args.jpeg_quality,
+                               png_compression=args.png_compression)
+    # Shared with the stage functions (which may run on pipeline threads); only the main thread writes
+    # Default HSV range for green leaves (may need tuning)
+    ui = {
+        'lower': np.array([25, 40, 40], dtype=np.uint8),
+        'upper': np.array([95, 255, 255], dtype=np.uint8),
+        'show_contours': True,
+    }
+    frame_counter = itertools.count()
+    # Reused per-resolution arrays; only safe when one frame is in flight at a time
+    pool = None if args.pipeline else BufferPool()
+
+    def read_frame():
+        with PROFILER.stage('read'):
+            ret, frame = cap.read()
         if not ret:
-            print('End of stream or cannot fetch frame')
-            break
-        frame_count += 1
-
-        frame_proc = preprocess_frame(frame, width=args.width)
-
-        if args.trackbar:
-            lower, upper = get_trackbar_values(trackbar_win)
+            return None
+        return {'idx': next(frame_counter), 'ts': time.time(), 'capture_ts': cap.last_timestamp, 'frame': frame,
+                'lower': ui['lower'], 'upper': ui['upper']}
+
+    def preprocess(item):
+        item['proc'] = preprocess_frame(item['frame'], width=args.width, buffers=pool)
+        if adaptive is not None:
+            # In frame order (single preprocess worker), so the running histograms see the stream as it is
+            with PROFILER.stage('adapt'):
+                # update() sees the raw frame (it applies the current gains to its own sample), then the gains
+                item['lower'], item['upper'] = adaptive.update(item['proc'], item['lower'], item['upper'])
+                item['proc'] = adaptive.normalize(item['proc'], dst=pool.get('normalized', item['proc'].shape)
+                                                  if pool else None)
+            item['adapt'] = adaptive.describe()
+        return item
+
+    def make_detector():
+        # One segmenter per detect worker: LUTSegmenter keeps scratch buffers
+        segmenter = LUTSegmenter(bits=args.lut_bits) if args.segmentation == 'lut' else None
+        last_thresholds = [None]
+        last_report = [time.monotonic()]
+
+        def segment(img, buffers, lower, upper, full=None):
+            if tiler is not None and img is full:
+                # Whole frames are tiled; the gate's changed-tile crops are small already
+                return tiler.mask(img, lower, upper, ranges=preset_ranges,
+                                  out=buffers.get('mask', img.shape[:2]) if buffers else None)
+            return segment_leaves(img, lower, upper, min_area=args.min_area, segmenter=segmenter,
+                                  pyramid=args.pyramid, buffers=buffers, ranges=preset_ranges)
+
+        def extract(mask):
+            return find_leaves(mask, args.min_area, args.engine)
+
+        def detect(item):
+            item['mask'] = item['detections'] = item['rois'] = item['gate'] = None
+            if tracker is not None and args.detect_every > 1 and item['idx'] % args.detect_every:
+                # Skipped frame: the render stage extrapolates the tracks
+                return item
+            lower, upper = item['lower'], item['upper']
+            roi_mask = None
+            thresholds = (tuple(lower.tolist()), tuple(upper.tolist()))
+            if thresholds != last_thresholds[0]:
+                # Leaves found with the old thresholds say nothing about the new ones
+                if scheduler is not None:
+                    scheduler.reset()
+                if gate is not None:
+                    gate.invalidate()
+                last_thresholds[0] = thresholds
+            if gate is not None:
+                with PROFILER.stage('gate'):
+                    segment_frame = functools.partial(segment, lower=lower, upper=upper, full=item['proc'])
+                    item['mask'], item['detections'] = gate.process(item['proc'], segment_frame, extract,
+                                                                    buffers=pool)
+                item['gate'] = gate.last
+                if preset_ranges and gate.last != 'hit':
+                    label_presets(item['proc'], item['detections'], preset_ranges, segmenter)
+                if calibration is not None and gate.last != 'hit':
+                    calibration.locate(item['detections'], item['proc'].shape)
+                if args.gate_report and time.monotonic() - last_report[0] >= args.gate_report:
+                    last_report[0] = time.monotonic()
+                    print(gate.report())
+                return item
+            if scheduler is not None:
+                item['rois'], roi_mask = scheduler.plan(item['proc'].shape)
+            item['mask'], item['detections'] = detect_leaves(
+                item['proc'], lower, upper, min_area=args.min_area, segmenter=segmenter, engine=args.engine,
+                pyramid=args.pyramid, rois=item['rois'], roi_mask=roi_mask, buffers=pool, tiler=tiler,
+                ranges=preset_ranges, calibration=calibration)
+            if scheduler is not None:
+                scheduler.update(item['detections'])
+            return item
+        return detect
+
+    last_mask = [None]
+
+    def render(item):
+        # Runs in frame order (single worker): tracking, recording and drawing
+        detections = item['detections']
+        if tracker is not None:
+            with PROFILER.stage('track'):
+                if detections is None:
+                    detections = tracker.predict()
+                    if calibration is not None:
+                        calibration.locate(detections, item['proc'].shape)
+                else:
+                    detections = tracker.update(detections)
+            item['detections'] = detections
+        if item['mask'] is None:
+            # Skipped frame: keep showing the last mask
+            item['mask'] = last_mask[0]
+        last_mask[0] = item['mask']
+        if sink is not None:
+            sink.write(item['idx'], detections, item['ts'])
+        if link is not None:
+            # Only packs and hands over the packet; the link thread does the (slow) write
+            link.publish(item['idx'], detections, item['capture_ts'])
+        if pool is not None:
+            canvas, left, right = pool.canvas(item['proc'].shape)
         else:
-            # Default HSV range for green leaves (may need tuning)
-            lower = np.array([25, 40, 40], dtype=np.uint8)
-            upper = np.array([95, 255, 255], dtype=np.uint8)
-
-        mask, detections = detect_leaves(frame_proc, lower, upper, min_area=args.min_area)
-        out = draw_detections(frame_proc, detections, show_contours=show_contours)
+            h, w = item['proc'].shape[:2]
+            canvas = np.empty((h, 2 * w, 3), dtype=np.uint8)
+            left, right = canvas[:, :w], canvas[:, w:]
+        with PROFILER.stage('draw'):
+            out = draw_detections(item['proc'], detections, show_contours=ui['show_contours'], out=left)
+        if scheduler is not None:
+            for x, y, w, h in item['rois'] or ():
+                cv2.rectangle(out, (x, y), (x + w - 1, y + h - 1), (255, 128, 0), 1)
+            share = scheduler.last_pixels / float(out.shape[0] * out.shape[1])
+            cv2.putText(out, f"{'FULL' if scheduler.last_full else 'ROI'} {share:.0%} px", (10, 24),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 128, 0), 2)
+        for i, name in enumerate(preset_names):
+            color = PRESET_COLORS[i % len(PRESET_COLORS)]
+            cv2.putText(out, name, (10, out.shape[0] - 12 - 20 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+        if item.get('adapt'):
+            cv2.putText(out, 'ADAPT ' + item['adapt'], (10, 48), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 200, 255), 2)
+        if item.get('gate'):
+            for x0, y0, x1, y1 in gate.last_rects:
+                cv2.rectangle(out, (x0, y0), (x1 - 1, y1 - 1), (255, 128, 0), 1)
+            cv2.putText(out, f"{item['gate'].upper()}  reused {gate.hits / max(1, gate.frames):.0%}", (10, 24),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 128, 0), 2)
+
+        # show side-by-side: the mask goes straight into the right half of the canvas
+        cv2.cvtColor(item['mask'], cv2.COLOR_GRAY2BGR, dst=right)
+        item['canvas'] = canvas
+        return item
+
+    pipe = None
+    if args.pipeline:
+        # read | preprocess | detect x N | render on worker threads, display here on the main (GUI) thread
+        pipe = StagePipeline(read_frame, [
+            Stage('preprocess', preprocess),
+            Stage('detect', make_detector, workers=args.detect_workers, factory=True),
+            Stage('render', render),
+        ], queue_size=args.queue_size)
+        items = pipe.results()
+    else:
+        def serial():
+            detect = make_detector()
+            while True:
+                item = read_frame()
+                if item is None:
+                    return
+                yield render(detect(preprocess(item)))
+        items = serial()
 
-        # show side-by-side
-        mask_bgr = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)
-        combined = np.hstack([out, mask_bgr])
+    print("Controls: q=quit, t=toggle trackbar, s=save, c=toggle contours")
 
-        cv2.imshow('Leaf Detector - Output | Mask', combined)
-        if args.trackbar:
-            # also show tuner window (trackbars are already visible)
-            pass
+    PROFILER.tick()
+    for item in items:
+        combined = item['canvas']
+        PROFILER.overlay(combined)
 
-        key = cv2.waitKey(1) & 0xFF
+        with PROFILER.stage('display'):
+            cv2.imshow('Leaf Detector - Output | Mask', combined)
+            if args.trackbar:
+                # also show tuner window (trackbars are already visible)
+                ui['lower'], ui['upper'] = get_trackbar_values(trackbar_win)
+
+            key = cv2.waitKey(1) & 0xFF
+        PROFILER.tick()
+        if args.autosave_area is not None and item['idx'] % args.autosave_every == 0:
+            with PROFILER.stage('autosave'):
+                snapshots.autosave(item['proc'], item['mask'], item['detections'], item['idx'],
+                                   min_area=args.autosave_area)
         if key == ord('q'):
             break
         elif key == ord('s'):
-            ts = datetime.now().strftime('%Y%m%d_%H%M%S')
-            fname_frame = os.path.join(save_dir, f'frame_{ts}.jpg')
-            fname_mask = os.path.join(save_dir, f'mask_{ts}.png')
-            cv2.imwrite(fname_frame, frame_proc)
-            cv2.imwrite(fname_mask, mask)
-            print('Saved', fname_frame, fname_mask)
+            # Copies the frame and mask onto the writer queue; encoding and disk writes happen in the background
+            fname_frame = snapshots.save(item['proc'], item['mask'], item['idx'])
+            if fname_frame is None:
+                print('WARNING: snapshot dropped, writer queue is full')
+            else:
+                print('Saving', fname_frame)
         elif key == ord('c'):
-            show_contours = not show_contours
-            print('Show contours:', show_contours)
+            ui['show_contours'] = not ui['show_contours']
+            print('Show contours:', ui['show_contours'])
         elif key == ord('t'):
             args.trackbar = not args.trackbar
             if args.trackbar:
@@ -194,7 +644,37 @@ def main():
             else:
                 cv2.destroyWindow(trackbar_win)
                 print('Trackbar OFF')
-
+    else:
+        print('End of stream or cannot fetch frame')
+
+    if pipe is not None:
+        pipe.close()
+        print('Pipeline:', pipe.stats())
+    if tiler is not None:
+        tiler.close()
+    print('Capture stats:', cap.stats())
+    if scheduler is not None:
+        print('ROI scheduler:', scheduler.stats())
+    if gate is not None:
+        print(gate.report())
+    if adaptive is not None:
+        print(f'Adaptive thresholds: {adaptive.updates} updates, last {adaptive.describe()}')
+    if PROFILER.enabled:
+        print(PROFILER.report())
+    if exporter is not None:
+        exporter.close()
+    if link is not None:
+        link.close()
+        print(link.report())
+    if robot is not None:
+        robot.close()
+        print(f'Robot stand-in decoded {len(robot.packets)} packets ({robot.decoder.bad} bad)')
+    if sink is not None:
+        sink.close()
+        print(f'Recorded {sink.frames_written} frames, {sink.records_written} detections -> {sink.path}')
+    snapshots.close()
+    if snapshots.files_written or snapshots.snapshots_dropped or snapshots.failures:
+        print(snapshots.report())
     cap.release()
     cv2.destroyAllWindows()
 
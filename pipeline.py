@@ -0,0 +1,193 @@
+"""
+Pipelined, multi-threaded stage executor for the detection loop.
+
+The serial loop runs read -> preprocess -> detect -> draw -> display one
+after another, so a frame costs the sum of all stages while most cores sit
+idle. OpenCV releases the GIL inside its calls, so plain threads overlap
+well:
+
+- a source thread pulls frames (e.g. ThreadedCapture.read)
+- every Stage runs on its own worker thread(s); the detect stage can have
+  several workers working on consecutive frames
+- stages are connected by bounded reorder queues: items carry a sequence
+  number and are handed out strictly in order, so a multi-worker stage never
+  reorders frames, and a full queue blocks its producer (backpressure all
+  the way back to the source)
+- results() yields the finished items in frame order on the caller's thread,
+  which is where HighGUI (imshow / waitKey) has to run
+
+Throughput then approaches the slowest single stage instead of the sum.
+
+Stage functions must not share mutable scratch state between workers
+(e.g. LUTSegmenter buffers): pass factory=True and `fn` is called once per
+worker thread to build that worker's own function.
+
+Usage:
+    pipe = StagePipeline(read_next, [
+        Stage('preprocess', preprocess),
+        Stage('detect', make_detector, workers=2, factory=True),
+        Stage('render', render),
+    ])
+    for item in pipe.results():
+        cv2.imshow('out', item['canvas'])
+    pipe.close()
+"""
+
+import heapq
+import threading
+
+from profiling import PROFILER
+
+_STOP = object()
+
+
+class _Failure:
+    __slots__ = ('exc',)
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+class ReorderQueue:
+    """Bounded queue that hands items out in sequence-number order."""
+
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self._heap = []
+        self._next = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, seq, item):
+        with self._cond:
+            # The item everybody is waiting for is always accepted, otherwise a full
+            # queue of later frames could wait forever on the one still being produced
+            while len(self._heap) >= self.maxsize and seq != self._next and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return
+            heapq.heappush(self._heap, (seq, id(item), item))
+            self._cond.notify_all()
+
+    def get(self):
+        with self._cond:
+            while not self._closed and not (self._heap and self._heap[0][0] == self._next):
+                self._cond.wait()
+            if self._closed:
+                return self._next, _STOP
+            seq, _, item = self._heap[0]
+            if item is _STOP:
+                # End of stream stays queued so every worker of the stage sees it
+                return seq, _STOP
+            heapq.heappop(self._heap)
+            self._next += 1
+            self._cond.notify_all()
+            return seq, item
+
+    def __len__(self):
+        return len(self._heap)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class Stage:
+    """One pipeline step: fn(item) -> item, run by `workers` threads."""
+
+    def __init__(self, name, fn, workers=1, factory=False):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.factory = factory
+        self.processed = 0
+
+
+class StagePipeline:
+    def __init__(self, source, stages, queue_size=4):
+        # source() returns the next item, or None at the end of the stream
+        self.source = source
+        self.stages = stages
+        self._queues = [ReorderQueue(queue_size) for _ in range(len(stages) + 1)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._remaining = [s.workers for s in stages]
+        self._started = False
+        self._closed = threading.Event()
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        t = threading.Thread(target=self._feed, name='pipeline-source', daemon=True)
+        t.start()
+        self._threads.append(t)
+        for i, stage in enumerate(self.stages):
+            for k in range(stage.workers):
+                t = threading.Thread(target=self._work, args=(i,), name=f'pipeline-{stage.name}-{k}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _feed(self):
+        out = self._queues[0]
+        seq = 0
+        try:
+            while not self._closed.is_set():
+                item = self.source()
+                if item is None:
+                    break
+                out.put(seq, item)
+                seq += 1
+        except Exception as exc:
+            out.put(seq, _Failure(exc))
+            seq += 1
+        out.put(seq, _STOP)
+
+    def _work(self, i):
+        stage = self.stages[i]
+        fn = stage.fn() if stage.factory else stage.fn
+        inq, outq = self._queues[i], self._queues[i + 1]
+        while True:
+            seq, item = inq.get()
+            if item is _STOP:
+                break
+            if not isinstance(item, _Failure):
+                try:
+                    with PROFILER.stage(stage.name):
+                        item = fn(item)
+                except Exception as exc:
+                    item = _Failure(exc)
+            with self._lock:
+                stage.processed += 1
+            outq.put(seq, item)
+        with self._lock:
+            self._remaining[i] -= 1
+            last = self._remaining[i] == 0
+        if last:
+            outq.put(seq, _STOP)
+
+    def results(self):
+        """Finished items in source order; re-raises the first stage error."""
+        self.start()
+        out = self._queues[-1]
+        while True:
+            _, item = out.get()
+            if item is _STOP:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+
+    def stats(self):
+        return {
+            'processed': {s.name: s.processed for s in self.stages},
+            'queued': [len(q) for q in self._queues],
+        }
+
+    def close(self):
+        self._closed.set()
+        for q in self._queues:
+            q.close()
+        for t in self._threads:
+            t.join(timeout=1.0)
@@ -0,0 +1,200 @@
+"""
+Indexed HSV preset store (SQLite) replacing the JSON preset file of 2preset.py.
+
+save_preset() used to re-read and re-write the whole JSON file (indent=4)
+on every save, and manual_detect() saves on every manual detection, so
+saving got slower as presets piled up and a crash mid-write left a
+truncated file. PresetStore keeps the presets in an SQLite database:
+
+- save() is one INSERT in one transaction: constant time, and atomic (the
+  WAL journal rolls an interrupted write back on the next open)
+- presets are indexed by name, camera and creation time; latest() / get()
+  fetch one row through an index instead of loading the file
+- per (name, camera) counts are kept in their own table, updated in the
+  same transaction, so count() does not scan the presets
+- import_json() migrates an old {"presets": [...]} file once
+
+A preset is the dict 2preset.py always wrote (H_low, H_high, S_low, S_high,
+V_low, V_high) plus id / name / camera / created.
+
+Usage:
+    store = PresetStore('presets.db')
+    store.save({'H_low': 25, 'H_high': 95, ...}, name='green', camera='rig-1')
+    latest = store.latest(camera='rig-1')
+    lower, upper = preset_bounds(latest)
+    labels, ranges = load_preset_set('presets.db', camera='rig-1')   # what --presets detects with
+    ranges = [preset_bounds(p) for p in store.preset_set(['green', 'yellow'])]   # latest of each name
+    ranges = [preset_bounds(p) for p in store.preset_set(camera='rig-1')]   # every distinct range
+    store.close()
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from segmentation import MAX_LABELS
+
+HSV_KEYS = ('H_low', 'H_high', 'S_low', 'S_high', 'V_low', 'V_high')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS presets (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    camera TEXT NOT NULL,
+    created REAL NOT NULL,
+    H_low INTEGER NOT NULL, H_high INTEGER NOT NULL,
+    S_low INTEGER NOT NULL, S_high INTEGER NOT NULL,
+    V_low INTEGER NOT NULL, V_high INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS presets_name ON presets (name, id);
+CREATE INDEX IF NOT EXISTS presets_camera ON presets (camera, id);
+CREATE INDEX IF NOT EXISTS presets_created ON presets (created);
+CREATE TABLE IF NOT EXISTS preset_counts (
+    name TEXT NOT NULL,
+    camera TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (name, camera)
+);
+"""
+
+_COLUMNS = ('id', 'name', 'camera', 'created') + HSV_KEYS
+_INSERT = f"INSERT INTO presets (name, camera, created, {', '.join(HSV_KEYS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def preset_labels(presets):
+    # Display names: the preset name, plus its id where several presets share a name
+    counts = {}
+    for p in presets:
+        counts[p['name']] = counts.get(p['name'], 0) + 1
+    return [p['name'] if counts[p['name']] == 1 else f"{p['name']}#{p['id']}" for p in presets]
+
+
+def preset_bounds(preset):
+    # (lower, upper) uint8 HSV arrays for cv2.inRange / LUTSegmenter
+    lower = np.array([preset['H_low'], preset['S_low'], preset['V_low']], dtype=np.uint8)
+    upper = np.array([preset['H_high'], preset['S_high'], preset['V_high']], dtype=np.uint8)
+    return lower, upper
+
+
+def load_preset_set(path, names=None, camera=None):
+    """(labels, ranges) of the presets of database `path` to detect with in one pass (see preset_set())."""
+    with PresetStore(path) as store:
+        presets = store.preset_set(names, camera=camera, limit=MAX_LABELS + 1)
+    if len(presets) > MAX_LABELS:
+        # label_presets() tells at most MAX_LABELS ranges apart
+        print(f'WARNING: more than {MAX_LABELS} distinct ranges in {path}, using the newest {MAX_LABELS} '
+              f'(pick some with --preset-names)')
+        presets = presets[:MAX_LABELS]
+    return preset_labels(presets), [preset_bounds(p) for p in presets]
+
+
+class PresetStore:
+    """Append-only, indexed HSV preset storage in one SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def save(self, values, name='default', camera='', created=None):
+        """Append one preset; returns its id."""
+        row = [int(values[k]) for k in HSV_KEYS]
+        created = time.time() if created is None else created
+        with self._conn:
+            cur = self._conn.execute(_INSERT, [name, camera, created] + row)
+            self._conn.execute(
+                'INSERT INTO preset_counts (name, camera, n) VALUES (?, ?, 1) '
+                'ON CONFLICT (name, camera) DO UPDATE SET n = n + 1', (name, camera))
+        return cur.lastrowid
+
+    def _where(self, name=None, camera=None, since=None, until=None):
+        clauses, params = [], []
+        for column, op, value in (('name', '=', name), ('camera', '=', camera),
+                                  ('created', '>=', since), ('created', '<', until)):
+            if value is not None:
+                clauses.append(f'{column} {op} ?')
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def get(self, preset_id):
+        row = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM presets WHERE id = ?", (preset_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def latest(self, name=None, camera=None):
+        """Most recently saved preset matching name / camera, or None."""
+        where, params = self._where(name, camera)
+        row = self._conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM presets{where} ORDER BY id DESC LIMIT 1", params).fetchone()
+        return dict(row) if row is not None else None
+
+    def find(self, name=None, camera=None, since=None, until=None, limit=None):
+        """Matching presets, newest first."""
+        where, params = self._where(name, camera, since, until)
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM presets{where} ORDER BY id DESC"
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def count(self, name=None, camera=None):
+        where, params = self._where(name, camera)
+        return self._conn.execute(f'SELECT COALESCE(SUM(n), 0) FROM preset_counts{where}', params).fetchone()[0]
+
+    def names(self):
+        return [row[0] for row in self._conn.execute('SELECT DISTINCT name FROM preset_counts ORDER BY name')]
+
+    def preset_set(self, names=None, camera=None, limit=None):
+        """Presets to detect with in one pass.
+
+        With `names`: the latest preset of each name, preferring those tuned on `camera`. Without: every
+        distinct HSV range, newest first (only those tuned on `camera` if there are any), at most `limit`.
+        """
+        if names:
+            presets = []
+            for name in names:
+                preset = (camera is not None and self.latest(name=name, camera=camera)) or self.latest(name=name)
+                if preset is not None:
+                    presets.append(preset)
+            return presets
+        if camera is not None and not self.count(camera=camera):
+            camera = None
+        where, params = self._where(camera=camera)
+        presets, seen = [], set()
+        for row in self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM presets{where} ORDER BY id DESC", params):
+            key = tuple(row[k] for k in HSV_KEYS)
+            if key in seen:
+                continue
+            seen.add(key)
+            presets.append(dict(row))
+            if limit is not None and len(presets) >= limit:
+                break
+        return presets
+
+    def import_json(self, path, name='default', camera=''):
+        """Append all presets of an old 2preset.py JSON file (in file order); returns how many."""
+        with open(path, 'r') as f:
+            presets = json.load(f).get('presets', [])
+        created = os.path.getmtime(path)
+        with self._conn:
+            for values in presets:
+                self._conn.execute(_INSERT, [name, camera, created] + [int(values[k]) for k in HSV_KEYS])
+            if presets:
+                self._conn.execute(
+                    'INSERT INTO preset_counts (name, camera, n) VALUES (?, ?, ?) '
+                    'ON CONFLICT (name, camera) DO UPDATE SET n = n + excluded.n', (name, camera, len(presets)))
+        return len(presets)
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,235 @@
+"""
+Per-stage timing for the detection loop.
+
+Hot-path code wraps each stage in a timing block:
+
+    from profiling import PROFILER
+    with PROFILER.stage('threshold'):
+        mask = ...
+
+PROFILER is disabled by default. stage() then returns one shared no-op
+context manager, so an instrumented stage costs a method call and nothing
+else. Once enabled (main.py --profile / --metrics-file / --metrics-port):
+
+- every stage keeps its last `window` samples (ms) in a ring buffer:
+  rolling mean / p50 / p95 / max and a rolling histogram
+- tick() once per frame gives the loop FPS
+- overlay() draws per-stage milliseconds and FPS onto a frame
+- MetricsExporter dumps the numbers periodically in the Prometheus text
+  format, to a file (atomic replace, works with node_exporter's textfile
+  collector) and/or a local HTTP endpoint at /metrics
+
+Usage:
+    PROFILER.enable()
+    exporter = MetricsExporter(PROFILER, path='leaf.prom', port=9108)
+    ...
+    print(PROFILER.report())
+"""
+
+import os
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+# Upper bucket edges (ms) for histogram()
+HIST_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, float('inf'))
+
+_NULL_STAGE = nullcontext()
+
+
+class _Stage:
+    __slots__ = ('timer', 'name', 't0')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timer.record(self.name, (time.perf_counter() - self.t0) * 1000.0)
+
+
+class _Ring:
+    __slots__ = ('samples', 'n', 'count', 'total')
+
+    def __init__(self, window):
+        self.samples = np.zeros(window)
+        self.n = 0
+        # Cumulative since start (Prometheus _count / _sum)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.samples[self.count % len(self.samples)] = value
+        self.count += 1
+        self.total += value
+        self.n = min(self.n + 1, len(self.samples))
+
+    def window(self):
+        return self.samples[:self.n]
+
+
+class StageTimer:
+    """Rolling per-stage timings; a no-op while disabled."""
+
+    def __init__(self, enabled=False, window=300):
+        self.enabled = enabled
+        self.window = window
+        self._stages = {}
+        self._frames = _Ring(window)
+        self._last_tick = None
+        self._lock = threading.Lock()
+
+    def enable(self, window=None):
+        if window:
+            self.window = window
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, ms):
+        with self._lock:
+            ring = self._stages.get(name)
+            if ring is None:
+                ring = self._stages[name] = _Ring(self.window)
+            ring.add(ms)
+
+    def tick(self):
+        # Call once per frame; frame-to-frame intervals give the FPS
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self._last_tick is not None:
+            with self._lock:
+                self._frames.add((now - self._last_tick) * 1000.0)
+        self._last_tick = now
+
+    def fps(self):
+        frames = self._frames.window()
+        return 1000.0 / frames.mean() if len(frames) else 0.0
+
+    def summary(self):
+        with self._lock:
+            windows = {name: (ring.window().copy(), ring.count, ring.total) for name, ring in self._stages.items()}
+        out = {}
+        for name, (w, count, total) in windows.items():
+            if not len(w):
+                continue
+            p50, p95 = np.percentile(w, [50, 95]).tolist()
+            out[name] = {'mean_ms': float(w.mean()), 'p50_ms': p50, 'p95_ms': p95, 'max_ms': float(w.max()),
+                         'count': count, 'sum_ms': total}
+        return out
+
+    def histogram(self, name, buckets=HIST_BUCKETS_MS):
+        # Rolling-window sample counts per bucket (upper edges, ms)
+        with self._lock:
+            ring = self._stages.get(name)
+            w = ring.window().copy() if ring is not None else np.empty(0)
+        return np.bincount(np.searchsorted(buckets, w), minlength=len(buckets))[:len(buckets)]
+
+    def overlay(self, img, origin=(10, 50), color=(0, 255, 255)):
+        if not self.enabled:
+            return img
+        x, y = origin
+        lines = [f'FPS {self.fps():.1f}']
+        lines += [f"{name:<10} {s['p50_ms']:6.2f} ms  p95 {s['p95_ms']:6.2f}" for name, s in self.summary().items()]
+        for i, line in enumerate(lines):
+            cv2.putText(img, line, (x, y + 18 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (0, 0, 0), 3)
+            cv2.putText(img, line, (x, y + 18 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.45, color, 1)
+        return img
+
+    def prometheus(self, prefix='leaf'):
+        lines = [f'# TYPE {prefix}_stage_ms summary']
+        for name, s in self.summary().items():
+            lines.append(f'{prefix}_stage_ms{{stage="{name}",quantile="0.5"}} {s["p50_ms"]:.4f}')
+            lines.append(f'{prefix}_stage_ms{{stage="{name}",quantile="0.95"}} {s["p95_ms"]:.4f}')
+            lines.append(f'{prefix}_stage_ms_sum{{stage="{name}"}} {s["sum_ms"]:.4f}')
+            lines.append(f'{prefix}_stage_ms_count{{stage="{name}"}} {s["count"]}')
+        lines.append(f'# TYPE {prefix}_fps gauge')
+        lines.append(f'{prefix}_fps {self.fps():.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        rows = [f"{'stage':<12}{'mean':>8}{'p50':>8}{'p95':>8}{'max':>8}  histogram (ms <= {HIST_BUCKETS_MS[:-1]}, more)"]
+        for name, s in self.summary().items():
+            hist = ' '.join(str(c) for c in self.histogram(name).tolist())
+            rows.append(f"{name:<12}{s['mean_ms']:8.2f}{s['p50_ms']:8.2f}{s['p95_ms']:8.2f}{s['max_ms']:8.2f}  {hist}")
+        rows.append(f'FPS {self.fps():.1f}')
+        return '\n'.join(rows)
+
+
+PROFILER = StageTimer()
+
+
+class MetricsExporter:
+    """Publishes a StageTimer as Prometheus text: periodic file dump and/or HTTP /metrics."""
+
+    def __init__(self, timer, path=None, port=None, interval=2.0, host='127.0.0.1'):
+        self.timer = timer
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._server = None
+        self._threads = []
+        if path:
+            t = threading.Thread(target=self._dump_loop, name='metrics-file', daemon=True)
+            t.start()
+            self._threads.append(t)
+        if port:
+            self._server = ThreadingHTTPServer((host, port), self._handler())
+            t = threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _handler(self):
+        timer = self.timer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = timer.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def dump(self):
+        # Write-then-rename so readers never see a half-written file
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.timer.prometheus())
+        os.replace(tmp, self.path)
+
+    def _dump_loop(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def close(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for t in self._threads:
+            t.join()
+        if self.path:
+            self.dump()
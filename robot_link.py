@@ -0,0 +1,430 @@
+"""
+Asynchronous robot command channel for detected leaf targets.
+
+The readme sends `ser.write(f"{cx},{cy}\\n".encode())` per leaf from the
+detection loop: at 115200 baud a handful of leaves blocks the loop for
+milliseconds, a slower link blocks it for longer every frame, and the same
+unchanged targets are re-sent frame after frame. RobotLink takes the link
+off the loop:
+
+- publish() only packs the frame's targets (largest leaves first, at most
+  max_targets) into one compact binary packet and drops it into a one-slot
+  mailbox; a writer thread sends it. When the link is slower than the
+  camera, an unsent packet is replaced by the newer one (superseded), and a
+  packet older than max_age by the time the link is free is dropped (stale)
+- frames whose targets did not move by more than `deadband` (same track IDs)
+  are not sent again, except for a keepalive every `keepalive` seconds
+- latency from frame capture to bytes written (and drained) is kept per
+  packet: report() gives p50 / p95 / max, and with PROFILER enabled it shows
+  up as the 'robot_link' stage in the overlay and /metrics
+- with `baudrate` set the writer also waits out each packet's time on the
+  wire (10 bits per byte). Kernel buffers of pseudo-terminals and many
+  USB-serial adapters accept writes long before the bytes are sent, which
+  would otherwise hide a slow link from the stale / superseded logic
+
+Packet (little-endian), 17 + 8 * n bytes:
+    'LR' | version u8 | flags u8 | seq u16 | frame u32 | age_ms u16 | n u8
+    n x (track_id i16, x i16, y i16, area u16)
+    crc32 u32 over everything before it
+flags bit 0: x / y in millimetres and area in cm^2 (from a calibration,
+see calibration.py, converted from its `units`: mm, cm, m or in),
+otherwise pixels and pixel area. age_ms is the time
+from capture to the moment the packet was handed to the port.
+
+pyserial is used when installed; otherwise a POSIX tty (or pseudo-terminal)
+is opened directly with termios. PtyStandIn is a local pseudo-terminal
+"robot" that decodes the packets, optionally at a simulated baud rate, so
+everything runs without hardware.
+
+Usage:
+    link = RobotLink(open_port('/dev/ttyUSB0', 115200), max_age=0.2)
+    link.publish(frame_idx, detections, capture_ts)   # capture_ts from time.perf_counter()
+    print(link.report())
+    link.close()
+
+    python robot_link.py selftest --baud 9600 --fps 30    # pty stand-in at 9600 baud
+    python robot_link.py listen /dev/ttyUSB1              # print decoded packets
+"""
+
+import argparse
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+import numpy as np
+
+from profiling import PROFILER
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = tty = None
+
+MAGIC = b'LR'
+VERSION = 1
+FLAG_WORLD = 0x01
+HEADER = struct.Struct('<2sBBHIHB')
+CRC = struct.Struct('<I')
+# Millimetres per calibration world unit
+UNIT_MM = {'mm': 1.0, 'cm': 10.0, 'm': 1000.0, 'in': 25.4}
+TARGET_DTYPE = np.dtype([('track_id', '<i2'), ('x', '<i2'), ('y', '<i2'), ('area', '<u2')])
+
+
+def encode_targets(detections, max_targets=16, world=False, units='cm'):
+    """(targets bytes, n) for the largest max_targets leaves; world: millimetres / cm^2 from a calibration in units."""
+    n = min(len(detections), max_targets, 255)
+    targets = np.zeros(n, dtype=TARGET_DTYPE)
+    if not n:
+        return targets.tobytes(), 0
+    order = np.argsort(-detections.areas, kind='stable')[:n]
+    if world:
+        scale = UNIT_MM[units]
+        xy = detections.world[order] * scale
+        area = detections.world_areas[order] * (scale / 10.0) ** 2
+    else:
+        xy = detections.centroids[order]
+        area = detections.areas[order]
+    targets['track_id'] = np.clip(detections.track_ids[order], -1, 32767)
+    xy = np.clip(np.nan_to_num(np.round(xy), nan=-32768), -32768, 32767)
+    targets['x'], targets['y'] = xy[:, 0], xy[:, 1]
+    targets['area'] = np.clip(np.nan_to_num(np.round(area)), 0, 65535)
+    return targets.tobytes(), n
+
+
+def build_packet(seq, frame_idx, age_ms, n, targets, flags=0):
+    body = HEADER.pack(MAGIC, VERSION, flags, seq & 0xFFFF, frame_idx & 0xFFFFFFFF,
+                       min(int(age_ms), 0xFFFF), n) + targets
+    return body + CRC.pack(zlib.crc32(body))
+
+
+class PacketDecoder:
+    """Incremental decoder: feed() raw bytes, get complete, CRC-checked packets; resyncs on garbage."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self.bad = 0
+
+    def feed(self, data):
+        self._buf += data
+        packets = []
+        while True:
+            start = self._buf.find(MAGIC)
+            if start < 0:
+                # Keep a trailing 'L' that may start the next magic
+                del self._buf[:max(0, len(self._buf) - 1)]
+                return packets
+            del self._buf[:start]
+            if len(self._buf) < HEADER.size:
+                return packets
+            _, version, flags, seq, frame_idx, age_ms, n = HEADER.unpack_from(self._buf)
+            size = HEADER.size + n * TARGET_DTYPE.itemsize + CRC.size
+            # A wrong version is rejected before waiting for `size` bytes a garbage header may claim
+            if version == VERSION and len(self._buf) < size:
+                return packets
+            if version != VERSION or CRC.unpack_from(self._buf, size - CRC.size)[0] != zlib.crc32(
+                    bytes(self._buf[:size - CRC.size])):
+                # Not a packet start after all: skip this magic and look for the next one
+                self.bad += 1
+                del self._buf[:1]
+                continue
+            targets = np.frombuffer(bytes(self._buf[HEADER.size:size - CRC.size]), dtype=TARGET_DTYPE)
+            packets.append({'seq': seq, 'frame': frame_idx, 'age_ms': age_ms, 'flags': flags, 'targets': targets})
+            del self._buf[:size]
+
+
+class PosixPort:
+    """Raw-mode tty / pseudo-terminal opened with termios, for systems without pyserial."""
+
+    def __init__(self, path, baudrate=115200):
+        if termios is None:
+            raise ImportError('serial ports need pyserial (pip install pyserial) on this platform')
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+        speed = getattr(termios, f'B{baudrate}', None)
+        if speed is not None:
+            attrs = termios.tcgetattr(self.fd)
+            attrs[4] = attrs[5] = speed
+            termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+        return len(data)
+
+    def flush(self):
+        # Wait until the driver has sent everything
+        termios.tcdrain(self.fd)
+
+    def read(self, size=4096):
+        return os.read(self.fd, size)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_port(path, baudrate=115200):
+    if serial is not None:
+        # Short read timeout so listeners get partial reads; writes still block until accepted
+        return serial.Serial(path, baudrate, timeout=0.05, write_timeout=None)
+    return PosixPort(path, baudrate)
+
+
+class RobotLink:
+    """Sends the newest frame's targets on a writer thread; never blocks the caller on the link."""
+
+    def __init__(self, port, max_targets=16, max_age=0.2, deadband=2.0, keepalive=1.0, world=False, baudrate=None,
+                 window=1000, units='cm'):
+        if world and units not in UNIT_MM:
+            raise ValueError(f'Cannot send world targets in {units!r} (expected one of {tuple(UNIT_MM)})')
+        self.port = port
+        self.max_targets = max_targets
+        self.max_age = max_age
+        self.deadband = deadband
+        self.keepalive = keepalive
+        self.world = world
+        self.units = units
+        self.baudrate = baudrate
+        self._wire_free = 0.0
+        self._cond = threading.Condition()
+        # One-slot mailbox: (frame_idx, capture_ts, n, targets)
+        self._pending = None
+        self._closed = False
+        self._last_targets = None
+        self._last_queued = None
+        self._seq = 0
+
+        self.published = 0
+        self.sent = 0
+        self.bytes_sent = 0
+        self.unchanged = 0
+        self.superseded = 0
+        self.stale = 0
+        self.errors = 0
+        self.latency_ms = deque(maxlen=window)
+
+        self._thread = threading.Thread(target=self._writer, name='robot-link', daemon=True)
+        self._thread.start()
+
+    def _unchanged(self, targets):
+        last = self._last_targets
+        if last is None or len(last) != len(targets):
+            return False
+        if not np.array_equal(last['track_id'], targets['track_id']):
+            return False
+        moved = np.abs(last['x'].astype(np.int32) - targets['x']).max(initial=0)
+        moved = max(moved, np.abs(last['y'].astype(np.int32) - targets['y']).max(initial=0))
+        return moved <= self.deadband
+
+    def publish(self, frame_idx, detections, capture_ts=None):
+        """Queue this frame's targets (capture_ts: time.perf_counter() at capture); returns False if skipped."""
+        capture_ts = time.perf_counter() if capture_ts is None else capture_ts
+        payload, n = encode_targets(detections, self.max_targets, self.world, self.units)
+        targets = np.frombuffer(payload, dtype=TARGET_DTYPE)
+        now = time.monotonic()
+        # The writer thread clears _last_targets when a packet never reached the robot, so the
+        # deadband decision and the mailbox update happen under the same lock
+        with self._cond:
+            self.published += 1
+            if self._unchanged(targets) and now - self._last_queued < self.keepalive:
+                self.unchanged += 1
+                return False
+            self._last_targets, self._last_queued = targets, now
+            if self._pending is not None:
+                self.superseded += 1
+            self._pending = (frame_idx, capture_ts, n, payload)
+            self._cond.notify()
+        return True
+
+    def _writer(self):
+        flags = FLAG_WORLD if self.world else 0
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                frame_idx, capture_ts, n, payload = self._pending
+                self._pending = None
+            age = time.perf_counter() - capture_ts
+            if self.max_age and age > self.max_age:
+                # The robot would act on where the leaves were, not where they are
+                # Nothing of these targets reached the robot: the next frame must not count as unchanged
+                with self._cond:
+                    self.stale += 1
+                    self._last_targets = None
+                continue
+            packet = build_packet(self._seq, frame_idx, age * 1000.0, n, payload, flags)
+            self._seq += 1
+            if self.baudrate:
+                # Estimated end of transmission, counted from when the write starts
+                self._wire_free = max(self._wire_free, time.perf_counter()) + len(packet) * 10.0 / self.baudrate
+            try:
+                self.port.write(packet)
+                self.port.flush()
+            except OSError as e:
+                with self._cond:
+                    self.errors += 1
+                    self._last_targets = None
+                print(f'WARNING: robot link write failed: {e}')
+                continue
+            if self.baudrate:
+                # No-op when flush() already drained a real UART; waits out buffered ptys / adapters
+                time.sleep(max(0.0, self._wire_free - time.perf_counter()))
+            ms = (time.perf_counter() - capture_ts) * 1000.0
+            self.latency_ms.append(ms)
+            self.sent += 1
+            self.bytes_sent += len(packet)
+            if PROFILER.enabled:
+                PROFILER.record('robot_link', ms)
+
+    def stats(self):
+        lat = np.array(self.latency_ms)
+        p50, p95 = np.percentile(lat, [50, 95]).tolist() if len(lat) else (None, None)
+        return {
+            'published': self.published,
+            'sent': self.sent,
+            'bytes': self.bytes_sent,
+            'unchanged': self.unchanged,
+            'superseded': self.superseded,
+            'stale': self.stale,
+            'errors': self.errors,
+            'latency_p50_ms': p50,
+            'latency_p95_ms': p95,
+            'latency_max_ms': float(lat.max()) if len(lat) else None,
+        }
+
+    def report(self):
+        s = self.stats()
+        text = (f"Robot link: {s['sent']}/{s['published']} frames sent ({s['bytes']} bytes), "
+                f"{s['unchanged']} unchanged, {s['superseded']} superseded, {s['stale']} stale")
+        if s['latency_p50_ms'] is not None:
+            text += (f", capture->written p50 {s['latency_p50_ms']:.1f} ms, p95 {s['latency_p95_ms']:.1f} ms, "
+                     f"max {s['latency_max_ms']:.1f} ms")
+        return text
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.port.close()
+
+
+class PtyStandIn:
+    """Local pseudo-terminal 'robot': decodes packets from self.path, optionally at a simulated baud rate."""
+
+    def __init__(self, baudrate=None):
+        if termios is None:
+            raise ImportError('PtyStandIn needs a POSIX system (pty / termios)')
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        # ~10 bits per byte on the wire (start + 8 data + stop)
+        self.bytes_per_sec = baudrate / 10.0 if baudrate else None
+        self.decoder = PacketDecoder()
+        self.packets = []
+        self._stopped = False
+        self._thread = threading.Thread(target=self._reader, name='pty-robot', daemon=True)
+        self._thread.start()
+
+    def _reader(self):
+        while not self._stopped:
+            try:
+                data = os.read(self._master, 64 if self.bytes_per_sec else 4096)
+            except OSError:
+                return
+            if self.bytes_per_sec:
+                time.sleep(len(data) / self.bytes_per_sec)
+            now = time.perf_counter()
+            for packet in self.decoder.feed(data):
+                packet['received'] = now
+                self.packets.append(packet)
+
+    def close(self):
+        self._stopped = True
+        os.close(self._slave)
+        os.close(self._master)
+        self._thread.join(timeout=1.0)
+
+
+def _selftest(args):
+    from benchmark import make_leaf_scene
+    from main import detect_leaves
+    from tracker import LeafTracker
+
+    robot = PtyStandIn(args.baud)
+    link = RobotLink(open_port(robot.path, args.baud), max_age=args.max_age, baudrate=args.baud)
+    frame = make_leaf_scene(800, 600, args.leaves, noise=4)
+    lower, upper = np.array([25, 40, 40], dtype=np.uint8), np.array([95, 255, 255], dtype=np.uint8)
+    tracker = LeafTracker()
+    publish_ms = []
+    n_frames = int(args.seconds * args.fps)
+    t_start = time.perf_counter()
+    for idx in range(n_frames):
+        capture_ts = time.perf_counter()
+        # Leaves drift a few pixels per frame, so every frame carries new targets
+        shifted = np.roll(frame, (idx * 3) % frame.shape[1], axis=1)
+        _, dets = detect_leaves(shifted, lower, upper, min_area=300)
+        dets = tracker.update(dets)
+        t0 = time.perf_counter()
+        link.publish(idx, dets, capture_ts)
+        publish_ms.append((time.perf_counter() - t0) * 1000.0)
+        time.sleep(max(0.0, t_start + (idx + 1) / args.fps - time.perf_counter()))
+    time.sleep(0.5)
+    link.close()
+    robot.close()
+    print(link.report())
+    print(f'publish() on the detection loop: mean {np.mean(publish_ms):.3f} ms, max {np.max(publish_ms):.3f} ms')
+    text = sum(len(f'{int(cx)},{int(cy)}\n') for cx, cy in dets.centroids.tolist())
+    print(f'Blocking text writes (readme) would hold the loop ~{text * 10000.0 / args.baud:.1f} ms per frame '
+          f'at {args.baud} baud ({text} bytes for {len(dets)} leaves)')
+    if robot.packets:
+        ages = np.array([p['age_ms'] for p in robot.packets])
+        print(f'Stand-in decoded {len(robot.packets)} packets ({robot.decoder.bad} bad), '
+              f'age at send p50 {np.median(ages):.1f} ms, last frame {robot.packets[-1]["frame"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Robot command channel: local self-test and packet listener')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('selftest', help='Publish synthetic detections to a pseudo-terminal stand-in')
+    p.add_argument('--baud', type=int, default=115200, help='Simulated link speed')
+    p.add_argument('--fps', type=float, default=30.0)
+    p.add_argument('--seconds', type=float, default=3.0)
+    p.add_argument('--leaves', type=int, default=12)
+    p.add_argument('--max-age', type=float, default=0.2, help='Drop packets older than this (seconds)')
+    p = sub.add_parser('listen', help='Print packets arriving on a serial port')
+    p.add_argument('port')
+    p.add_argument('--baud', type=int, default=115200)
+    args = parser.parse_args()
+
+    if args.cmd == 'selftest':
+        _selftest(args)
+        return
+    port = open_port(args.port, args.baud)
+    decoder = PacketDecoder()
+    try:
+        while True:
+            for packet in decoder.feed(port.read(4096)):
+                unit = 'mm' if packet['flags'] & FLAG_WORLD else 'px'
+                targets = ' '.join(f"#{t['track_id']}@{t['x']},{t['y']}" for t in packet['targets'])
+                print(f"seq {packet['seq']} frame {packet['frame']} age {packet['age_ms']} ms [{unit}] {targets}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        port.close()
+
+
+if __name__ == '__main__':
+    main()
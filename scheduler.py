@@ -0,0 +1,177 @@
+"""
+Region-of-interest scheduling for the live detection loop.
+
+The picker only needs leaves in part of the frame (e.g. the lower half in
+front of the gripper), and between two frames leaves barely move. The
+scheduler decides, per frame, which rectangles detect_leaves should touch:
+
+- static ROIs: polygons (fractions of the processed frame) that bound every
+  detection; pixels outside them are never thresholded
+- full pass every `full_every` frames: the whole frame (or the static ROIs)
+  so new leaves entering the view are picked up
+- in between: only rectangles around the previous frame's leaves, grown by
+  `margin` (fraction of the box) + `min_pad` pixels to cover motion
+- fall back to a full pass on the next frame when a tracked leaf is lost
+  (one of the ROIs came back empty) or nothing is being tracked
+
+Overlapping rectangles are merged, so no pixel is processed twice. The
+pixels processed per frame (and the average fraction of the frame) are
+exposed through `last_pixels` and `stats()` for tuning CPU use on small boards.
+
+Usage:
+    sched = ROIScheduler(static_rois=[[(0, 0.5), (1, 0.5), (1, 1), (0, 1)]], full_every=10)
+    rois, roi_mask = sched.plan(frame.shape)
+    mask, dets = detect_leaves(frame, lower, upper, rois=rois, roi_mask=roi_mask)
+    sched.update(dets)
+"""
+
+import argparse
+
+import cv2
+import numpy as np
+
+
+def parse_polygon(text):
+    # "x,y x,y x,y ..." with coordinates as fractions of the frame width/height
+    try:
+        points = [tuple(float(v) for v in pair.split(',')) for pair in text.split()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected "x,y x,y x,y" but got {text!r}')
+    if len(points) < 3 or any(len(p) != 2 for p in points):
+        raise argparse.ArgumentTypeError(f'A ROI polygon needs at least 3 x,y points, got {text!r}')
+    return points
+
+
+def merge_rects(rects):
+    # rects as [x0, y0, x1, y1]; repeatedly union any two that overlap
+    rects = [list(r) for r in rects]
+    merged = True
+    while merged and len(rects) > 1:
+        merged = False
+        out = []
+        for r in rects:
+            for o in out:
+                if r[0] < o[2] and o[0] < r[2] and r[1] < o[3] and o[1] < r[3]:
+                    o[0], o[1] = min(o[0], r[0]), min(o[1], r[1])
+                    o[2], o[3] = max(o[2], r[2]), max(o[3], r[3])
+                    merged = True
+                    break
+            else:
+                out.append(r)
+        rects = out
+    return rects
+
+
+class ROIScheduler:
+    """Plans which parts of each frame detect_leaves processes."""
+
+    def __init__(self, static_rois=None, full_every=10, margin=0.25, min_pad=16):
+        self.static_rois = [np.asarray(p, dtype=np.float64) for p in static_rois or []]
+        self.full_every = max(1, int(full_every))
+        self.margin = margin
+        self.min_pad = min_pad
+
+        self.frames = 0
+        self.full_frames = 0
+        self.fallbacks = 0
+        self.last_pixels = 0
+        self.last_full = True
+        self._pixels_total = 0
+        self._frame_pixels = 0
+        self._since_full = 0
+        self._force_full = True
+        self._track_rects = []
+        self._shape = None
+        self._static_mask = None
+        self._static_rects = None
+
+    def _prepare(self, shape):
+        h, w = shape[:2]
+        if self._shape == (h, w):
+            return
+        self._shape = (h, w)
+        self._frame_pixels = h * w
+        self._track_rects = []
+        self._force_full = True
+        if not self.static_rois:
+            self._static_mask = None
+            self._static_rects = [[0, 0, w, h]]
+            return
+        self._static_mask = np.zeros((h, w), dtype=np.uint8)
+        rects = []
+        for poly in self.static_rois:
+            pts = np.round(poly * (w - 1, h - 1)).astype(np.int32)
+            cv2.fillPoly(self._static_mask, [pts], 255)
+            x, y, bw, bh = cv2.boundingRect(pts)
+            rects.append([x, y, x + bw, y + bh])
+        self._static_rects = merge_rects(rects)
+
+    def plan(self, shape):
+        """Return (rois, roi_mask) for detect_leaves; rois=None means the whole frame."""
+        self._prepare(shape)
+        h, w = self._shape
+        full = self._force_full or not self._track_rects or self._since_full + 1 >= self.full_every
+        if full:
+            rects = self._static_rects
+            self._since_full = 0
+            self.full_frames += 1
+        else:
+            # Track rects, clipped to the bounding box of the static ROIs
+            bx0 = min(r[0] for r in self._static_rects)
+            by0 = min(r[1] for r in self._static_rects)
+            bx1 = max(r[2] for r in self._static_rects)
+            by1 = max(r[3] for r in self._static_rects)
+            rects = [[max(x0, bx0), max(y0, by0), min(x1, bx1), min(y1, by1)]
+                     for x0, y0, x1, y1 in self._track_rects]
+            rects = merge_rects([r for r in rects if r[2] > r[0] and r[3] > r[1]])
+            self._since_full += 1
+        self.frames += 1
+        self.last_full = full
+        self.last_pixels = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in rects)
+        self._pixels_total += self.last_pixels
+
+        if full and self._static_mask is None:
+            return None, None
+        return [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in rects], self._static_mask
+
+    def update(self, detections):
+        """Feed back the detections of the frame that was just planned."""
+        h, w = self._shape
+        rects = detections.rects
+        centroids = detections.centroids
+        if not self.last_full and self._track_rects:
+            # Lost track: some ROI around a previous leaf no longer contains any leaf centroid
+            tr = np.array(self._track_rects, dtype=np.float64)
+            cx, cy = centroids[:, 0], centroids[:, 1]
+            inside = ((cx[None, :] >= tr[:, 0:1]) & (cx[None, :] < tr[:, 2:3]) &
+                      (cy[None, :] >= tr[:, 1:2]) & (cy[None, :] < tr[:, 3:4]))
+            if not inside.any(axis=1).all():
+                self._force_full = True
+                self.fallbacks += 1
+            else:
+                self._force_full = False
+        else:
+            self._force_full = False
+
+        r = rects.astype(np.int64)
+        pad_x = (r[:, 2] * self.margin).astype(np.int64) + self.min_pad
+        pad_y = (r[:, 3] * self.margin).astype(np.int64) + self.min_pad
+        x0 = np.maximum(r[:, 0] - pad_x, 0)
+        y0 = np.maximum(r[:, 1] - pad_y, 0)
+        x1 = np.minimum(r[:, 0] + r[:, 2] + pad_x, w)
+        y1 = np.minimum(r[:, 1] + r[:, 3] + pad_y, h)
+        self._track_rects = np.stack([x0, y0, x1, y1], 1).tolist()
+
+    def reset(self):
+        # e.g. after the thresholds change: next frame is a full pass
+        self._force_full = True
+
+    def stats(self):
+        mean = self._pixels_total / self.frames if self.frames else 0.0
+        return {
+            'frames': self.frames,
+            'full_frames': self.full_frames,
+            'fallbacks': self.fallbacks,
+            'mean_pixels': int(mean),
+            'mean_fraction': round(mean / self._frame_pixels, 3) if self._frame_pixels else 0.0,
+        }
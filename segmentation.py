@@ -0,0 +1,256 @@
+"""
+Lookup-table HSV segmentation for the leaf detector.
+
+cv2.cvtColor(BGR2HSV) + cv2.inRange costs two full-frame passes and an
+intermediate HSV image per frame, and every extra HSV range adds another
+inRange + bitwise_or. The thresholds only change when a trackbar moves, so
+instead we classify every BGR colour once and store the answer in a table:
+
+- build: all (2**bits)**3 quantized BGR colours -> HSV -> inRange against
+  every range -> one packed table (rebuilt only when the ranges change)
+- per frame: BGR -> BGRA (so each pixel is one uint32), mask the low bits,
+  one vectorized gather from the table
+
+Several ranges (e.g. all presets from 2preset.py) are OR-ed into the same
+table, so the per-frame cost does not grow with the number of ranges.
+labels() uses a second table built from the same classification, with bit i
+set where range i matches, to tell which preset(s) a pixel belongs to (up to
+MAX_LABELS ranges).
+
+Hue is circular (0..179 in OpenCV), so a range with H_low > H_high wraps
+around 179 -> 0 (reds, reddish-brown dry leaves). The LUT resolves the wrap
+while it is built, so a wrapped range costs the same per frame as any other.
+The cvtColor+inRange path (range_mask) has to split a wrapped range into
+[H_low, 179] and [0, H_high] and OR the two, about twice the cost of one
+inRange, which is one more reason to prefer the LUT for red presets.
+
+bits=5 gives a 32x32x32 table that rebuilds in about a millisecond
+(smooth trackbar dragging); bits=8 is exact (full 24-bit table) but takes
+a few hundred ms to rebuild, so it suits fixed thresholds.
+
+Usage:
+    seg = LUTSegmenter(bits=5)
+    seg.update([((25, 40, 40), (95, 255, 255))])
+    mask = seg.mask(frame_bgr)
+    bits = seg.labels(frame_bgr)           # bit i: pixel matches range i
+"""
+
+import cv2
+import numpy as np
+
+# Ranges that labels() / label_image() can tell apart (one bit each)
+MAX_LABELS = 16
+
+
+def normalize_ranges(ranges):
+    return tuple((tuple(int(v) for v in lo), tuple(int(v) for v in hi)) for lo, hi in ranges)
+
+
+def hue_wraps(lo, hi):
+    return int(lo[0]) > int(hi[0])
+
+
+def mean_hsv(pixels):
+    # Mean (h, s, v) of HSV pixels with a circular hue mean: hues 178 and 2 average to 0, not 90
+    pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 3)
+    angle = pixels[:, 0] * (np.pi / 90.0)
+    h = np.arctan2(np.sin(angle).mean(), np.cos(angle).mean()) * (90.0 / np.pi)
+    s, v = pixels[:, 1:].mean(axis=0)
+    return int(round(h)) % 180, int(s), int(v)
+
+
+def range_mask(hsv, lo, hi, dst=None):
+    """cv2.inRange on an HSV image, with H_low > H_high selecting the hue range that wraps past 179."""
+    if not hue_wraps(lo, hi):
+        return cv2.inRange(hsv, np.asarray(lo, dtype=np.uint8), np.asarray(hi, dtype=np.uint8), dst=dst)
+    # [H_low, 179] | [0, H_high]; cheaper than any single-pass LUT form on full frames
+    upper = cv2.inRange(hsv, (int(lo[0]), int(lo[1]), int(lo[2])), (179, int(hi[1]), int(hi[2])), dst=dst)
+    lower = cv2.inRange(hsv, (0, int(lo[1]), int(lo[2])), (int(hi[0]), int(hi[1]), int(hi[2])))
+    return cv2.bitwise_or(upper, lower, dst=upper)
+
+
+def _label_dtype(n_ranges):
+    if n_ranges > MAX_LABELS:
+        raise ValueError(f'at most {MAX_LABELS} ranges can be labelled, got {n_ranges}')
+    return np.uint8 if n_ranges <= 8 else np.uint16
+
+
+class LUTSegmenter:
+    """BGR -> mask classifier backed by a precomputed colour lookup table."""
+
+    def __init__(self, bits=5):
+        if not 1 <= bits <= 8:
+            raise ValueError(f'bits must be in 1..8, got {bits}')
+        self.bits = bits
+        self.shift = 8 - bits
+        # Keep the top `bits` bits of each of B, G, R inside the packed uint32
+        keep = (0xFF << self.shift) & 0xFF
+        self.pixel_mask = keep | (keep << 8) | (keep << 16)
+        self.ranges = None
+        self.table = None
+        self.label_table = None
+        self._cell_bits = None
+        self.builds = 0
+        self._bgra = None
+        self._index = None
+
+    def _bucket_colors(self):
+        # Representative BGR colour (bucket centre) for every quantized cell, laid out [r, g, b]
+        n = 1 << self.bits
+        levels = (np.arange(n, dtype=np.uint16) << self.shift).astype(np.uint8)
+        if self.shift:
+            levels |= 1 << (self.shift - 1)
+        colors = np.empty((n, n, n, 3), dtype=np.uint8)
+        colors[..., 0] = levels[None, None, :]
+        colors[..., 1] = levels[None, :, None]
+        colors[..., 2] = levels[:, None, None]
+        return colors.reshape(n * n, n, 3)
+
+    def update(self, ranges):
+        ranges = normalize_ranges(ranges)
+        if ranges == self.ranges:
+            return False
+        n = 1 << self.bits
+        hsv = cv2.cvtColor(self._bucket_colors(), cv2.COLOR_BGR2HSV)
+        hit = np.zeros(hsv.shape[:2], dtype=np.uint8)
+        # Per-cell range bits for labels(); only kept when the ranges fit in MAX_LABELS bits
+        cell_bits = np.zeros(hsv.shape[:2], dtype=_label_dtype(len(ranges))) if len(ranges) <= MAX_LABELS else None
+        for i, (lo, hi) in enumerate(ranges):
+            m = range_mask(hsv, lo, hi)
+            cv2.bitwise_or(hit, m, dst=hit)
+            if cell_bits is not None:
+                cell_bits[m != 0] |= 1 << i
+
+        self.table = self._expand(hit)
+        self._cell_bits = cell_bits
+        # Built on the first labels() call: plain mask() users never pay for it
+        self.label_table = None
+        self.ranges = ranges
+        self.builds += 1
+        return True
+
+    def _expand(self, cells):
+        # Packed index is b | g << 8 | r << 16 (after the shift), i.e. table[r, g, b]
+        n = 1 << self.bits
+        table = np.zeros((n, 256, 256), dtype=cells.dtype)
+        table[:, :n, :n] = cells.reshape(n, n, n)
+        return table.reshape(-1)
+
+    def _pack(self, frame):
+        # Flat buffers sized for the largest frame seen; smaller frames/ROIs use a view of the prefix
+        h, w = frame.shape[:2]
+        n = h * w
+        if self._index is None or self._index.size < n:
+            self._bgra = np.empty(n * 4, dtype=np.uint8)
+            # intp: np.take would otherwise convert the whole index array on every call
+            self._index = np.empty(n, dtype=np.intp)
+        bgra = self._bgra[:n * 4].reshape(h, w, 4)
+        index = self._index[:n].reshape(h, w)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA, dst=bgra)
+        # Little-endian view: B | G << 8 | R << 16 | A << 24; dropping A happens in the mask
+        np.bitwise_and(bgra.view(np.uint32)[..., 0], self.pixel_mask, out=index)
+        if self.shift:
+            np.right_shift(index, self.shift, out=index)
+        return index
+
+    def mask(self, frame, dst=None):
+        if self.table is None:
+            raise RuntimeError('LUTSegmenter.update() must be called before mask()')
+        index = self._pack(frame)
+        # The packed index is always inside the table; mode='raise' would make np.take buffer `out`
+        return np.take(self.table, index, out=dst, mode='clip')
+
+    def labels(self, frame, dst=None):
+        """Per-pixel range bits (bit i set where range i matches), uint8 or uint16 for > 8 ranges."""
+        if self.table is None:
+            raise RuntimeError('LUTSegmenter.update() must be called before labels()')
+        if self._cell_bits is None:
+            _label_dtype(len(self.ranges))
+        if self.label_table is None:
+            self.label_table = self._expand(self._cell_bits)
+        index = self._pack(frame)
+        return np.take(self.label_table, index, out=dst, mode='clip')
+
+
+def _threshold(frame, ranges, segmenter=None):
+    if segmenter is not None:
+        segmenter.update(ranges)
+        return segmenter.mask(frame)
+    return inrange_mask(frame, ranges)
+
+
+def pyramid_mask(frame, ranges, scale, kernel_size=5, segmenter=None, min_area=0):
+    """Threshold + morphology at 1/scale, then re-threshold blob edges at full resolution.
+
+    The threshold/morphology part costs roughly 1/scale**2 of the full-size
+    pass. Afterwards only the ROIs of blobs that can still reach min_area are
+    touched at full resolution: the blob is upsampled, and the band of
+    +-scale pixels around its boundary is re-thresholded from the original
+    pixels of that ROI, so outlines (and bounding boxes) stay pixel-accurate.
+    """
+    h, w = frame.shape[:2]
+    sw, sh = max(1, w // scale), max(1, h // scale)
+    small = cv2.resize(frame, (sw, sh), interpolation=cv2.INTER_AREA)
+    small_mask = _threshold(small, ranges, segmenter)
+
+    # Same open/close as detect_leaves with the kernel scaled down; area averaging
+    # in the resize already removes speckle that a kernel < 3 would have removed
+    ks = int(round(kernel_size / scale)) | 1
+    if ks >= 3:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (ks, ks))
+        small_mask = cv2.morphologyEx(small_mask, cv2.MORPH_OPEN, kernel, iterations=1)
+        small_mask = cv2.morphologyEx(small_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+    mask = np.zeros((h, w), dtype=np.uint8)
+    contours, _ = cv2.findContours(small_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # Generous cut-off: the refined outline may grow by up to one band width
+    min_small_area = 0.5 * min_area / (scale * scale)
+    band_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * scale + 1, 2 * scale + 1))
+    pad = 2
+    for cnt in contours:
+        if min_small_area and cv2.contourArea(cnt) < min_small_area:
+            continue
+        x, y, bw, bh = cv2.boundingRect(cnt)
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(sw, x + bw + pad), min(sh, y + bh + pad)
+        # Full-resolution ROI; blobs touching the right/bottom edge also cover the
+        # remainder columns/rows lost to the integer downscale
+        fx0, fy0 = x0 * scale, y0 * scale
+        fx1 = w if x1 == sw else x1 * scale
+        fy1 = h if y1 == sh else y1 * scale
+
+        up = cv2.resize(small_mask[y0:y1, x0:x1], None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+        if up.shape != (fy1 - fy0, fx1 - fx0):
+            up = cv2.copyMakeBorder(up, 0, fy1 - fy0 - up.shape[0], 0, fx1 - fx0 - up.shape[1],
+                                    cv2.BORDER_REPLICATE)
+        band = cv2.dilate(up, band_kernel)
+        cv2.subtract(band, cv2.erode(up, band_kernel), dst=band)
+        fine = _threshold(frame[fy0:fy1, fx0:fx1], ranges, segmenter)
+        cv2.copyTo(fine, band, up)
+        # Neighbouring ROIs may overlap; OR keeps both blobs intact
+        roi = mask[fy0:fy1, fx0:fx1]
+        cv2.bitwise_or(roi, up, dst=roi)
+    return mask
+
+
+def label_image(frame, ranges, segmenter=None):
+    # Range bits per pixel: through the LUT when given, else one inRange per range
+    if segmenter is not None:
+        segmenter.update(ranges)
+        return segmenter.labels(frame)
+    ranges = normalize_ranges(ranges)
+    bits = np.zeros(frame.shape[:2], dtype=_label_dtype(len(ranges)))
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    for i, (lo, hi) in enumerate(ranges):
+        bits[range_mask(hsv, lo, hi) != 0] |= 1 << i
+    return bits
+
+
+def inrange_mask(frame, ranges):
+    # Reference path: one HSV conversion, one inRange per range
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    mask = None
+    for lo, hi in normalize_ranges(ranges):
+        m = range_mask(hsv, lo, hi)
+        mask = m if mask is None else cv2.bitwise_or(mask, m)
+    return mask
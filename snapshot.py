@@ -0,0 +1,195 @@
+"""
+Asynchronous snapshot writer for the leaf detector ('s' key, dataset collection).
+
+The 's' key used to cv2.imwrite a JPEG frame and a PNG mask on the UI
+thread, which stalled the video for tens of milliseconds, and its
+second-granularity timestamps made two saves within one second overwrite
+each other. SnapshotWriter moves all of it off the capture loop:
+
+- save() / autosave() only copy the images (the loop reuses its buffers)
+  and put them on a bounded queue; `workers` background threads encode and
+  write them (cv2.imwrite releases the GIL while it encodes)
+- the caller never waits on disk: when the queue is full the snapshot is
+  dropped and counted instead
+- formats: jpg (jpeg_quality), png (png_compression 0-9) or npy (raw
+  arrays, np.save); masks are stored lossless (png, or npy with npy)
+- unique names: <kind>_<date>_<time>_<microseconds>_f<frame>_<counter>,
+  written under a temporary name and renamed, so a file with its final name
+  is always complete
+- autosave(): every detection of at least `min_area` px is saved as a
+  padded crop of the frame and of the mask, and described by one line in
+  index.jsonl (files, frame, rect, area, track id, preset), for collecting
+  a training set while the robot drives
+
+Usage:
+    snapshots = SnapshotWriter('leaf_detections', fmt='jpg', jpeg_quality=90)
+    snapshots.save(frame, mask, frame_idx)                  # returns at once
+    snapshots.autosave(frame, mask, detections, frame_idx, min_area=2000)
+    snapshots.close()                                       # waits for the queued writes
+    print(snapshots.report())
+
+    python leaf_detector.py --snapshot-format png --png-compression 1
+    python leaf_detector.py --autosave-area 2000 --autosave-every 15 --snapshot-dir dataset
+"""
+
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+FORMATS = ('jpg', 'png', 'npy')
+
+
+class SnapshotWriter:
+    """Bounded queue of images to write, drained by background writer threads."""
+
+    def __init__(self, directory='leaf_detections', fmt='jpg', jpeg_quality=95, png_compression=3, workers=2,
+                 queue_size=32):
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown snapshot format: {fmt!r} (expected one of {FORMATS})')
+        self.directory = directory
+        self.fmt = fmt
+        self.mask_fmt = 'npy' if fmt == 'npy' else 'png'
+        self._params = {
+            'jpg': [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)],
+            'png': [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)],
+        }
+        os.makedirs(directory, exist_ok=True)
+        self._queue = queue.Queue(max(1, queue_size))
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._index = None
+        self.files_written = 0
+        self.snapshots_dropped = 0
+        self.failures = 0
+        self.write_ms = deque(maxlen=1000)
+        self._threads = [threading.Thread(target=self._writer, name=f'snapshot-writer-{i}', daemon=True)
+                         for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    def _path(self, kind, frame_idx, fmt, stamp=None):
+        # The counter keeps names unique even within one microsecond / one frame
+        stamp = stamp or datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        return os.path.join(self.directory, f'{kind}_{stamp}_f{frame_idx:06d}_{next(self._counter)}.{fmt}')
+
+    def _submit(self, files, records=()):
+        # One queue item per call: every put wakes a writer thread, which costs more than the copies
+        try:
+            self._queue.put_nowait((files, records))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.snapshots_dropped += 1
+            return False
+
+    def save(self, frame, mask=None, frame_idx=0):
+        """Queue the frame (and mask) for writing; returns the frame's file name, or None if the queue was full."""
+        frame_path = self._path('frame', frame_idx, self.fmt)
+        files = [(frame_path, frame.copy(), self.fmt)]
+        if mask is not None:
+            files.append((self._path('mask', frame_idx, self.mask_fmt), mask.copy(), self.mask_fmt))
+        return frame_path if self._submit(files) else None
+
+    def autosave(self, frame, mask, detections, frame_idx=0, min_area=0, pad=8):
+        """Queue a crop of every detection with area >= min_area; returns how many (0 also if the queue was full)."""
+        if detections is None or not len(detections):
+            return 0
+        h, w = frame.shape[:2]
+        rects, areas = detections.rects.tolist(), detections.areas.tolist()
+        track_ids, presets = detections.track_ids.tolist(), detections.presets.tolist()
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        files, records = [], []
+        for i, area in enumerate(areas):
+            if area < min_area:
+                continue
+            x, y, rw, rh = rects[i]
+            x0, y0 = max(0, x - pad), max(0, y - pad)
+            x1, y1 = min(w, x + rw + pad), min(h, y + rh + pad)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            leaf_path = self._path('leaf', frame_idx, self.fmt, stamp)
+            mask_path = self._path('leafmask', frame_idx, self.mask_fmt, stamp)
+            record = {
+                'frame': frame_idx, 'image': os.path.basename(leaf_path), 'mask': os.path.basename(mask_path),
+                'crop': [x0, y0, x1 - x0, y1 - y0], 'rect': [x, y, rw, rh], 'area': int(area),
+            }
+            if track_ids[i] >= 0:
+                record['id'] = track_ids[i]
+            if presets[i] >= 0:
+                record['preset'] = presets[i]
+            records.append(record)
+            files.append((leaf_path, frame[y0:y1, x0:x1].copy(), self.fmt))
+            files.append((mask_path, mask[y0:y1, x0:x1].copy(), self.mask_fmt))
+        if not records or not self._submit(files, records):
+            return 0
+        return len(records)
+
+    def _write(self, path, image, fmt):
+        root, ext = os.path.splitext(path)
+        tmp = root + '.tmp' + ext
+        if fmt == 'npy':
+            np.save(tmp, image)
+        elif not cv2.imwrite(tmp, image, self._params[fmt]):
+            raise OSError(f'cv2.imwrite failed for {path}')
+        os.replace(tmp, path)
+
+    def _writer(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            files, records = job
+            t0 = time.perf_counter()
+            written = 0
+            try:
+                for path, image, fmt in files:
+                    self._write(path, image, fmt)
+                    written += 1
+                if records:
+                    with self._lock:
+                        if self._index is None:
+                            self._index = open(os.path.join(self.directory, 'index.jsonl'), 'a')
+                        self._index.write(''.join(json.dumps(r) + '\n' for r in records))
+            except (OSError, cv2.error) as e:
+                with self._lock:
+                    self.failures += 1
+                print(f'WARNING: snapshot not written: {e}')
+            with self._lock:
+                self.files_written += written
+                self.write_ms.append((time.perf_counter() - t0) * 1000.0)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def report(self):
+        with self._lock:
+            text = (f'Snapshots: {self.files_written} files -> {self.directory}, {self.snapshots_dropped} dropped '
+                    f'(queue full), {self.failures} failed')
+            if self.write_ms:
+                p50, p95 = np.percentile(np.array(self.write_ms), [50, 95]).tolist()
+                text += f', write p50 {p50:.1f} ms, p95 {p95:.1f} ms'
+        return text
+
+    def close(self):
+        """Write everything still queued, then stop the writer threads."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
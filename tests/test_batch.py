@@ -0,0 +1,48 @@
+"""Sharded batch detection must give the same per-frame output as one worker."""
+
+import json
+
+import cv2
+import pytest
+
+from batch import make_shards, run_batch
+from benchmark import make_leaf_scene
+
+N_FRAMES = 12
+
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('batch') / 'field.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 12, (320, 240))
+    for i in range(N_FRAMES):
+        writer.write(make_leaf_scene(320, 240, n_leaves=8, seed=i))
+    writer.release()
+    return path
+
+
+def test_make_shards_cover_every_frame_once():
+    for total, workers in ((1, 4), (10, 1), (100, 3), (7, 8)):
+        shards = make_shards(total, workers)
+        assert shards[0][0] == 0 and shards[-1][1] == total
+        assert all(a < b for a, b in shards)
+        assert all(b == a2 for (_, b), (a2, _) in zip(shards, shards[1:]))
+    assert make_shards(0, 4) == [(0, None)]
+
+
+def _frames(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_sharded_output_matches_single_worker(video, tmp_path):
+    single, sharded = str(tmp_path / 'single.jsonl'), str(tmp_path / 'sharded.jsonl')
+    assert run_batch(video, single, width=None, min_area=200, workers=1)['frames'] == N_FRAMES
+    assert run_batch(video, sharded, width=None, min_area=200, workers=3, track=True)['frames'] == N_FRAMES
+    single, sharded = _frames(single), _frames(sharded)
+    assert [f['frame'] for f in sharded] == list(range(N_FRAMES))
+    assert sum(len(f['detections']) for f in single) > 0
+    for a, b in zip(single, sharded):
+        assert a['ts'] == b['ts']
+        assert [d['rect'] for d in a['detections']] == [d['rect'] for d in b['detections']]
+        assert all('id' in d for d in b['detections'])
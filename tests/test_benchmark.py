@@ -0,0 +1,37 @@
+"""Benchmark helpers: deterministic scenes, summaries and --json / compare round trip."""
+
+import argparse
+import json
+
+import numpy as np
+
+from benchmark import bench_pipeline, compare, make_leaf_scene, summarize, time_call, write_json
+
+
+def test_leaf_scene_is_deterministic():
+    a = make_leaf_scene(160, 120, n_leaves=10, seed=4)
+    assert a.shape == (120, 160, 3) and a.dtype == np.uint8
+    np.testing.assert_array_equal(a, make_leaf_scene(160, 120, n_leaves=10, seed=4))
+    assert not np.array_equal(a, make_leaf_scene(160, 120, n_leaves=10, seed=5))
+
+
+def test_summarize():
+    stats = summarize([1.0, 2.0, 3.0, 4.0])
+    assert stats['mean_ms'] == 2.5 and stats['p50_ms'] == 2.5
+    assert stats['fps'] == 400.0
+    assert len(time_call(lambda: None, repeat=7, warmup=0)) == 7
+
+
+def test_pipeline_rows_round_trip_through_json(tmp_path, capsys):
+    rows = bench_pipeline([(160, 120)], [5], [4.0], n_frames=2, repeat=3)
+    assert len(rows) == 1 and rows[0]['total_p50_ms'] > 0
+    args = argparse.Namespace(bench='pipeline', json=None, repeat=3)
+    old, new = str(tmp_path / 'old.json'), str(tmp_path / 'new.json')
+    write_json(old, 'pipeline', args, rows)
+    write_json(new, 'pipeline', args, rows)
+    with open(old) as f:
+        data = json.load(f)
+    assert data['bench'] == 'pipeline' and data['params'] == {'repeat': 3} and 'cpus' in data['env']
+    capsys.readouterr()
+    compare(old, new)
+    assert 'total_p50_ms' in capsys.readouterr().out
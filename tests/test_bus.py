@@ -0,0 +1,116 @@
+"""Bus topics and the camera node's frame ring lifetime."""
+
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from bus import Bus, FrameHandle, ImageRaw, camera_node, close_frames, frame_valid, open_frame, run_graph
+
+N_FRAMES = 12
+SLOTS = 4
+
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('bus') / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 12, (64, 48))
+    for i in range(N_FRAMES):
+        writer.write(np.full((48, 64, 3), 20 * i, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def _queued(sub):
+    msgs = []
+    while True:
+        msg = sub.get(timeout=0.05)
+        if msg is None:
+            return msgs
+        msgs.append(msg)
+
+
+def test_topics_are_typed_and_keep_last():
+    bus = Bus(depth=2)
+    sub = bus.subscribe('image_raw')
+    pub = bus.publisher('image_raw')
+    with pytest.raises(TypeError):
+        pub.publish('not an ImageRaw')
+    for seq in range(5):
+        pub.publish(ImageRaw(seq, 0.0, FrameHandle('ring', seq)))
+    assert [m.seq for m in _queued(sub)] == [3, 4] and pub.dropped == 3
+    with pytest.raises(ValueError):
+        bus.subscribe('no_such_topic')
+
+
+def test_camera_ring_outlives_end_of_stream_until_stop(video):
+    bus = Bus(depth=64)
+    sub = bus.subscribe('image_raw')
+    stop, done = threading.Event(), threading.Event()
+    node = threading.Thread(target=camera_node, daemon=True,
+                            kwargs={'stop': stop, 'image_raw': bus.publisher('image_raw'), 'source': video,
+                                    'slots': SLOTS, 'done': done})
+    node.start()
+    assert done.wait(5)
+    msgs = _queued(sub)
+    assert len(msgs) == N_FRAMES
+    # A node attaching only now still reads the last frames of the file
+    rings = {}
+    try:
+        last = msgs[-SLOTS:]
+        views = [open_frame(m.frame, rings) for m in last]
+        assert all(v is not None for v in views)
+        assert all(frame_valid(m.frame, rings) for m in last)
+        assert not frame_valid(msgs[0].frame, rings)
+        del views
+    finally:
+        close_frames(rings)
+    stop.set()
+    node.join(5)
+    assert not node.is_alive()
+    assert open_frame(msgs[-1].frame, {}) is None
+
+
+def test_ring_attachments_are_per_node(video):
+    bus = Bus(depth=64)
+    sub = bus.subscribe('image_raw')
+    stop, done = threading.Event(), threading.Event()
+    node = threading.Thread(target=camera_node, daemon=True,
+                            kwargs={'stop': stop, 'image_raw': bus.publisher('image_raw'), 'source': video,
+                                    'slots': SLOTS, 'done': done})
+    node.start()
+    try:
+        assert done.wait(5)
+        handle = _queued(sub)[-1].frame
+        a, b = {}, {}
+        assert open_frame(handle, a) is not None and open_frame(handle, b) is not None
+        close_frames(a)
+        # Another node's attachment is not affected
+        assert not a and frame_valid(handle, b)
+        close_frames(b)
+    finally:
+        stop.set()
+        node.join(5)
+
+
+def test_run_graph_drains_after_the_source(video):
+    bus = Bus(depth=64)
+    sub = bus.subscribe('image_raw')
+    results = bus.queue()
+
+    def reader(stop, image_raw, results):
+        rings, read = {}, 0
+        try:
+            while not stop.is_set():
+                msg = image_raw.get(timeout=0.05)
+                if msg is not None and open_frame(msg.frame, rings) is not None:
+                    read += 1
+        finally:
+            close_frames(rings)
+            results.put(read)
+
+    run_graph(bus, [('camera', camera_node, {'image_raw': bus.publisher('image_raw'), 'source': video,
+                                             'slots': N_FRAMES}),
+                    ('reader', reader, {'image_raw': sub, 'results': results})], drain=0.3)
+    assert results.get(timeout=1) == N_FRAMES
@@ -0,0 +1,87 @@
+"""ThreadedCapture policies and seeking, on a short generated video file."""
+
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from capture import ThreadedCapture
+
+N_FRAMES = 10
+
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('capture') / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+    for i in range(N_FRAMES):
+        writer.write(np.full((48, 64, 3), 20 * i, dtype=np.uint8))
+    writer.release()
+    # Decoded reference frames (MJPG is lossy, so compare against what the decoder returns)
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    assert len(frames) == N_FRAMES
+    return path, frames
+
+
+def _read_all(cap):
+    out = []
+    while True:
+        ret, frame = cap.read(timeout=2)
+        if not ret:
+            return out
+        out.append(frame)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        ThreadedCapture(0, policy='newest')
+
+
+def test_block_delivers_every_frame_in_order(video):
+    path, frames = video
+    with ThreadedCapture(path, policy='block', buffer_size=2) as cap:
+        got = _read_all(cap)
+        stats = cap.stats()
+    assert len(got) == N_FRAMES
+    assert all(np.array_equal(a, b) for a, b in zip(got, frames))
+    assert stats['dropped'] == 0 and stats['delivered'] == N_FRAMES
+
+
+def test_latest_skips_to_newest_frame(video):
+    path, frames = video
+    with ThreadedCapture(path, policy='latest', buffer_size=4) as cap:
+        deadline = time.time() + 2
+        while cap.stats()['decoded'] < N_FRAMES and time.time() < deadline:
+            time.sleep(0.01)
+        ret, frame = cap.read(timeout=2)
+        assert ret and np.array_equal(frame, frames[-1])
+        assert cap.stats()['dropped'] == N_FRAMES - 1
+        assert cap.read(timeout=2) == (False, None)
+
+
+def test_seek_drops_prefetched_frames(video):
+    path, frames = video
+    with ThreadedCapture(path, policy='block', buffer_size=4) as cap:
+        cap.read(timeout=2)
+        assert cap.set(cv2.CAP_PROP_POS_FRAMES, 6)
+        got = _read_all(cap)
+    assert len(got) == N_FRAMES - 6
+    assert all(np.array_equal(a, b) for a, b in zip(got, frames[6:]))
+
+
+def test_seek_after_eof_resumes(video):
+    path, frames = video
+    with ThreadedCapture(path, policy='block') as cap:
+        assert len(_read_all(cap)) == N_FRAMES
+        assert cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        ret, frame = cap.read(timeout=1)
+        assert ret and np.array_equal(frame, frames[0])
+        assert len(_read_all(cap)) == N_FRAMES - 1
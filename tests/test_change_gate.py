@@ -0,0 +1,64 @@
+"""ChangeGate: reuse on static frames, partial recompute equal to a full one."""
+
+import cv2
+import numpy as np
+
+from benchmark import make_leaf_scene
+from change_gate import ChangeGate
+from main import find_leaves, morph_reach, segment_leaves
+
+LOWER, UPPER = (25, 40, 40), (95, 255, 255)
+
+
+def _segment(img, buffers):
+    return segment_leaves(img, LOWER, UPPER, buffers=buffers)
+
+
+def _extract(mask):
+    return find_leaves(mask, 200)
+
+
+def _gate(**kwargs):
+    return ChangeGate(threshold=12, tile=64, pad=morph_reach(), **kwargs)
+
+
+def test_static_frame_is_reused():
+    frame = make_leaf_scene(640, 480, n_leaves=15, seed=1)
+    gate = _gate()
+    mask, dets = gate.process(frame, _segment, _extract)
+    assert gate.last == 'full'
+    again, dets_again = gate.process(frame.copy(), _segment, _extract)
+    assert gate.last == 'hit' and dets_again is dets
+    np.testing.assert_array_equal(again, mask)
+    assert gate.stats()['hits'] == 1 and gate.stats()['full'] == 1
+
+
+def test_local_change_recomputes_only_its_tiles():
+    frame = make_leaf_scene(640, 480, n_leaves=15, seed=1)
+    gate = _gate()
+    gate.process(frame, _segment, _extract)
+    moved = frame.copy()
+    cv2.ellipse(moved, (560, 400), (30, 18), 20, 0, 360, (40, 160, 60), -1)
+    mask, dets = gate.process(moved, _segment, _extract)
+    assert gate.last == 'partial' and gate.last_rects
+    # Tiles grown by the morphology reach: identical to processing the whole frame
+    expected = _segment(moved, None)
+    np.testing.assert_array_equal(mask, expected)
+    np.testing.assert_array_equal(dets.rects, _extract(expected).rects)
+    assert gate.stats()['recomputed_fraction'] < 1.0
+
+
+def test_large_change_invalidate_and_refresh_run_in_full():
+    gate = _gate(refresh_every=3)
+    gate.process(make_leaf_scene(320, 240, seed=1), _segment, _extract)
+    gate.process(make_leaf_scene(320, 240, seed=2), _segment, _extract)
+    assert gate.last == 'full'
+    frame = make_leaf_scene(320, 240, seed=2)
+    gate.invalidate()
+    gate.process(frame, _segment, _extract)
+    assert gate.last == 'full'
+    modes = []
+    for _ in range(4):
+        gate.process(frame, _segment, _extract)
+        modes.append(gate.last)
+    assert modes == ['hit', 'hit', 'full', 'hit']
@@ -0,0 +1,81 @@
+"""JSONL / binary detection sinks read back through json and BinaryDetectionLog."""
+
+import json
+
+import numpy as np
+import pytest
+
+from detection_log import BinaryDetectionLog, BinarySink, JsonlSink, open_sink
+from detections import Detections
+
+
+def _square(x, y, size):
+    return np.array([[[x, y]], [[x + size, y]], [[x + size, y + size]], [[x, y + size]]], dtype=np.int32)
+
+
+def _detections(frame_idx):
+    dets = Detections.from_contours([_square(10 * frame_idx, 5, 20), _square(100, 50 + frame_idx, 30)])
+    dets.records['track_id'] = [frame_idx, -1]
+    dets.records['preset'] = [-1, 2]
+    return dets
+
+
+FRAMES = {0: _detections(0), 1: Detections(), 3: _detections(3), 4: _detections(4)}
+
+
+def test_open_sink_picks_format(tmp_path):
+    for name, cls in (('run.ldet', BinarySink), ('run.BIN', BinarySink), ('run.jsonl', JsonlSink)):
+        sink = open_sink(str(tmp_path / name))
+        sink.close()
+        assert type(sink) is cls
+
+
+def test_binary_round_trip(tmp_path):
+    path = str(tmp_path / 'run.ldet')
+    with BinarySink(path) as sink:
+        for frame_idx, dets in FRAMES.items():
+            sink.write(frame_idx, dets, timestamp=100.0 + frame_idx)
+    assert sink.frames_written == len(FRAMES)
+
+    log = BinaryDetectionLog(path)
+    assert len(log) == sum(len(d) for d in FRAMES.values())
+    for frame_idx, dets in FRAMES.items():
+        recs = log.frame(frame_idx)
+        assert len(recs) == len(dets)
+        if not len(dets):
+            continue
+        assert (recs['timestamp'] == 100.0 + frame_idx).all()
+        np.testing.assert_array_equal(np.stack([recs['x'], recs['y'], recs['w'], recs['h']], axis=1), dets.rects)
+        np.testing.assert_allclose(np.stack([recs['cx'], recs['cy']], axis=1), dets.centroids)
+        np.testing.assert_array_equal(recs['area'], dets.areas)
+        np.testing.assert_array_equal(recs['track_id'], dets.track_ids)
+        np.testing.assert_array_equal(recs['preset'], dets.presets)
+        assert np.isnan(recs['wx']).all()
+    assert len(log.frame(2)) == 0
+    assert len(log.frame_range(1, 4)) == len(FRAMES[3])
+
+
+def test_binary_empty_and_foreign_files(tmp_path):
+    path = str(tmp_path / 'empty.ldet')
+    BinarySink(path).close()
+    assert len(BinaryDetectionLog(path)) == 0
+    other = tmp_path / 'other.ldet'
+    other.write_bytes(b'not a log at all')
+    with pytest.raises(ValueError):
+        BinaryDetectionLog(str(other))
+
+
+def test_jsonl_round_trip(tmp_path):
+    path = str(tmp_path / 'run.jsonl')
+    with JsonlSink(path, contour_epsilon=1.0) as sink:
+        for frame_idx, dets in FRAMES.items():
+            sink.write(frame_idx, dets, timestamp=100.0 + frame_idx)
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['frame'] for line in lines] == list(FRAMES)
+    for line, dets in zip(lines, FRAMES.values()):
+        assert [d['rect'] for d in line['detections']] == dets.rects.tolist()
+        assert [d['area'] for d in line['detections']] == dets.areas.tolist()
+        assert [d.get('id', -1) for d in line['detections']] == dets.track_ids.tolist()
+        assert [d.get('preset', -1) for d in line['detections']] == dets.presets.tolist()
+        assert all('world' not in d and len(d['contour']) == 4 for d in line['detections'])
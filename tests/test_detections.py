@@ -0,0 +1,52 @@
+"""Detections geometry against cv2.contourArea / boundingRect / moments."""
+
+import cv2
+import numpy as np
+
+from benchmark import make_leaf_scene
+from detections import Detections, records_equal
+from segmentation import inrange_mask
+
+
+def _contours():
+    frame = make_leaf_scene(480, 360, n_leaves=30, seed=2)
+    mask = inrange_mask(frame, [((25, 40, 40), (95, 255, 255))])
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # A single pixel and a line have zero area: centroids fall back to the rect centre
+    return list(contours) + [np.array([[[5, 5]]], np.int32), np.array([[[1, 2]], [[9, 2]]], np.int32)]
+
+
+def test_geometry_matches_opencv():
+    contours = _contours()
+    dets = Detections.from_contours(contours)
+    assert len(dets) == len(contours)
+    for i, cnt in enumerate(contours):
+        assert dets.areas[i] == cv2.contourArea(cnt)
+        assert tuple(dets.rects[i]) == cv2.boundingRect(cnt)
+        m = cv2.moments(cnt)
+        if m['m00']:
+            np.testing.assert_allclose(dets.centroids[i], (m['m10'] / m['m00'], m['m01'] / m['m00']), atol=1e-6)
+        else:
+            x, y, w, h = cv2.boundingRect(cnt)
+            np.testing.assert_allclose(dets.centroids[i], (x + (w - 1) / 2.0, y + (h - 1) / 2.0))
+        np.testing.assert_array_equal(dets.contour(i), cnt)
+
+
+def test_min_area_and_filter():
+    contours = _contours()
+    areas = np.array([cv2.contourArea(c) for c in contours])
+    threshold = float(np.median(areas))
+    assert len(Detections.from_contours(contours, min_area=threshold)) == (areas >= threshold).sum()
+    dets = Detections.from_contours(contours)
+    assert len(dets.filter(dets.areas > threshold)) == (areas > threshold).sum()
+
+
+def test_records_equal_treats_missing_world_as_equal():
+    dets = Detections.from_contours(_contours())
+    other = Detections.from_contours(_contours())
+    # NaN world fields: plain array_equal can never match uncalibrated records
+    assert not np.array_equal(dets.records, other.records)
+    assert records_equal(dets.records, other.records)
+    other.records['area'][0] += 1
+    assert not records_equal(dets.records, other.records)
+    assert not records_equal(dets.records, dets.records[1:])
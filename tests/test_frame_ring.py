@@ -0,0 +1,87 @@
+"""FrameRing / RingReader: ordered and latest-only reading, skip accounting, end of stream."""
+
+import numpy as np
+import pytest
+
+from frame_ring import FrameRing, RingCapture, RingReader
+
+SHAPE = (6, 8, 3)
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing.create(None, SHAPE, slots=4)
+    yield ring
+    ring.close()
+
+
+def _write(ring, values):
+    for v in values:
+        ring.write(np.full(SHAPE, v, dtype=np.uint8), timestamp=float(v))
+
+
+def _read_values(reader, n):
+    out = []
+    for _ in range(n):
+        seq, ts, view = reader.read(timeout=0.1)
+        assert view[0, 0, 0] == seq and ts == float(seq)
+        out.append(seq)
+    return out
+
+
+def test_next_reads_in_order_and_counts_skips(ring):
+    reader = RingReader(FrameRing.attach(ring.name), policy='next')
+    try:
+        # A reader joining a running ring starts at its newest frame, then takes every frame in turn
+        _write(ring, range(2))
+        assert _read_values(reader, 1) == [1]
+        _write(ring, range(2, 4))
+        assert _read_values(reader, 2) == [2, 3]
+        assert reader.read(timeout=0.01) is None
+        # The reader fell behind by more than the ring holds: it resumes at the oldest safe slot
+        _write(ring, range(4, 14))
+        assert _read_values(reader, 3) == [11, 12, 13]
+        assert reader.stats() == {'read': 6, 'skipped': 7, 'torn': 0}
+    finally:
+        reader.ring.close()
+
+
+def test_latest_skips_to_newest(ring):
+    reader = RingReader(FrameRing.attach(ring.name), policy='latest')
+    try:
+        _write(ring, range(5))
+        assert _read_values(reader, 1) == [4]
+        _write(ring, range(5, 8))
+        assert _read_values(reader, 1) == [7]
+        assert reader.stats() == {'read': 2, 'skipped': 2, 'torn': 0}
+    finally:
+        reader.ring.close()
+
+
+def test_overwritten_frames_are_invalid(ring):
+    _write(ring, range(6))
+    assert ring.view(1) is None and not ring.valid(1)
+    assert ring.valid(2) and ring.view(5)[0, 0, 0] == 5
+    with pytest.raises(ValueError):
+        ring.write(np.zeros((2, 2, 3), dtype=np.uint8))
+
+
+def test_end_of_stream_and_name_reuse():
+    ring = FrameRing.create(None, SHAPE, slots=4)
+    name = ring.name
+    with pytest.raises(FileExistsError):
+        FrameRing.create(name, SHAPE)
+    cap = RingCapture(name, policy='next', copy=True)
+    _write(ring, [9])
+    ret, frame = cap.read(timeout=0.1)
+    assert ret and frame[0, 0, 0] == 9 and cap.last_seq == 0
+    ring.close()
+    assert cap.read(timeout=0.1) == (False, None)
+    cap.reader.ring.close()
+    with pytest.raises(FileNotFoundError):
+        FrameRing.attach(name)
+
+
+def test_unknown_policy(ring):
+    with pytest.raises(ValueError):
+        RingReader(ring, policy='oldest')
@@ -0,0 +1,82 @@
+"""ReorderQueue ordering and StagePipeline frame order with multi-worker stages."""
+
+import random
+import threading
+import time
+
+import pytest
+
+from pipeline import ReorderQueue, Stage, StagePipeline, _STOP
+
+
+def test_reorder_queue_hands_out_in_sequence():
+    q = ReorderQueue(maxsize=8)
+    for seq in (3, 1, 0, 2):
+        q.put(seq, f'item{seq}')
+    assert [q.get() for _ in range(4)] == [(i, f'item{i}') for i in range(4)]
+
+
+def test_full_queue_still_accepts_the_next_item():
+    q = ReorderQueue(maxsize=2)
+    q.put(1, 'b')
+    q.put(2, 'c')
+    # A later frame blocks while the queue is full ...
+    blocked = threading.Thread(target=q.put, args=(3, 'd'), daemon=True)
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+    # ... but the one every consumer waits for never does
+    q.put(0, 'a')
+    assert [q.get()[1] for _ in range(3)] == ['a', 'b', 'c']
+    blocked.join(1.0)
+    assert not blocked.is_alive() and q.get() == (3, 'd')
+
+
+def test_stop_stays_queued_for_every_worker():
+    q = ReorderQueue()
+    q.put(0, _STOP)
+    assert q.get() == (0, _STOP) and q.get() == (0, _STOP)
+
+
+def test_close_releases_waiting_consumers():
+    q = ReorderQueue()
+    result = []
+    t = threading.Thread(target=lambda: result.append(q.get()), daemon=True)
+    t.start()
+    q.close()
+    t.join(1.0)
+    assert result and result[0][1] is _STOP
+
+
+def test_pipeline_keeps_source_order():
+    source = iter(range(50))
+
+    def slow_square(x):
+        time.sleep(random.random() * 0.002)
+        return x * x
+
+    pipe = StagePipeline(lambda: next(source, None), [
+        Stage('square', slow_square, workers=4),
+        Stage('negate', lambda x: -x, workers=2),
+    ], queue_size=3)
+    try:
+        assert list(pipe.results()) == [-x * x for x in range(50)]
+    finally:
+        pipe.close()
+    assert pipe.stats()['processed'] == {'square': 50, 'negate': 50}
+
+
+def test_pipeline_reraises_stage_errors():
+    source = iter(range(5))
+
+    def fail_on_three(x):
+        if x == 3:
+            raise RuntimeError('bad frame')
+        return x
+
+    pipe = StagePipeline(lambda: next(source, None), [Stage('check', fail_on_three, workers=2)])
+    try:
+        with pytest.raises(RuntimeError, match='bad frame'):
+            list(pipe.results())
+    finally:
+        pipe.close()
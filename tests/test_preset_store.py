@@ -0,0 +1,54 @@
+"""PresetStore: save / latest / find / count and the JSON migration."""
+
+import json
+
+import numpy as np
+
+from preset_store import HSV_KEYS, PresetStore, preset_bounds
+
+
+def _values(h_low, h_high=95):
+    return dict(zip(HSV_KEYS, (h_low, h_high, 40, 255, 40, 255)))
+
+
+def test_save_latest_find_count(tmp_path):
+    with PresetStore(str(tmp_path / 'presets.db')) as store:
+        a = store.save(_values(25), name='green', camera='rig-1', created=1.0)
+        b = store.save(_values(15, 35), name='yellow', camera='rig-1', created=2.0)
+        c = store.save(_values(30), name='green', camera='rig-2', created=3.0)
+        assert store.latest()['id'] == c
+        assert store.latest(name='green', camera='rig-1')['id'] == a
+        assert store.latest(name='brown') is None
+        assert [p['id'] for p in store.find(name='green')] == [c, a]
+        assert [p['id'] for p in store.find(since=2.0)] == [c, b]
+        assert [p['id'] for p in store.find(limit=1)] == [c]
+        assert store.count() == 3 and store.count(name='green') == 2 and store.count(camera='rig-1') == 2
+        assert store.names() == ['green', 'yellow']
+        preset = store.get(b)
+        assert {k: preset[k] for k in HSV_KEYS} == _values(15, 35)
+        assert (preset['name'], preset['camera'], preset['created']) == ('yellow', 'rig-1', 2.0)
+        assert store.get(999) is None
+
+
+def test_presets_survive_reopen(tmp_path):
+    path = str(tmp_path / 'presets.db')
+    with PresetStore(path) as store:
+        store.save(_values(25), name='green')
+    with PresetStore(path) as store:
+        assert store.count() == 1 and store.latest()['name'] == 'green'
+
+
+def test_import_json(tmp_path):
+    legacy = tmp_path / 'presets.json'
+    legacy.write_text(json.dumps({'presets': [_values(20), _values(22), _values(24)]}))
+    with PresetStore(str(tmp_path / 'presets.db')) as store:
+        store.save(_values(30), name='old')
+        assert store.import_json(str(legacy), name='imported') == 3
+        assert store.count(name='imported') == 3
+        # File order is kept: the last entry of the file is the newest
+        assert store.latest(name='imported')['H_low'] == 24
+
+
+def test_preset_bounds():
+    lower, upper = preset_bounds(_values(25))
+    assert lower.dtype == np.uint8 and lower.tolist() == [25, 40, 40] and upper.tolist() == [95, 255, 255]
@@ -0,0 +1,87 @@
+"""Detecting with a preset set: which presets, their labels and the per-leaf preset index."""
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import SAMPLE_RANGES, make_leaf_scene
+from main import detect_leaves
+from preset_store import HSV_KEYS, PresetStore, load_preset_set, preset_labels
+from segmentation import MAX_LABELS, LUTSegmenter, label_image
+
+
+def _values(lo, hi):
+    return dict(zip(HSV_KEYS, (lo[0], hi[0], lo[1], hi[1], lo[2], hi[2])))
+
+
+GREEN = ((35, 60, 60), (85, 255, 255))
+YELLOW = ((15, 80, 80), (34, 255, 255))
+BROWN = ((5, 40, 20), (14, 200, 160))
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'presets.db')
+    with PresetStore(path) as store:
+        store.save(_values(*GREEN), name='default')
+        store.save(_values(*YELLOW), name='default')
+        store.save(_values(*GREEN), name='default')
+        store.save(_values(*BROWN), name='brown', camera='rig-1')
+    return path
+
+
+def test_every_distinct_range_without_names(db):
+    labels, ranges = load_preset_set(db)
+    assert labels == ['brown', 'default#3', 'default#2']
+    assert [(tuple(lo), tuple(hi)) for lo, hi in ranges] == [BROWN, GREEN, YELLOW]
+
+
+def test_latest_of_each_name(db):
+    labels, ranges = load_preset_set(db, ['default', 'brown', 'missing'])
+    assert labels == ['default', 'brown']
+    assert [(tuple(lo), tuple(hi)) for lo, hi in ranges] == [GREEN, BROWN]
+
+
+def test_camera_presets_preferred(db):
+    assert load_preset_set(db, camera='rig-1')[0] == ['brown']
+    # No presets for that camera: every camera's ranges
+    assert len(load_preset_set(db, camera='rig-9')[1]) == 3
+
+
+def test_preset_set_is_capped_at_max_labels(tmp_path, capsys):
+    path = str(tmp_path / 'many.db')
+    with PresetStore(path) as store:
+        for h in range(MAX_LABELS + 4):
+            store.save(_values((h, 40, 40), (h + 10, 255, 255)))
+    labels, ranges = load_preset_set(path)
+    assert len(ranges) == MAX_LABELS and 'WARNING' in capsys.readouterr().out
+    assert ranges[0][0][0] == MAX_LABELS + 3
+
+
+def test_preset_labels():
+    presets = [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': 'a'}]
+    assert preset_labels(presets) == ['a#1', 'b', 'a#3']
+
+
+def test_lut_labels_match_label_image():
+    ranges = SAMPLE_RANGES
+    frame = make_leaf_scene(320, 240, n_leaves=20, seed=3)
+    labels = label_image(frame, ranges, segmenter=LUTSegmenter(bits=8))
+    np.testing.assert_array_equal(labels, label_image(frame, ranges))
+    assert labels.dtype == np.uint8
+    with pytest.raises(ValueError):
+        label_image(frame, ranges * 3)
+
+
+@pytest.mark.parametrize('lut', [False, True])
+def test_leaves_are_tagged_with_their_preset(lut):
+    frame = np.full((200, 300, 3), (40, 60, 90), dtype=np.uint8)
+    hsv_colors = {0: (60, 200, 160), 1: (25, 200, 200)}
+    for preset, cx in ((0, 70), (1, 220)):
+        color = cv2.cvtColor(np.uint8([[hsv_colors[preset]]]), cv2.COLOR_HSV2BGR)[0, 0].tolist()
+        cv2.circle(frame, (cx, 100), 40, color, -1)
+    ranges = [GREEN, YELLOW]
+    _, dets = detect_leaves(frame, *GREEN, min_area=500, ranges=ranges,
+                            segmenter=LUTSegmenter(bits=8) if lut else None)
+    order = np.argsort(dets.centroids[:, 0])
+    assert dets.presets[order].tolist() == [0, 1]
@@ -0,0 +1,127 @@
+"""Robot packets: encode / decode round trip, resync on garbage, deadband and stale handling."""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from detections import Detections
+from robot_link import FLAG_WORLD, TARGET_DTYPE, PacketDecoder, RobotLink, build_packet, encode_targets
+
+
+def _detections(sizes, x0=0):
+    contours = [np.array([[[x, 10]], [[x + s, 10]], [[x + s, 10 + s]], [[x, 10 + s]]], dtype=np.int32)
+                for x, s in zip(range(x0, x0 + 100 * len(sizes), 100), sizes)]
+    dets = Detections.from_contours(contours)
+    dets.records['track_id'] = np.arange(len(sizes))
+    return dets
+
+
+def _packet(seq, frame_idx, dets, **kwargs):
+    payload, n = encode_targets(dets, **kwargs)
+    return build_packet(seq, frame_idx, 12.7, n, payload), n
+
+
+def test_round_trip_and_split_reads():
+    data = b''.join(_packet(seq, 100 + seq, _detections([20, 40, 30]))[0] for seq in range(3))
+    decoder = PacketDecoder()
+    packets = []
+    for i in range(len(data)):
+        packets += decoder.feed(data[i:i + 1])
+    assert [p['seq'] for p in packets] == [0, 1, 2] and [p['frame'] for p in packets] == [100, 101, 102]
+    assert decoder.bad == 0
+    targets = packets[0]['targets']
+    # Largest leaves first
+    assert targets['track_id'].tolist() == [1, 2, 0] and targets['area'].tolist() == [1600, 900, 400]
+    assert targets['x'].tolist() == [120, 215, 10] and packets[0]['age_ms'] == 12
+
+
+def test_resync_after_garbage_and_corruption():
+    good, _ = _packet(7, 1, _detections([20]))
+    corrupt = bytearray(good)
+    corrupt[-6] ^= 0xFF
+    decoder = PacketDecoder()
+    packets = decoder.feed(b'\x00LRxx' + bytes(corrupt) + b'noise L' + good)
+    assert [p['seq'] for p in packets] == [7] and decoder.bad >= 1
+    # A trailing 'L' may start the next magic
+    assert decoder.feed(good[:1]) == [] and len(decoder.feed(good[1:])) == 1
+
+
+def test_max_targets_and_empty():
+    payload, n = encode_targets(_detections([10, 20, 30, 40]), max_targets=2)
+    assert n == 2 and len(payload) == 2 * TARGET_DTYPE.itemsize
+    assert encode_targets(Detections()) == (b'', 0)
+
+
+@pytest.mark.parametrize('units, scale', [('mm', 1.0), ('cm', 10.0), ('m', 1000.0), ('in', 25.4)])
+def test_world_targets_in_millimetres(units, scale):
+    dets = _detections([20])
+    dets.records['world'] = [[1.5, 2.0]]
+    dets.records['world_area'] = [0.5]
+    targets = np.frombuffer(encode_targets(dets, world=True, units=units)[0], dtype=TARGET_DTYPE)
+    assert targets['x'][0] == round(1.5 * scale) and targets['y'][0] == round(2.0 * scale)
+    assert targets['area'][0] == round(0.5 * (scale / 10.0) ** 2)
+
+
+def test_unknown_world_units_rejected():
+    with pytest.raises(ValueError):
+        RobotLink(_MemoryPort(), world=True, units='ft')
+
+
+class _MemoryPort:
+    def __init__(self):
+        self.data = bytearray()
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        with self.lock:
+            self.data += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def packets(self):
+        with self.lock:
+            return PacketDecoder().feed(bytes(self.data))
+
+
+def _wait_sent(link, n):
+    deadline = time.time() + 2
+    while link.sent + link.stale < n and time.time() < deadline:
+        time.sleep(0.005)
+
+
+def test_deadband_keepalive_and_world_flag():
+    port = _MemoryPort()
+    link = RobotLink(port, deadband=2.0, keepalive=10.0, world=True, units='cm', max_age=0)
+    dets = _detections([20, 30])
+    dets.records['world'] = dets.centroids / 10.0
+    assert link.publish(0, dets)
+    _wait_sent(link, 1)
+    # Same IDs moved by at most the deadband: not sent again
+    assert not link.publish(1, dets)
+    moved = _detections([20, 30], x0=5)
+    moved.records['world'] = moved.centroids / 10.0
+    assert link.publish(2, moved)
+    link.close()
+    packets = port.packets()
+    assert [p['frame'] for p in packets] == [0, 2] and all(p['flags'] & FLAG_WORLD for p in packets)
+    assert link.stats()['unchanged'] == 1
+
+
+def test_stale_packet_is_resent_with_the_next_frame():
+    port = _MemoryPort()
+    link = RobotLink(port, max_age=0.05, keepalive=10.0)
+    dets = _detections([20])
+    assert link.publish(0, dets, capture_ts=time.perf_counter() - 1.0)
+    _wait_sent(link, 1)
+    assert link.stale == 1
+    # Nothing reached the robot, so identical targets are not "unchanged"
+    assert link.publish(1, dets)
+    link.close()
+    assert [p['frame'] for p in port.packets()] == [1]
@@ -0,0 +1,70 @@
+"""LUTSegmenter and wrapped-hue ranges against the cvtColor + inRange reference."""
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import SAMPLE_RANGES, make_leaf_scene
+from segmentation import LUTSegmenter, hue_wraps, inrange_mask, mean_hsv, range_mask
+
+WRAPPED = ((170, 60, 30), (8, 255, 200))
+
+
+def _frames():
+    rng = np.random.default_rng(1)
+    noise = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    return [make_leaf_scene(320, 240, n_leaves=20, seed=3), noise]
+
+
+@pytest.mark.parametrize('n_ranges', [1, 3, len(SAMPLE_RANGES)])
+def test_lut_exact_matches_inrange(n_ranges):
+    ranges = SAMPLE_RANGES[:n_ranges]
+    seg = LUTSegmenter(bits=8)
+    seg.update(ranges)
+    for frame in _frames():
+        np.testing.assert_array_equal(seg.mask(frame), inrange_mask(frame, ranges))
+
+
+def test_lut_quantized_agrees_with_inrange():
+    ranges = SAMPLE_RANGES[:1]
+    seg = LUTSegmenter(bits=5)
+    seg.update(ranges)
+    frame = make_leaf_scene(320, 240, n_leaves=20, seed=3)
+    # Only colours close to a range boundary can land in the other bucket
+    assert (seg.mask(frame) == inrange_mask(frame, ranges)).mean() > 0.99
+
+
+def test_lut_rebuilds_only_on_change():
+    seg = LUTSegmenter(bits=4)
+    assert seg.update(SAMPLE_RANGES[:2])
+    assert not seg.update([tuple(map(list, r)) for r in SAMPLE_RANGES[:2]])
+    assert seg.update(SAMPLE_RANGES[:1])
+    assert seg.builds == 2
+    with pytest.raises(ValueError):
+        LUTSegmenter(bits=9)
+    with pytest.raises(RuntimeError):
+        LUTSegmenter().mask(_frames()[1])
+
+
+def test_wrapped_range_mask_is_or_of_both_ends():
+    lo, hi = WRAPPED
+    assert hue_wraps(lo, hi) and not hue_wraps(*SAMPLE_RANGES[0])
+    for frame in _frames():
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        expected = cv2.bitwise_or(cv2.inRange(hsv, (lo[0], lo[1], lo[2]), (179, hi[1], hi[2])),
+                                  cv2.inRange(hsv, (0, lo[1], lo[2]), (hi[0], hi[1], hi[2])))
+        np.testing.assert_array_equal(range_mask(hsv, lo, hi), expected)
+        assert expected.any()
+
+
+def test_lut_wrapped_range_matches_inrange():
+    ranges = [WRAPPED, SAMPLE_RANGES[0]]
+    seg = LUTSegmenter(bits=8)
+    seg.update(ranges)
+    for frame in _frames():
+        np.testing.assert_array_equal(seg.mask(frame), inrange_mask(frame, ranges))
+
+
+def test_mean_hsv_wraps_hue():
+    assert mean_hsv([[178, 100, 50], [2, 200, 150]]) == (0, 150, 100)
+    assert mean_hsv([[60, 10, 10], [70, 10, 10]]) == (65, 10, 10)
@@ -0,0 +1,86 @@
+"""SnapshotWriter: unique names, complete files, drop-on-full and the autosave index."""
+
+import json
+import os
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from detections import Detections
+from snapshot import SnapshotWriter
+
+
+def _frame():
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    frame[40:80, 50:110] = (40, 160, 60)
+    return frame
+
+
+def test_unique_names_and_complete_files(tmp_path):
+    frame, mask = _frame(), np.zeros((120, 160), dtype=np.uint8)
+    with SnapshotWriter(str(tmp_path), fmt='png', workers=3) as writer:
+        paths = [writer.save(frame, mask, frame_idx=7) for _ in range(20)]
+    assert len(set(paths)) == 20
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 40 and not [f for f in files if '.tmp' in f]
+    np.testing.assert_array_equal(cv2.imread(paths[0]), frame)
+    assert writer.files_written == 40 and writer.snapshots_dropped == 0
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path, monkeypatch):
+    release = threading.Event()
+    writer = SnapshotWriter(str(tmp_path), workers=1, queue_size=1)
+    original = writer._write
+
+    def slow_write(path, image, fmt):
+        release.wait(5)
+        original(path, image, fmt)
+
+    monkeypatch.setattr(writer, '_write', slow_write)
+    results = [writer.save(_frame(), frame_idx=i) for i in range(5)]
+    # One job is being written, one waits in the queue, the rest are dropped
+    assert results.count(None) >= 3 and writer.snapshots_dropped == results.count(None)
+    release.set()
+    writer.close()
+    assert writer.files_written == 5 - results.count(None)
+    assert 'dropped' in writer.report()
+
+
+def test_autosave_crops_and_index(tmp_path):
+    frame = _frame()
+    mask = cv2.inRange(frame, (30, 150, 50), (50, 170, 70))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    dets = Detections.from_contours(contours)
+    dets.records['track_id'] = 3
+    with SnapshotWriter(str(tmp_path), fmt='npy') as writer:
+        assert writer.autosave(frame, mask, dets, frame_idx=12, min_area=10 ** 6) == 0
+        assert writer.autosave(frame, mask, dets, frame_idx=12, min_area=100, pad=4) == 1
+    with open(tmp_path / 'index.jsonl') as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 1
+    record = records[0]
+    assert record['frame'] == 12 and record['id'] == 3 and 'preset' not in record
+    assert record['rect'] == dets.rects[0].tolist() and record['crop'] == [46, 36, 68, 48]
+    crop = np.load(tmp_path / record['image'])
+    x, y, w, h = record['crop']
+    np.testing.assert_array_equal(crop, frame[y:y + h, x:x + w])
+    assert np.load(tmp_path / record['mask']).shape == (h, w)
+
+
+def test_failed_writes_are_counted(tmp_path, monkeypatch):
+    writer = SnapshotWriter(str(tmp_path))
+
+    def broken(path, image, fmt):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(writer, '_write', broken)
+    writer.save(_frame())
+    writer.close()
+    assert writer.failures == 1 and writer.files_written == 0
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        SnapshotWriter(str(tmp_path), fmt='gif')
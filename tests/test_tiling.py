@@ -0,0 +1,63 @@
+"""Tiled segmentation must stitch to exactly the untiled mask."""
+
+import functools
+
+import numpy as np
+import pytest
+
+from benchmark import SAMPLE_RANGES, make_leaf_scene
+from calibration import Calibration
+from detections import records_equal
+from main import detect_leaves, find_leaves, morph_reach, segment_leaves
+from segmentation import LUTSegmenter
+from tiling import TileSegmenter
+
+LOWER, UPPER = SAMPLE_RANGES[0]
+
+
+@pytest.mark.parametrize('lut', [False, True])
+@pytest.mark.parametrize('tiles', [1, 3, 8])
+def test_tiled_mask_matches_untiled(lut, tiles):
+    frame = make_leaf_scene(480, 360, n_leaves=30, seed=5)
+
+    def factory():
+        return functools.partial(segment_leaves, segmenter=LUTSegmenter() if lut else None)
+
+    expected = factory()(frame, LOWER, UPPER)
+    tiler = TileSegmenter(factory, tiles=tiles, workers=2, pad=morph_reach())
+    try:
+        mask = tiler.mask(frame, LOWER, UPPER)
+    finally:
+        tiler.close()
+    np.testing.assert_array_equal(mask, expected)
+    leaves, expected_leaves = find_leaves(mask, 500), find_leaves(expected, 500)
+    np.testing.assert_array_equal(leaves.rects, expected_leaves.rects)
+    np.testing.assert_array_equal(leaves.areas, expected_leaves.areas)
+    np.testing.assert_array_equal(leaves.centroids, expected_leaves.centroids)
+
+
+def test_tiled_preset_set_matches_untiled():
+    frame = make_leaf_scene(480, 360, n_leaves=30, seed=6)
+    ranges = SAMPLE_RANGES[:4]
+    expected = segment_leaves(frame, LOWER, UPPER, ranges=ranges)
+    tiler = TileSegmenter(lambda: segment_leaves, tiles=5, workers=2, pad=morph_reach())
+    try:
+        mask = tiler.mask(frame, LOWER, UPPER, ranges=ranges)
+    finally:
+        tiler.close()
+    np.testing.assert_array_equal(mask, expected)
+
+
+@pytest.mark.parametrize('calibrated', [False, True])
+def test_tiled_records_match_untiled(calibrated):
+    frame = make_leaf_scene(480, 360, n_leaves=30, seed=7)
+    # Without a calibration world / world_area are NaN, which records_equal treats as equal
+    calibration = Calibration((480, 360), np.diag([0.05, 0.05, 1.0])) if calibrated else None
+    _, expected = detect_leaves(frame, LOWER, UPPER, min_area=500, calibration=calibration)
+    tiler = TileSegmenter(lambda: segment_leaves, tiles=4, workers=2, pad=morph_reach())
+    try:
+        _, dets = detect_leaves(frame, LOWER, UPPER, min_area=500, tiler=tiler, calibration=calibration)
+    finally:
+        tiler.close()
+    assert len(dets) and np.isnan(dets.world).any() != calibrated
+    assert records_equal(dets.records, expected.records)
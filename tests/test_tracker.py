@@ -0,0 +1,73 @@
+"""LeafTracker keeps leaf IDs across frames, gaps and reordered detections."""
+
+import numpy as np
+import pytest
+
+from detections import Detections
+from tracker import LeafTracker, box_iou, linear_sum_assignment
+
+
+def _square(x, y, size=20):
+    x, y = int(round(x)), int(round(y))
+    return np.array([[[x, y]], [[x + size, y]], [[x + size, y + size]], [[x, y + size]]], dtype=np.int32)
+
+
+def _frame(positions):
+    return Detections.from_contours([_square(x, y) for x, y in positions])
+
+
+def _ids_by_x(dets):
+    order = np.argsort(dets.centroids[:, 0])
+    return dets.track_ids[order].tolist()
+
+
+ASSIGNMENTS = ['greedy'] + (['hungarian'] if linear_sum_assignment is not None else [])
+
+
+@pytest.mark.parametrize('assignment', ASSIGNMENTS)
+def test_ids_persist_while_leaves_move(assignment):
+    tracker = LeafTracker(max_distance=40, assignment=assignment)
+    first = None
+    for t in range(15):
+        positions = [(10 + 3 * t, 50), (200 - 2 * t, 80 + t), (400, 300)]
+        if t % 2:
+            # Detection order must not matter
+            positions = positions[::-1]
+        ids = _ids_by_x(tracker.update(_frame(positions)))
+        first = first or ids
+        assert ids == first
+    assert sorted(first) == [0, 1, 2] and len(tracker) == 3
+
+
+def test_gap_keeps_id_until_max_missed():
+    tracker = LeafTracker(max_distance=40, max_missed=3)
+    leaf = tracker.update(_frame([(100, 100)])).track_ids[0]
+    for _ in range(3):
+        tracker.update(Detections())
+    assert tracker.update(_frame([(102, 101)])).track_ids[0] == leaf
+    for _ in range(4):
+        tracker.update(Detections())
+    assert len(tracker) == 0
+    assert tracker.update(_frame([(102, 101)])).track_ids[0] != leaf
+
+
+def test_far_detection_starts_new_track():
+    tracker = LeafTracker(max_distance=30)
+    a = tracker.update(_frame([(100, 100)])).track_ids[0]
+    b = tracker.update(_frame([(300, 100)])).track_ids[0]
+    assert a != b and len(tracker) == 2
+
+
+def test_predict_extrapolates_velocity():
+    tracker = LeafTracker(max_distance=40)
+    for t in range(10):
+        tracked = tracker.update(_frame([(100 + 5 * t, 100)]))
+    predicted = tracker.predict()
+    assert predicted.track_ids.tolist() == tracked.track_ids.tolist()
+    assert predicted.centroids[0, 0] > tracked.centroids[0, 0] + 3
+
+
+def test_box_iou():
+    a = np.array([[0, 0, 10, 10]])
+    b = np.array([[0, 0, 10, 10], [5, 0, 10, 10], [20, 20, 5, 5]])
+    np.testing.assert_allclose(box_iou(a, b), [[1.0, 50 / 150, 0.0]])
@@ -0,0 +1,213 @@
+"""
+Multi-object leaf tracker: stable IDs across frames.
+
+Runs after detect_leaves and associates the new detections with the
+existing tracks:
+
+- cost matrix for all (track, detection) pairs at once: 1 - IoU of the
+  predicted and detected boxes plus the centroid distance / max_distance;
+  pairs further apart than max_distance are never matched
+- assignment: greedy (cheapest pairs first) or the Hungarian method from
+  scipy.optimize.linear_sum_assignment when scipy is installed
+- every track carries a constant-velocity Kalman filter on its centroid,
+  batched over all tracks as (N, 4) state / (N, 4, 4) covariance arrays
+- tracks not matched for max_missed frames are dropped, unmatched
+  detections start new tracks with a fresh ID
+
+Between detections predict() extrapolates the tracks one frame, so
+detection can run at a reduced rate (main.py --detect-every N) while the
+output keeps moving. The IDs end up in Detections.records['track_id'],
+so they are drawn by Detections.draw and exported by the detection sinks.
+
+Usage:
+    tracker = LeafTracker(max_distance=80)
+    tracked = tracker.update(detections)   # measured frame
+    tracked = tracker.predict()            # skipped frame, extrapolated
+"""
+
+import numpy as np
+
+from detections import DETECTION_DTYPE, Detections
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+ASSIGNMENTS = ('greedy', 'hungarian')
+
+# Constant velocity, one frame per step: [cx, cy, vx, vy]
+_F = np.array([[1, 0, 1, 0],
+               [0, 1, 0, 1],
+               [0, 0, 1, 0],
+               [0, 0, 0, 1]], dtype=np.float64)
+
+
+def box_iou(a, b):
+    # a: (N, 4), b: (M, 4) as x, y, w, h -> (N, M)
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    ix = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    iy = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    inter = np.clip(ix, 0, None) * np.clip(iy, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def greedy_assignment(cost, invalid):
+    # Cheapest valid pairs first, each row and column used at most once
+    rows, cols = np.nonzero(~invalid)
+    order = np.argsort(cost[rows, cols], kind='stable')
+    used_r = np.zeros(cost.shape[0], dtype=bool)
+    used_c = np.zeros(cost.shape[1], dtype=bool)
+    pairs = []
+    for r, c in zip(rows[order].tolist(), cols[order].tolist()):
+        if not used_r[r] and not used_c[c]:
+            used_r[r] = used_c[c] = True
+            pairs.append((r, c))
+    return pairs
+
+
+class LeafTracker:
+    """Associates Detections across frames and assigns persistent track IDs."""
+
+    def __init__(self, max_distance=80.0, max_missed=10, assignment='greedy',
+                 process_noise=1.0, measurement_noise=4.0):
+        if assignment not in ASSIGNMENTS:
+            raise ValueError(f'assignment must be one of {ASSIGNMENTS}, got {assignment!r}')
+        if assignment == 'hungarian' and linear_sum_assignment is None:
+            raise ImportError("assignment='hungarian' needs scipy (pip install scipy)")
+        self.max_distance = float(max_distance)
+        self.max_missed = max_missed
+        self.assignment = assignment
+        self.next_id = 0
+
+        q = process_noise
+        self._Q = np.diag([q, q, q * 0.5, q * 0.5])
+        self._R = np.eye(2) * measurement_noise
+
+        self.ids = np.empty(0, dtype=np.int64)
+        self.state = np.empty((0, 4))
+        self.cov = np.empty((0, 4, 4))
+        self.size = np.empty((0, 2))
+        self.area = np.empty(0)
+        self.missed = np.empty(0, dtype=np.int64)
+        # Per track: (Detections, row) it was last seen in, for its contour
+        self._sources = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _predict(self):
+        self.state = self.state @ _F.T
+        self.cov = np.einsum('ij,njk,lk->nil', _F, self.cov, _F) + self._Q
+
+    def _boxes(self):
+        xy = self.state[:, :2] - self.size / 2.0
+        return np.concatenate([xy, self.size], axis=1)
+
+    def _match(self, detections):
+        n, m = len(self.ids), len(detections)
+        if not n or not m:
+            return []
+        centroids = detections.centroids.astype(np.float64)
+        dist = np.linalg.norm(self.state[:, None, :2] - centroids[None, :, :], axis=2)
+        cost = (1.0 - box_iou(self._boxes(), detections.rects)) + dist / self.max_distance
+        invalid = dist > self.max_distance
+        if self.assignment == 'hungarian':
+            rows, cols = linear_sum_assignment(np.where(invalid, 1e6, cost))
+            return [(r, c) for r, c in zip(rows.tolist(), cols.tolist()) if not invalid[r, c]]
+        return greedy_assignment(cost, invalid)
+
+    def update(self, detections):
+        """Associate one frame of detections; returns them with records['track_id'] set."""
+        self._predict()
+        pairs = self._match(detections)
+        m = len(detections)
+        track_ids = np.full(m, -1, dtype=np.int64)
+        matched = np.zeros(len(self.ids), dtype=bool)
+
+        if pairs:
+            t, d = (np.array(v, dtype=np.int64) for v in zip(*pairs))
+            # Kalman measurement update of the centroid, batched over the matched tracks
+            z = detections.centroids[d].astype(np.float64)
+            P = self.cov[t]
+            S = P[:, :2, :2] + self._R
+            K = P[:, :, :2] @ np.linalg.inv(S)
+            innovation = z - self.state[t, :2]
+            self.state[t] += np.einsum('nij,nj->ni', K, innovation)
+            self.cov[t] = P - K @ P[:, :2, :]
+            self.size[t] = detections.rects[d, 2:]
+            self.area[t] = detections.areas[d]
+            self.missed[t] = 0
+            matched[t] = True
+            track_ids[d] = self.ids[t]
+            for ti, di in zip(t.tolist(), d.tolist()):
+                self._sources[ti] = (detections, di)
+
+        self.missed[~matched] += 1
+
+        # Unmatched detections start new tracks
+        new = np.flatnonzero(track_ids < 0)
+        if len(new):
+            new_ids = np.arange(self.next_id, self.next_id + len(new))
+            self.next_id += len(new)
+            track_ids[new] = new_ids
+            state = np.zeros((len(new), 4))
+            state[:, :2] = detections.centroids[new]
+            cov = np.tile(np.diag([10.0, 10.0, 100.0, 100.0]), (len(new), 1, 1))
+            self.ids = np.concatenate([self.ids, new_ids])
+            self.state = np.concatenate([self.state, state])
+            self.cov = np.concatenate([self.cov, cov])
+            self.size = np.concatenate([self.size, detections.rects[new, 2:].astype(np.float64)])
+            self.area = np.concatenate([self.area, detections.areas[new]])
+            self.missed = np.concatenate([self.missed, np.zeros(len(new), dtype=np.int64)])
+            self._sources.extend((detections, i) for i in new.tolist())
+
+        keep = self.missed <= self.max_missed
+        if not keep.all():
+            self._keep(keep)
+
+        records = detections.records.copy()
+        records['track_id'] = track_ids
+        return Detections(records, detections.points, detections.labels)
+
+    def _keep(self, keep):
+        self.ids = self.ids[keep]
+        self.state = self.state[keep]
+        self.cov = self.cov[keep]
+        self.size = self.size[keep]
+        self.area = self.area[keep]
+        self.missed = self.missed[keep]
+        self._sources = [s for s, k in zip(self._sources, keep.tolist()) if k]
+
+    def predict(self):
+        """Advance all tracks one frame without a measurement; returns the live tracks as Detections."""
+        self._predict()
+        live = np.flatnonzero(self.missed == 0)
+        records = np.empty(len(live), dtype=DETECTION_DTYPE)
+        if not len(live):
+            return Detections(records)
+        centroids = self.state[live, :2]
+        size = self.size[live]
+        records['rect'][:, :2] = np.round(centroids - size / 2.0)
+        records['rect'][:, 2:] = size
+        records['area'] = self.area[live]
+        records['centroid'] = centroids
+        records['label'] = -1
+        records['track_id'] = self.ids[live]
+        # Moved boxes: world positions are located again by the caller
+        records['world'] = np.nan
+        records['world_area'] = np.nan
+
+        # Last seen contour (and preset) of each track, shifted along with its box
+        chunks = []
+        for row, i in enumerate(live.tolist()):
+            dets, j = self._sources[i]
+            records['preset'][row] = dets.presets[j]
+            shift = np.round(centroids[row] - dets.centroids[j]).astype(np.int32)
+            chunks.append(dets.contour(j).reshape(-1, 2) + shift)
+        lengths = np.array([len(c) for c in chunks], dtype=np.int64)
+        records['end'] = np.cumsum(lengths)
+        records['start'] = records['end'] - lengths
+        return Detections(records, np.concatenate(chunks).astype(np.int32))
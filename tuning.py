@@ -0,0 +1,147 @@
+"""
+Incremental HSV thresholding for interactive tuning on a paused frame.
+
+While tuning, the frame stays the same and only one trackbar moves at a
+time, yet detect_leaf redid cvtColor(BGR2HSV) + a 3-channel inRange on
+every call. ThresholdCache keeps, per frame:
+
+- the HSV image (converted once)
+- per-channel histograms, so a bound move that no pixel crosses is a no-op
+  (e.g. dragging H_low through hues that do not occur in the frame)
+- one mask per channel and the AND of the other two channels, so moving a
+  single trackbar costs one single-channel inRange + one bitwise_and
+  instead of a full conversion + threshold
+
+H_low > H_high is a hue range wrapping around 179 -> 0 (see
+segmentation.range_mask); the hue channel mask is then the OR of
+[H_low, 179] and [0, H_high], and the histogram counts flipped pixels with
+the same wrapped membership.
+
+A new frame (a different array object) falls back to one plain
+inRange on its HSV image; the per-channel state is only built once the same
+frame is thresholded again with different bounds, so playing video pays
+nothing extra.
+
+The returned mask is owned by the cache and overwritten by the next call;
+copy it to keep it.
+
+Usage:
+    tuner = ThresholdCache()
+    mask = tuner.mask(frame, lower, upper)   # cached / incremental
+    if tuner.version != shown:               # redraw only when the mask actually changed
+        shown = tuner.version
+"""
+
+import cv2
+import numpy as np
+
+from segmentation import range_mask
+
+_VALUES = np.arange(256)
+
+
+def _inside(c, lo, hi):
+    # Channel values (0..255) inside [lo, hi]; only hue (c == 0) wraps when lo > hi
+    if lo <= hi:
+        return (_VALUES >= lo) & (_VALUES <= hi)
+    if c == 0:
+        return (_VALUES >= lo) | (_VALUES <= hi)
+    return np.zeros(256, dtype=bool)
+
+
+class ThresholdCache:
+    """Per-frame HSV / per-channel mask cache for repeated thresholding of one frame."""
+
+    def __init__(self):
+        self._frame = None
+        self._hsv = None
+        self._channels = None
+        self._hists = None
+        self._chan_masks = [None, None, None]
+        self._rest = None
+        self._rest_channel = None
+        self._bounds = None
+        self._mask = None
+        # Bumped whenever the returned mask changes
+        self.version = 0
+        self.full_updates = 0
+        self.incremental_updates = 0
+        self.skipped_updates = 0
+
+    def set_frame(self, frame):
+        """Cache the HSV image of `frame`; returns False if it is the frame already cached."""
+        if frame is self._frame:
+            return False
+        self._frame = frame
+        self._hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        self._channels = None
+        self._hists = None
+        self._chan_masks = [None, None, None]
+        self._rest = None
+        self._rest_channel = None
+        self._bounds = None
+        return True
+
+    def hsv(self, frame):
+        self.set_frame(frame)
+        return self._hsv
+
+    def _split(self):
+        if self._channels is None:
+            self._channels = cv2.split(self._hsv)
+            self._hists = [cv2.calcHist([ch], [0], None, [256], [0, 256]).ravel().astype(np.int64)
+                           for ch in self._channels]
+
+    def _affected(self, c, old, new):
+        # Pixels whose class flips: values in exactly one of the old and new ranges
+        return int(self._hists[c][_inside(c, *old) ^ _inside(c, *new)].sum())
+
+    def _channel_mask(self, c, lo, hi, dst=None):
+        if c == 0 and lo > hi:
+            # Wrapped hue: [lo, 179] | [0, hi] (two single-channel inRange beat a cv2.LUT here)
+            upper = cv2.inRange(self._channels[c], lo, 179, dst=dst)
+            return cv2.bitwise_or(upper, cv2.inRange(self._channels[c], 0, hi), dst=upper)
+        return cv2.inRange(self._channels[c], lo, hi, dst=dst)
+
+    def mask(self, frame, lower, upper):
+        lower = np.asarray(lower, dtype=np.uint8)
+        upper = np.asarray(upper, dtype=np.uint8)
+        bounds = tuple(zip(lower.tolist(), upper.tolist()))
+        new_frame = self.set_frame(frame)
+        old = self._bounds
+
+        if not new_frame and bounds == old:
+            return self._mask
+        self._bounds = bounds
+        if old is None:
+            # First threshold of this frame: one pass, no per-channel state yet
+            self._mask = range_mask(self._hsv, lower, upper)
+            self.full_updates += 1
+            self.version += 1
+            return self._mask
+
+        self._split()
+        moved = [c for c in range(3) if bounds[c] != old[c] and self._affected(c, old[c], bounds[c])]
+        if not moved:
+            self.skipped_updates += 1
+            return self._mask
+
+        masks = self._chan_masks
+        for c in range(3):
+            if masks[c] is None or c in moved:
+                masks[c] = self._channel_mask(c, *bounds[c], dst=masks[c])
+
+        if len(moved) == 1:
+            c = moved[0]
+            if self._rest_channel != c:
+                a, b = [k for k in range(3) if k != c]
+                self._rest = cv2.bitwise_and(masks[a], masks[b], dst=self._rest)
+                self._rest_channel = c
+            cv2.bitwise_and(masks[c], self._rest, dst=self._mask)
+        else:
+            cv2.bitwise_and(masks[0], masks[1], dst=self._mask)
+            cv2.bitwise_and(self._mask, masks[2], dst=self._mask)
+            self._rest_channel = None
+        self.incremental_updates += 1
+        self.version += 1
+        return self._mask